@@ -0,0 +1,226 @@
+"""
+Offline benchmark. Runs main end to end against the local stand-in site and a local database
+for every combination of scenario params and reports throughput and peak memory.
+
+    python -m bench.run --fz 44 --num-proc 1 2 4 --queries 10 50 --results 100 --latency 0.05
+    python -m bench.run --fz 223 --engine browser http --enrich-engine browser http --mode kw okpd
+"""
+import sys
+import json
+import time
+import argparse
+import itertools
+import tempfile
+import threading
+import configparser
+import multiprocessing as mp
+from pathlib import Path
+from datetime import datetime
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import main as rts_main
+from db.backends import SQLiteBackend
+from bench.site import SiteSettings, StandInSite, _number, leaf_codes
+
+
+class PeakMemory:
+    """Peak resident memory of the process and its children, polled in background"""
+    def __init__(self, interval=0.2):
+        self.interval = interval
+        self.peak = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _rss(self):
+        try:
+            import psutil
+        except ImportError:
+            return None
+        proc = psutil.Process()
+        total = proc.memory_info().rss
+        for child in proc.children(recursive=True):
+            try:
+                total += child.memory_info().rss
+            except psutil.Error:
+                pass
+        return total
+
+    def _poll(self):
+        while not self._stop.is_set():
+            if (rss := self._rss()) is not None:
+                self.peak = max(self.peak or 0, rss)
+            self._stop.wait(self.interval)
+
+    def __enter__(self):
+        self._thread = threading.Thread(target=self._poll, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        if self.peak is None:
+            # no psutil, fall back to the peak the os reports
+            try:
+                import resource
+                self.peak = (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss +
+                             resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss) * 1024
+            except ImportError:
+                pass
+
+
+def write_conf(work_dir: Path, site_url, fz, shared, engine='http', enrich_engine='http', driver_cache_dir=None):
+    """
+    Config of a scenario, every path points into its work folder
+    driver_cache_dir: chromedriver cache kept between scenarios, default one of the config otherwise
+    """
+    db_path = work_dir / 'db.sqlite'
+    # numbers shared by all queries play the ones already imported
+    backend = SQLiteBackend(str(db_path))
+    backend.add([_number(0, i, fz) for i in range(shared)], fz)
+    backend.close()
+
+    conf = configparser.ConfigParser()
+    conf['data'] = {
+        'input_folder_keyword': str(work_dir / 'kw'),
+        'input_folder_okpd': str(work_dir / 'okpd'),
+        'output_folder': str(work_dir / 'out'),
+        'task_history_path': str(work_dir / 'cache' / 'task_history.json'),
+        'run_journal_dir': str(work_dir / 'cache' / 'runs'),
+        'okpd_index_path': str(work_dir / 'cache' / 'okpd_index.json'),
+    }
+    conf['logging'] = {
+        'log_path': str(work_dir / 'log'),
+        'report_dir': str(work_dir / 'reports'),
+    }
+    conf['runtime'] = {
+        'search_interval_days': '1',
+        'kw_search_policy': 'any',
+        'num_proc': '1',
+        'num_proc_enrich': '2',
+        'output_batch_size': '500',
+        'engine': engine,
+        'enrich_engine': enrich_engine,
+        'website_url': site_url,
+        'html_parser': 'lxml',
+    }
+    conf['database'] = {'backend': 'sqlite', 'path': str(db_path)}
+    if driver_cache_dir is not None:
+        conf['browser'] = {'driver_cache_dir': driver_cache_dir}
+
+    conf_path = work_dir / 'conf.ini'
+    with open(conf_path, 'w', encoding='utf-8') as f:
+        conf.write(f)
+    return conf_path
+
+
+def write_input(work_dir: Path, queries, mode='kw'):
+    """
+    Keywords or codes of the synthetic okpd tree, one query per line
+    return: number of queries written
+    """
+    (work_dir / 'kw').mkdir(parents=True, exist_ok=True)
+    (work_dir / 'okpd').mkdir(parents=True, exist_ok=True)
+    if mode == 'kw':
+        lines = [f'запрос {i}' for i in range(queries)]
+    else:
+        # leaf codes, so none of them is dropped under a parent code
+        lines = leaf_codes()[:queries]
+    with open(work_dir / mode / 'queries.txt', 'w', encoding='utf-8') as f:
+        f.write('\n'.join(lines))
+    return len(lines)
+
+
+def run_scenario(site, fz, num_proc, queries, engine='http', enrich_engine='http', mode='kw', driver_cache_dir=None):
+    settings = site.settings
+    with tempfile.TemporaryDirectory() as tmp:
+        work_dir = Path(tmp)
+        queries = write_input(work_dir, queries, mode)
+        conf_path = write_conf(work_dir, site.url, fz, int(settings.results * settings.overlap), 
+                               engine, enrich_engine, driver_cache_dir)
+
+        requests_before = settings.requests
+        started = time.perf_counter()
+        with PeakMemory() as memory:
+            rts_main.main(['--fz', fz, '--mode', mode, '--num-proc', str(num_proc), '--config', str(conf_path)])
+        duration = time.perf_counter() - started
+
+        report_path = max((work_dir / 'reports').glob('report_*.json'), key=lambda path: path.stat().st_mtime)
+        with open(report_path, encoding='utf-8') as f:
+            stages = json.load(f)['stages']
+        output_lines = sum(len(path.read_text().splitlines()) for path in (work_dir / 'out').glob('*.txt'))
+
+    pages = stages.get('collect_page', {})
+    return {
+        'fz': fz,
+        'engine': engine,
+        'enrich_engine': enrich_engine if fz == '223' else None,
+        'mode': mode,
+        'num_proc': num_proc,
+        'queries': queries,
+        'results_per_query': settings.results,
+        'latency': settings.latency,
+        'seconds': round(duration, 2),
+        'queries_per_min': round(queries / duration * 60, 1),
+        'pages_per_sec': round(pages.get('count', 0) / duration, 2),
+        'numbers_per_sec': round(pages.get('items', 0) / duration, 1),
+        'new_numbers': output_lines,
+        'site_requests': settings.requests - requests_before,
+        'peak_memory_mb': round(memory.peak / 2 ** 20, 1) if memory.peak else None,
+        'stages': stages,
+    }
+
+
+def get_args(argv):
+    ap = argparse.ArgumentParser()
+    ap.add_argument('--fz', nargs='+', default=['44'], choices=['44', '223'])
+    ap.add_argument('--engine', nargs='+', default=['http'], choices=['browser', 'http'])
+    ap.add_argument('--enrich-engine', nargs='+', default=['http'], choices=['browser', 'http'],
+                    help='How 223 numbers are enriched, not used for 44')
+    ap.add_argument('--mode', nargs='+', default=['kw'], choices=['kw', 'okpd'])
+    ap.add_argument('--num-proc', nargs='+', type=int, default=[1, 2, 4])
+    ap.add_argument('--queries', nargs='+', type=int, default=[10, 50])
+    ap.add_argument('--results', type=int, default=100, help='Notifications found by every query')
+    ap.add_argument('--latency', type=float, default=0.05, help='Seconds added to every response')
+    ap.add_argument('--overlap', type=float, default=0.2,
+                    help='Share of numbers common to all queries, they are also treated as imported')
+    ap.add_argument('--record-dir', default=None, help='Folder with recorded pages served by path')
+    ap.add_argument('--driver-cache-dir', default=None, help='Chromedriver cache kept between scenarios')
+    ap.add_argument('--output', default=None, help='JSON file with results of all scenarios')
+    return ap.parse_args(argv)
+
+
+def main(argv):
+    ap = get_args(argv)
+    site = StandInSite(SiteSettings(ap.results, ap.latency, ap.overlap, ap.record_dir)).start()
+    results = []
+    try:
+        for fz in ap.fz:
+            scenarios = itertools.product(ap.engine, ap.enrich_engine if fz == '223' else ap.enrich_engine[:1], 
+                                          ap.mode, ap.queries, ap.num_proc)
+            for engine, enrich_engine, mode, queries, num_proc in scenarios:
+                print(f'Сценарий: ФЗ{fz}, поиск {engine}, режим {mode}, {queries} запросов, {num_proc} процессов' + 
+                      (f', закупки {enrich_engine}' if fz == '223' else ''))
+                results.append(run_scenario(site, fz, num_proc, queries, engine, enrich_engine, mode, 
+                                            ap.driver_cache_dir))
+    finally:
+        site.stop()
+
+    print()
+    print(f'{"fz":>4} {"engine":>8} {"enrich":>8} {"mode":>5} {"proc":>5} {"queries":>8} {"sec":>8} {"q/min":>8} '
+          f'{"pages/s":>8} {"nums/s":>8} {"peak MB":>8}')
+    for res in results:
+        print(f'{res["fz"]:>4} {res["engine"]:>8} {str(res["enrich_engine"] or "-"):>8} {res["mode"]:>5} '
+              f'{res["num_proc"]:>5} {res["queries"]:>8} {res["seconds"]:>8} '
+              f'{res["queries_per_min"]:>8} {res["pages_per_sec"]:>8} {res["numbers_per_sec"]:>8} '
+              f'{str(res["peak_memory_mb"]):>8}')
+
+    output = ap.output or f'bench_{datetime.now().strftime("%d_%m_%Y_%H_%M_%S")}.json'
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump(results, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == '__main__':
+    mp.freeze_support()
+    main(sys.argv[1:])
@@ -0,0 +1,344 @@
+import time
+import json
+import hashlib
+import threading
+from string import Template
+from pathlib import Path
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qsl, quote, urlencode
+
+from parser.collector import RES_PER_PAGE, PAGE_PARAM
+from parser.http_engine import SEARCH_PATH, QUERY_FIELDS, REGULATION_VALUES
+
+
+_PAGE_TEMPLATE = """<html><body>
+<div id="Notifications" class="main-tabs__item"><div class="main-tabs__count"><span>{count}</span></div></div>
+<div id="content">{cards}</div>
+<ul id="pager">{pager}</ul>
+</body></html>"""
+
+_CARD_TEMPLATE = """<div class="card-item"><div class="card-item__about"><a href="{href}">Извещение № {num}</a></div></div>"""
+
+_ZAKUPKI_TEMPLATE = """<html><body><div class="search-results">
+<div class="registry-entry__header-top__icon"><a href="/epz/order/notice/printForm/view.html?pfid={pfid}">print</a></div>
+</div></body></html>"""
+
+
+# filter modal with the classes and behaviour fill relies on: collapsed sections, show more and
+# clear all links, checkbox grids, date pickers, keyword tags, okpd tree and code searchbox.
+# Search goes to the results url built from the filled params
+_FILTER_TEMPLATE = Template("""<html><head><style>
+.modal-settings-section.collapsed .modal-settings-body { display: none; }
+.grid-column-4-1.more { display: none; }
+.modal-settings-section.expanded .grid-column-4-1.more { display: block; }
+.settings-tree li > ul { display: none; }
+.settings-tree li.settings-tree--show > ul { display: block; }
+.cstm-search__suggest, .modal-settings-row a, .title-collapse { cursor: pointer; }
+</style></head><body>
+<div class="consultation_modal" style="display: none"><div class="modal-close"></div></div>
+<div class="modal-settings">
+<div class="modal-settings-search"><div class="main-search__controls"><span class="main-search__tags"></span><input type="text"></div></div>
+<div class="modal-settings-filter__main">
+<div class="modal-settings-section">
+  <div class="filter-title"><div class="title-collapse title-collapse--more">Быстрые настройки</div></div>
+  <div class="modal-settings-body">
+    <div class="modal-settings-row"><div class="grid-row">
+      <div class="grid-column-4-1"><input type="checkbox" id="qs1" data-field="$in_files" value="true"><label for="qs1">Искать в файлах</label></div>
+      <div class="grid-column-4-1"><input type="checkbox" id="qs2" data-field="$exact" value="true"><label for="qs2">Точное соответствие</label></div>
+    </div></div>
+    <div class="modal-settings-row filter-helpers"><a>Снять всё</a></div>
+  </div>
+</div>
+<div class="modal-settings-section">
+  <div class="filter-title"><div class="title-collapse title-collapse--more">Правило проведения</div></div>
+  <div class="modal-settings-body">
+    <div class="modal-settings-row"><div class="grid-row">$regulation
+      <div class="grid-column-4-1 more"><input type="checkbox" id="rg0" data-field="$regulation_field" value="commercial"><label for="rg0">Коммерческие закупки</label></div>
+    </div></div>
+    <div class="modal-settings-row"><a class="show-more">Показать еще</a></div>
+    <div class="modal-settings-row filter-helpers"><a>Снять всё</a></div>
+  </div>
+</div>
+<div class="modal-settings-section collapsed">
+  <div class="filter-title"><div class="title-collapse title-collapse--less">Фильтры по датам</div></div>
+  <div class="modal-settings-body">
+    <div class="modal-settings-row"><div class="grid-row">
+      <div class="grid-column-2"><div class="form-group__title">Опубликовано</div><input class="datepicker" type="text" data-field="$publish_from"><input class="datepicker" type="text" data-field="$publish_to"></div>
+      <div class="grid-column-2"><div class="form-group__title">Окончание подачи заявок</div><input class="datepicker" type="text"><input class="datepicker" type="text"></div>
+    </div></div>
+  </div>
+</div>
+<div class="modal-settings-section collapsed">
+  <div class="filter-title"><div class="title-collapse title-collapse--less">ОКПД2</div></div>
+  <div class="modal-settings-body">
+    <div class="modal-settings-row"><div class="form-control-search"><input type="text"><button type="button" class="cstm-button-clear">x</button><div class="cstm-search__autocomplite"></div></div></div>
+    <div class="settings-tree"><ul>$tree</ul></div>
+  </div>
+</div>
+</div>
+<div class="bottomCenterSearch"><button type="button">Найти</button></div>
+</div>
+<script>
+var fields = $fields, searchPath = '/$search_path', textCodes = [];
+function sectionOf(el) { return el.closest('.modal-settings-section'); }
+document.querySelectorAll('.title-collapse').forEach(function(title) {
+    title.addEventListener('click', function() {
+        var collapsed = title.classList.contains('title-collapse--less');
+        title.classList.toggle('title-collapse--less', !collapsed);
+        title.classList.toggle('title-collapse--more', collapsed);
+        sectionOf(title).classList.toggle('collapsed', !collapsed);
+    });
+});
+document.querySelectorAll('.modal-settings-row a').forEach(function(a) {
+    a.addEventListener('click', function(e) {
+        e.preventDefault();
+        var section = sectionOf(a);
+        if (a.classList.contains('show-more')) {
+            section.classList.add('expanded');
+            a.textContent = 'Скрыть';
+        } else {
+            section.querySelectorAll('input[type=checkbox]').forEach(function(input) { input.checked = false; });
+        }
+    });
+});
+document.querySelectorAll('.settings-tree button').forEach(function(button) {
+    button.addEventListener('click', function() { button.closest('li').classList.toggle('settings-tree--show'); });
+});
+var tags = document.querySelector('.main-search__tags');
+var keywordInput = document.querySelector('.main-search__controls input');
+keywordInput.addEventListener('keydown', function(e) {
+    if (e.key !== 'Enter' || !keywordInput.value.trim()) return;
+    var tag = document.createElement('span');
+    tag.className = 'main-search__tag';
+    tag.textContent = keywordInput.value.trim();
+    var remove = document.createElement('i');
+    remove.className = 'main-search__tag-remove';
+    remove.addEventListener('click', function() { tag.remove(); });
+    tag.appendChild(remove);
+    tags.appendChild(tag);
+    keywordInput.value = '';
+});
+var codeSearch = document.querySelector('.form-control-search');
+var codeInput = codeSearch.querySelector('input');
+var autocomplete = codeSearch.querySelector('.cstm-search__autocomplite');
+codeSearch.querySelector('.cstm-button-clear').addEventListener('click', function() {
+    codeInput.value = '';
+    autocomplete.innerHTML = '';
+});
+codeInput.addEventListener('input', function() {
+    var code = codeInput.value.trim();
+    autocomplete.innerHTML = code ? '<div class="cstm-search__suggest"><b></b></div>' : '';
+    if (!code) return;
+    var suggest = autocomplete.querySelector('.cstm-search__suggest');
+    suggest.querySelector('b').textContent = code;
+    suggest.addEventListener('click', function() {
+        if (textCodes.indexOf(code) === -1) textCodes.push(code);
+    });
+});
+document.querySelector('.bottomCenterSearch button').addEventListener('click', function() {
+    var query = new URLSearchParams();
+    tags.querySelectorAll('.main-search__tag').forEach(function(tag) { query.append(fields.keywords, tag.textContent); });
+    document.querySelectorAll('.grid-column-4-1 input:checked').forEach(function(input) {
+        query.append(input.dataset.field, input.value);
+    });
+    document.querySelectorAll('.settings-tree input:checked').forEach(function(input) {
+        query.append(fields.okpd, input.value);
+    });
+    textCodes.forEach(function(code) { query.append(fields.okpd, code); });
+    document.querySelectorAll('input.datepicker').forEach(function(input) {
+        if (input.dataset.field && input.value) query.append(input.dataset.field, input.value.replace(/-/g, '.'));
+    });
+    window.location.href = searchPath + '?' + query.toString();
+});
+</script>
+</body></html>""")
+
+_TREE_SECTIONS = ['A', 'B', 'C']
+_TREE_WIDTH = 3     # children of every node below a section
+
+
+def okpd_codes():
+    """
+    Codes of the synthetic okpd tree, sections first, parents before their children
+    return: List[Tuple[str, int]] of (code, depth)
+    """
+    codes = []
+
+    def walk(code, depth):
+        codes.append((code, depth))
+        if depth == 4:
+            return
+        for i in range(1, _TREE_WIDTH + 1):
+            if depth == 0:
+                child = f'{_TREE_SECTIONS.index(code) * _TREE_WIDTH + i:02d}'
+            elif depth == 1:
+                child = f'{code}.{i}'
+            else:
+                child = f'{code}{i}' if depth == 2 else f'{code}.{i}'
+            walk(child, depth + 1)
+
+    for section in _TREE_SECTIONS:
+        walk(section, 0)
+    return codes
+
+
+def leaf_codes():
+    """Deepest codes of the synthetic tree, none of them is a parent of another"""
+    return [code for (code, depth) in okpd_codes() if depth == 4]
+
+
+def _tree_html():
+    html, depth_prev = [], None
+    codes = okpd_codes()
+    for k, (code, depth) in enumerate(codes):
+        has_children = k + 1 < len(codes) and codes[k + 1][1] > depth
+        button = '<button type="button"></button>' if has_children else ''
+        html.append(f'<li>{button}<label><input type="checkbox" value="{code}"><b>{code}</b> Код {code}</label>')
+        if has_children:
+            html.append('<ul>')
+            continue
+        html.append('</li>')
+        # close finished parents
+        next_depth = codes[k + 1][1] if k + 1 < len(codes) else 0
+        html.append('</ul></li>' * (depth - next_depth))
+    return ''.join(html)
+
+
+def filter_page():
+    regulation = ''.join(
+        f'<div class="grid-column-4-1"><input type="checkbox" id="rg{value}" data-field="{QUERY_FIELDS["regulation"]}" '
+        f'value="{value}"><label for="rg{value}">{option.upper()}</label></div>'
+        for (option, value) in REGULATION_VALUES.items())
+    return _FILTER_TEMPLATE.substitute(
+        regulation=regulation, 
+        regulation_field=QUERY_FIELDS['regulation'], 
+        in_files=QUERY_FIELDS['in_files'], 
+        exact=QUERY_FIELDS['exact'], 
+        publish_from=QUERY_FIELDS['publish_from'], 
+        publish_to=QUERY_FIELDS['publish_to'], 
+        tree=_tree_html(), 
+        fields=json.dumps(QUERY_FIELDS), 
+        search_path=SEARCH_PATH)
+
+
+class SiteSettings:
+    """
+    Shape of the stand-in site
+    results: notifications found by every query
+    latency: seconds added to every response
+    overlap: share of numbers every query has in common with other queries
+    record_dir: optional folder with recorded pages served by path, they are served instead of the synthetic
+        filter modal and okpd tree
+    """
+    def __init__(self, results=100, latency=0.0, overlap=0.0, record_dir=None):
+        self.results = results
+        self.latency = latency
+        self.overlap = overlap
+        self.record_dir = Path(record_dir) if record_dir is not None else None
+        self.requests = 0
+        self._lock = threading.Lock()
+
+    def hit(self):
+        with self._lock:
+            self.requests += 1
+
+
+def _query_seed(query):
+    """Numbers of a query depend on its search params only, page and sorting are left out"""
+    params = sorted((k, v) for (k, v) in query if k not in (PAGE_PARAM, QUERY_FIELDS['sort']))
+    return int(hashlib.md5(repr(params).encode()).hexdigest()[:10], 16)
+
+
+def _number(seed, i, fz):
+    if fz == '223':
+        return '3' + f'{(seed + i) % 10 ** 10:010d}'
+    return f'{(seed + i) % 10 ** 18:019d}'
+
+
+def query_numbers(query, settings: SiteSettings):
+    fz = dict(query).get(QUERY_FIELDS['regulation'], '44')
+    shared = int(settings.results * settings.overlap)
+    seed = _query_seed(query)
+    # shared numbers are the same for all queries of the law
+    return [_number(0, i, fz) for i in range(shared)] + \
+        [_number(seed, i, fz) for i in range(settings.results - shared)]
+
+
+def make_handler(settings: SiteSettings):
+
+    class StandInHandler(BaseHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+        def _send(self, body, status=200, headers=None):
+            body = body.encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', 'text/html; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            for key, value in (headers or {}).items():
+                self.send_header(key, value)
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            settings.hit()
+            if settings.latency:
+                time.sleep(settings.latency)
+
+            url = urlparse(self.path)
+            query = parse_qsl(url.query, keep_blank_values=True)
+
+            if settings.record_dir is not None:
+                recorded = settings.record_dir / url.path.strip('/')
+                if recorded.is_file():
+                    return self._send(recorded.read_text(encoding='utf-8'))
+
+            if url.path.strip('/') == SEARCH_PATH and dict(query).get('isFilter') == '1':
+                return self._send(filter_page())
+            if url.path.strip('/') == SEARCH_PATH:
+                return self._send(self.results_page(query))
+            if url.path.startswith('/card/'):
+                num = url.path.rsplit('/', 1)[1]
+                return self._send('', 302, {'Location': f'/zakupki/epz/order/notice/search?noticeInfoId={num[-8:]}'})
+            if url.path.startswith('/zakupki/'):
+                return self._send(_ZAKUPKI_TEMPLATE.format(pfid=dict(query).get('noticeInfoId', '0')))
+            return self._send('<html><body></body></html>')
+
+        def results_page(self, query):
+            nums = query_numbers(query, settings)
+            page = int(dict(query).get(PAGE_PARAM, 1))
+            base = f'http://{self.headers["Host"]}'
+            page_nums = nums[(page - 1) * RES_PER_PAGE:page * RES_PER_PAGE]
+            cards = ''.join(_CARD_TEMPLATE.format(href=f'{base}/card/{quote(num)}', num=num) for num in page_nums)
+            pages = -(-len(nums) // RES_PER_PAGE)
+            pager = ''.join(f'<li><a class="page-link" href="{self._page_href(query, i)}">{i}</a></li>' 
+                            for i in range(1, pages + 1))
+            return _PAGE_TEMPLATE.format(count=len(nums), cards=cards, pager=pager)
+
+        def _page_href(self, query, page):
+            return '?' + urlencode([(k, v) for (k, v) in query if k != PAGE_PARAM] + [(PAGE_PARAM, page)])
+
+    return StandInHandler
+
+
+class StandInSite:
+    """Local stand-in of rts-tender and zakupki served from a background thread"""
+    def __init__(self, settings: SiteSettings, host='127.0.0.1', port=0):
+        self.settings = settings
+        self.server = ThreadingHTTPServer((host, port), make_handler(settings))
+        self.server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self.server.server_address[:2]
+        return f'http://{host}:{port}/'
+
+    def start(self):
+        self._thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
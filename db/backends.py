@@ -0,0 +1,119 @@
+import sqlite3
+from abc import ABC, abstractmethod
+from typing import Dict, Iterable, List, Set
+
+
+class DedupBackend(ABC):
+    """Storage of already imported notifications"""
+
+    @abstractmethod
+    def unknown_numbers(self, nums: List[str], fz: str) -> Set[str]:
+        """Numbers which are not imported yet. Input numbers are distinct"""
+
+    def close(self):
+        pass
+
+
+class SQLServerBackend(DedupBackend):
+    def __init__(self, address, database, username, password):
+        import pyodbc
+
+        conn_string = \
+            f'DRIVER={{ODBC Driver 18 for SQL Server}};SERVER={address};DATABASE={database};UID={username};PWD={password};Encrypt=no'
+        self.conn = pyodbc.connect(conn_string)
+
+    def unknown_numbers(self, nums, fz):
+        query1 = \
+"""
+IF (OBJECT_ID('tempdb..#RTSTempCollected') IS NOT NULL)
+	DROP TABLE #RTSTempCollected
+
+CREATE TABLE #RTSTempCollected (notifnr varchar(50))
+"""
+        query2 = \
+"""
+INSERT INTO #RTSTempCollected (notifnr)
+VALUES (?)
+"""
+        query3 = \
+f"""
+SELECT t.notifnr
+FROM #RTSTempCollected t
+LEFT JOIN [cursorimport].import.notifications{'223' if fz == '223' else '44'} n
+    ON t.notifnr = n.notificationnumber
+WHERE n.id_Notification is NULL
+"""
+
+        cursor = self.conn.cursor()
+        cursor.execute(query1)
+
+        # parameters are sent as arrays in bulk instead of one statement per row
+        cursor.fast_executemany = True
+        cursor.executemany(query2, [(num, ) for num in nums])
+
+        cursor.execute(query3)
+        unknown = {num[0] for num in cursor.fetchall()}
+        cursor.close()
+
+        return unknown
+
+    def close(self):
+        self.conn.close()
+
+
+class SQLiteBackend(DedupBackend):
+    """Same tables as import database, for local runs and benchmarks"""
+
+    def __init__(self, path=':memory:'):
+        self.conn = sqlite3.connect(path)
+        for fz in ('44', '223'):
+            self.conn.execute(f'CREATE TABLE IF NOT EXISTS notifications{fz} (notificationnumber TEXT PRIMARY KEY)')
+
+    def add(self, nums: Iterable[str], fz):
+        with self.conn:
+            self.conn.executemany(f'INSERT OR IGNORE INTO notifications{fz} VALUES (?)', [(num, ) for num in nums])
+
+    def unknown_numbers(self, nums, fz):
+        cursor = self.conn.cursor()
+        cursor.execute('DROP TABLE IF EXISTS temp.collected')
+        cursor.execute('CREATE TEMP TABLE collected (notifnr TEXT)')
+        cursor.executemany('INSERT INTO temp.collected VALUES (?)', [(num, ) for num in nums])
+        cursor.execute(f"""
+            SELECT t.notifnr
+            FROM temp.collected t
+            LEFT JOIN notifications{'223' if fz == '223' else '44'} n
+                ON t.notifnr = n.notificationnumber
+            WHERE n.notificationnumber IS NULL
+        """)
+        unknown = {num[0] for num in cursor.fetchall()}
+        cursor.close()
+
+        return unknown
+
+    def close(self):
+        self.conn.close()
+
+
+class MemoryBackend(DedupBackend):
+    """In-memory stand-in for tests and benchmarks"""
+
+    def __init__(self):
+        self.known: Dict[str, Set[str]] = {'44': set(), '223': set()}
+
+    def add(self, nums: Iterable[str], fz):
+        self.known[fz].update(nums)
+
+    def unknown_numbers(self, nums, fz):
+        return set(nums) - self.known[fz]
+
+
+def make_backend(backend='sqlserver', **kwargs):
+    match backend:
+        case 'sqlserver':
+            return SQLServerBackend(**kwargs)
+        case 'sqlite':
+            return SQLiteBackend(kwargs.get('path', ':memory:'))
+        case 'memory':
+            return MemoryBackend()
+        case _:
+            raise ValueError(f'Unknown database backend {backend}')
@@ -0,0 +1,85 @@
+import sqlite3
+import threading
+import time
+from bisect import bisect_left
+from pathlib import Path
+from typing import Dict, List
+
+
+def _merge_sorted(known, nums):
+    """Sorted nums merged into sorted known, slices between them are copied as a whole"""
+    merged, start = [], 0
+    for num in nums:
+        idx = bisect_left(known, num, start)
+        merged.extend(known[start:idx])
+        merged.append(num)
+        start = idx
+    merged.extend(known[start:])
+    return merged
+
+
+class KnownCache:
+    """
+    Local cache kept between runs. Remembers numbers the database reported as already imported
+    and 223 notification info resolved on zakupki, so they are not checked or visited again.
+    Membership is answered from sorted in-memory arrays, sqlite file only persists them.
+    Known numbers are dropped after known_ttl_days, searches do not find them by then
+    """
+    def __init__(self, path, ttl_days=7, known_ttl_days=90):
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute('CREATE TABLE IF NOT EXISTS known (fz TEXT, notif_num TEXT, added_at REAL, '
+                          'PRIMARY KEY (fz, notif_num)) WITHOUT ROWID')
+        self.conn.execute('CREATE TABLE IF NOT EXISTS resolved (notif_num TEXT PRIMARY KEY, noticeinfoid TEXT, pfid TEXT, resolved_at REAL)')
+        self.ttl_sec = ttl_days * 24 * 60 * 60
+        self.known_ttl_sec = known_ttl_days * 24 * 60 * 60
+
+        with self.conn:
+            # cache of older versions has no add time, its numbers start aging now
+            if 'added_at' not in [row[1] for row in self.conn.execute('PRAGMA table_info(known)')]:
+                self.conn.execute('ALTER TABLE known ADD COLUMN added_at REAL')
+                self.conn.execute('UPDATE known SET added_at = ?', (time.time(), ))
+            # stale resolutions and old known numbers are dropped on open
+            self.conn.execute('DELETE FROM resolved WHERE resolved_at < ?', (time.time() - self.ttl_sec, ))
+            self.conn.execute('DELETE FROM known WHERE added_at < ?', (time.time() - self.known_ttl_sec, ))
+
+        self._lock = threading.Lock()
+        self._known: Dict[str, List[str]] = {'44': [], '223': []}
+        for fz in self._known:
+            self._known[fz] = [row[0] for row in self.conn.execute(
+                'SELECT notif_num FROM known WHERE fz = ? ORDER BY notif_num', (fz, ))]
+        self._resolved = {row[0]: (row[1], row[2]) for row in self.conn.execute(
+            'SELECT notif_num, noticeinfoid, pfid FROM resolved')}
+
+    def is_known(self, notif_num, fz):
+        with self._lock:
+            known = self._known[fz]
+            idx = bisect_left(known, notif_num)
+            return idx < len(known) and known[idx] == notif_num
+
+    def add_known(self, nums, fz):
+        nums = sorted({num for num in nums if not self.is_known(num, fz)})
+        if not nums:
+            return
+        added_at = time.time()
+        with self._lock:
+            self._known[fz] = _merge_sorted(self._known[fz], nums)
+            with self.conn:
+                self.conn.executemany('INSERT OR IGNORE INTO known VALUES (?, ?, ?)', 
+                                      [(fz, num, added_at) for num in nums])
+
+    def get_resolved(self, notif_num):
+        """return: (noticeinfoid, pfid) or None"""
+        with self._lock:
+            return self._resolved.get(notif_num)
+
+    def put_resolved(self, notif_num, noticeinfoid, pfid):
+        with self._lock:
+            self._resolved[notif_num] = (noticeinfoid, pfid)
+            with self.conn:
+                self.conn.execute('INSERT OR REPLACE INTO resolved VALUES (?, ?, ?, ?)',
+                                  (notif_num, noticeinfoid, pfid, time.time()))
+
+    def close(self):
+        self.conn.close()
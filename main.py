@@ -3,19 +3,34 @@ import argparse
 import configparser
 import time
 import logging
-from datetime import datetime
+from datetime import date, datetime
 from pathlib import Path
 import multiprocessing as mp
 from functools import partial
 from itertools import chain
 import traceback
-from webdriver_manager.chrome import ChromeDriverManager
-
-from parser.driver import init_driver, quit_driver
-from parser.autofill import fill, get_input_data, WidgetType
-from parser.collector import collect, filter_unique, output_collected, collect_num_info
-from parser.utils import get_pid, chunk_into_n
+import queue
+from math import ceil
+from dataclasses import dataclass
+from typing import Optional, Tuple
+
+from parser.driver import install_driver, recycle_driver_if_needed, WEBSITE_URL
+from parser.http_engine import http_search, record_search_url, check_query_fields
+from parser.autofill import fill, get_input_data, WidgetType, build_okpd_index
+from parser.okpd_index import load_index
+from parser.collector import collect, collect_num_info, is_valid_num, known_page_stop, TooManyPages, RES_PER_PAGE
+from parser.output import OutputWriter
+from parser.pipeline import EnrichPipeline
+from parser.resolver import resolve_nums_info
+from parser.utils import get_pid
+from parser.workers import init_worker, pack_collected, unpack_collected, pool_browsers, kill_processes
+from parser.tabs import run_in_tabs, current_tab
+from parser.journal import RunJournal, PageJournal, task_key
+from parser import metrics
+from parser.planner import RunPlan, PlannedFile, Shards, normalize_input, default_window, split_window
+from parser.scheduler import make_tasks, order_tasks, TaskSizeHistory, QueryWatermarks, load_watermarks
 from db.connection import DBConnection
+from db.cache import KnownCache
 
 
 CONFIG_PATH = r'.\conf.ini'
@@ -33,9 +48,19 @@ def get_args(argv):
                     help='Запуск без интерфейса')
     ap.add_argument('--num-proc', required=False, type=int, 
                     help='Количество запускаемых процессов')
+    ap.add_argument('--num-proc-enrich', required=False, type=int, 
+                    help='Количество процессов, собирающих данные с закупок для ФЗ223')
     ap.add_argument('--fz', required=True, choices=['44', '223'],
                     help='поиск по ФЗ44/ФЗ223')
-    return ap.parse_args() 
+    ap.add_argument('--engine', required=False, choices=['browser', 'http'],
+                    help='Поиск через браузер/прямыми http запросами без браузера')
+    ap.add_argument('--incremental', required=False, choices=['y', 'n'],
+                    help='Листать результаты от новых к старым до страницы, найденной в прошлом запуске')
+    ap.add_argument('--resume', required=False, choices=['y', 'n'], default='n',
+                    help='Продолжить последний незавершенный запуск')
+    ap.add_argument('--config', required=False, default=CONFIG_PATH,
+                    help='Путь к файлу конфигурации')
+    return ap.parse_args(argv) 
 
 
 def get_conf(conf_path):
@@ -65,67 +90,233 @@ def _in_out_file_gen(input_folder, output_folder, out_prefix=''):
     out_folder_path = Path(output_folder)
     out_folder_path.mkdir(parents=True, exist_ok=True)
 
+    out_names = {}  # name -> files given it
     for in_file_path in in_folder_path.iterdir():
         with open(in_file_path, 'r') as f:
             if f.readable():
-                out_file_path = out_folder_path / f'{out_prefix}{datetime.now().strftime("%d_%m_%Y_%H_%M_%S")}.txt'
+                # files are planned at once, names made within the same second get a counter
+                out_name = f'{out_prefix}{datetime.now().strftime("%d_%m_%Y_%H_%M_%S")}'
+                out_names[out_name] = out_names.get(out_name, 0) + 1
+                if out_names[out_name] > 1:
+                    out_name += f'_{out_names[out_name]}'
+                out_file_path = out_folder_path / f'{out_name}.txt'
                 yield (in_file_path, out_file_path)
             else:
                 logging.warning(f"Can't read file {in_file_path}")
 
 
-def mp_kw_job(input_data, fz, search_interval, kw_policy):
+@dataclass
+class JobSettings:
+    """Search settings shared by all tasks of the run"""
+    fz: str
+    search_interval: int
+    kw_policy: Optional[str] = None
+    engine: str = 'browser'
+    tabs: int = 1
+    fill_mode: str = 'modal'
+    okpd_index_path: Optional[str] = None
+    stream_pages: bool = False  # pages are streamed to 223 enrichment if set
+    watermark_path: Optional[str] = None    # incremental run if set
+    run_dir: Optional[str] = None   # collected pages are journaled if set
+    resume: bool = False
+    shard_pages: Optional[int] = None   # queries with more result pages are split by publish date
+    search_url_path: Optional[str] = None   # results url of a browser search is recorded to it for http engine
+    date_window: Optional[Tuple[date, date]] = None    # publish window of the run, kept by its journal
+
+
+def _stop(settings, task, mode):
+    """Stop condition of an incremental run, None means all pages are collected"""
+    if settings.watermark_path is None:
+        return None
+    watermarks = load_watermarks(settings.watermark_path)
+    known = watermarks.get(task, mode, settings.fz) if watermarks is not None else set()
+    return known_page_stop(known)
+
+
+def _journal(settings):
+    if settings.run_dir is None:
+        return None
+    return PageJournal(settings.run_dir, settings.resume)
+
+
+def _on_page(settings):
+    if not settings.stream_pages:
+        return None
+    # queue is handed to each subprocess by pool initializer
+    from parser.workers import ENRICH_QUEUE
+    return ENRICH_QUEUE.put
+
+
+def _max_pages(settings, date_window):
+    """
+    Page limit the task is split at. Incremental runs stop at known pages and are not split,
+    neither is a single day window
+    """
+    if settings.shard_pages is None or settings.watermark_path is not None:
+        return None
+    date_from, date_to = date_window or settings.date_window or default_window(settings.search_interval)
+    if date_from >= date_to:
+        return None
+    return settings.shard_pages
+
+
+def _shards(settings, date_window, count):
+    """Windows the task is split into instead of collecting its results"""
+    windows = split_window(date_window or settings.date_window or default_window(settings.search_interval), 
+                           ceil(count / RES_PER_PAGE), settings.shard_pages)
+    print(f'Драйвер {get_pid()}: найдено {count}, запрос разбит на {len(windows)} интервалов по дате публикации')
+    return Shards(count, windows)
+
+
+def _window_text(date_window):
+    if date_window is None:
+        return ''
+    return f' за {date_window[0]:%d.%m.%Y}-{date_window[1]:%d.%m.%Y}'
+
+
+def _task_driver():
+    """Driver the task runs on: tab of the calling thread in tab sessions, otherwise the subprocess driver"""
+    if (tab := current_tab()) is not None:
+        return tab
+    # dead browser or one past its memory or page budget is restarted between tasks
+    recycle_driver_if_needed()
+    # driver object is global to each subprocess
+    from parser.driver import DRIVER
+    return DRIVER
+
+
+def mp_kw_job(input_data, settings, date_window=None):
     try:
-        print(f'Драйвер {get_pid()}: поиск по словам {input_data}')
+        print(f'Драйвер {get_pid()}: поиск по словам {input_data}{_window_text(date_window)}')
+        # resumed run searches the window it started with, not the one of the resume day
+        date_window = date_window or settings.date_window
 
         # fight mp map chunksize heuristic
         if len(input_data) and isinstance(input_data[0], list):
             input_data = list(chain(*input_data))
 
-        # driver object is global to each subprocess
-        from parser.driver import DRIVER
+        if settings.engine == 'http':
+            # session object is global to each subprocess
+            from parser.http_engine import SESSION
+
+            collected = http_search(SESSION, input_data, 'kw', settings.fz, settings.search_interval, 
+                                    kw_policy=settings.kw_policy, on_page=_on_page(settings), 
+                                    stop=_stop(settings, input_data, 'kw'), journal=_journal(settings), 
+                                    date_window=date_window, max_pages=_max_pages(settings, date_window))
+            print(f'Драйвер {get_pid()}: собрано {len(collected)}')
+            return pack_collected(collected)
+
+        driver = _task_driver()
 
         collected = []
-        fill_res = fill(DRIVER, input_data, 'kw', fz, search_interval, kw_policy=kw_policy)
+        fill_res = fill(driver, input_data, 'kw', settings.fz, settings.search_interval, 
+                        kw_policy=settings.kw_policy, fill_mode=settings.fill_mode, date_window=date_window)
         if fill_res is not None:
-            collected = collect(DRIVER)
+            record_search_url(settings.search_url_path, driver.current_url, 'kw', input_data, settings.fz, 
+                              kw_policy=settings.kw_policy, date_window=date_window)
+            collected = collect(driver, settings.tabs, _on_page(settings), _stop(settings, input_data, 'kw'), 
+                                _journal(settings), _max_pages(settings, date_window))
 
         print(f'Драйвер {get_pid()}: собрано {len(collected)}')
-        return collected
+        return pack_collected(collected)
+
+    except TooManyPages as e:
+        return _shards(settings, date_window, e.count)
     
     except:
         raise Exception(f"Драйвер {get_pid()}:\n" + "".join(traceback.format_exception(*sys.exc_info()))) 
 
 
-def mp_okpd_job(input_data, fz, search_interval):
+def mp_okpd_job(input_data, settings, date_window=None):
     try:
-        print(f'Драйвер {get_pid()}: поиск по кодам {input_data}')
+        print(f'Драйвер {get_pid()}: поиск по кодам {input_data}{_window_text(date_window)}')
+        # resumed run searches the window it started with, not the one of the resume day
+        date_window = date_window or settings.date_window
 
         # fight mp map chunksize heuristic
         if len(input_data) and isinstance(input_data[0], list):
             input_data = list(chain(*input_data))
 
-        # driver object is global to each subprocess
-        from parser.driver import DRIVER
+        if settings.engine == 'http':
+            # session object is global to each subprocess
+            from parser.http_engine import SESSION
+
+            collected = http_search(SESSION, input_data, 'okpd', settings.fz, settings.search_interval, 
+                                    okdp_policy='tree', on_page=_on_page(settings), 
+                                    stop=_stop(settings, input_data, 'okpd'), journal=_journal(settings), 
+                                    date_window=date_window, max_pages=_max_pages(settings, date_window))
+            print(f'Драйвер {get_pid()}: собрано {len(collected)}')
+            return pack_collected(collected)
+
+        driver = _task_driver()
+
+        # codes are selected through the tree index if it was harvested
+        load_index(settings.okpd_index_path)
 
+        stop = _stop(settings, input_data, 'okpd')
+        journal = _journal(settings)
         collected = []
-        fill_res = fill(DRIVER, input_data, 'okpd', fz, search_interval, okdp_policy='tree')
+        fill_res = fill(driver, input_data, 'okpd', settings.fz, settings.search_interval, 
+                        okdp_policy='tree', fill_mode=settings.fill_mode, date_window=date_window)
         if fill_res is not None:
+            if not fill_res[WidgetType.NESTED_LIST]:
+                record_search_url(settings.search_url_path, driver.current_url, 'okpd', input_data, settings.fz, 
+                                  okdp_policy='tree', date_window=date_window)
             # if all codes were not filled then search uses all codes, so we skip
             if len(fill_res[WidgetType.NESTED_LIST]) < len(input_data):
-                collected.extend(collect(DRIVER))
+                collected.extend(collect(driver, settings.tabs, _on_page(settings), stop, journal, 
+                                         _max_pages(settings, date_window)))
             if fill_res[WidgetType.NESTED_LIST]:
                 for code in fill_res[WidgetType.NESTED_LIST]:
-                    fill(DRIVER, code, 'okpd', fz, search_interval, okdp_policy='text')
-                    collected.extend(collect(DRIVER))
+                    fill(driver, code, 'okpd', settings.fz, settings.search_interval, 
+                         okdp_policy='text', fill_mode=settings.fill_mode, date_window=date_window)
+                    collected.extend(collect(driver, settings.tabs, _on_page(settings), stop, journal))
         
         print(f'Драйвер {get_pid()}: собрано {len(collected)}')
-        return collected
+        return pack_collected(collected)
+
+    except TooManyPages as e:
+        return _shards(settings, date_window, e.count)
     
     except:
         raise Exception(f"Драйвер {get_pid()}:\n" + "".join(traceback.format_exception(*sys.exc_info())))
     
 
+def mp_task_job(item, settings):
+    """
+    Task of any file and mode of the run
+    item: (index of the task in the run, mode, task, publish date window or None for the whole interval)
+    return: (index of the task, packed (number, url) it collected or Shards it is split into)
+    """
+    i, task_mode, task, date_window = item
+    job = mp_kw_job if task_mode == 'kw' else mp_okpd_job
+    return i, job(task, settings, date_window)
+
+
+def mp_tabs_job(tasks, job):
+    """Runs a group of tasks concurrently, each in its own tab of the subprocess browser"""
+    try:
+        # dead browser or one past its memory or page budget is restarted between groups
+        recycle_driver_if_needed()
+        # driver object is global to each subprocess
+        from parser.driver import DRIVER
+
+        return run_in_tabs(DRIVER, job, tasks, len(tasks))
+    
+    except:
+        raise Exception(f"Драйвер {get_pid()}:\n" + "".join(traceback.format_exception(*sys.exc_info())))
+
+
+def mp_okpd_index_job(okpd_index_path, max_age_days):
+    try:
+        driver = _task_driver()
+
+        return build_okpd_index(driver, okpd_index_path, max_age_days)
+    
+    except:
+        raise Exception(f"Драйвер {get_pid()}:\n" + "".join(traceback.format_exception(*sys.exc_info())))
+
+
 def parse_nums_info_job(input_data):
     try:
         print(f'Драйвер {get_pid()}: обрабатываю данные с закупок')
@@ -134,6 +325,8 @@ def parse_nums_info_job(input_data):
         if len(input_data) and isinstance(input_data[0], list):
             input_data = list(chain(*input_data))
 
+        # dead browser or one past its memory or page budget is restarted between tasks
+        recycle_driver_if_needed()
         # driver object is global to each subprocess
         from parser.driver import DRIVER
 
@@ -145,12 +338,135 @@ def parse_nums_info_job(input_data):
     
     except:
         raise Exception(f"Драйвер {get_pid()}:\n" + "".join(traceback.format_exception(*sys.exc_info())))
+
+
+def resolve_nums_info_job(input_data, retries=2):
+    try:
+        print(f'Драйвер {get_pid()}: обрабатываю данные с закупок без браузера')
+
+        # session object is global to each subprocess
+        from parser.http_engine import SESSION
+
+        return resolve_nums_info(SESSION.session, input_data, SESSION.pool_size, SESSION.timeout, retries)
     
+    except:
+        raise Exception(f"Драйвер {get_pid()}:\n" + "".join(traceback.format_exception(*sys.exc_info())))
+    
+
+
+def run_tasks(pool, job, plan, to_run, task_history, fz, watermarks=None, search_tabs=1, on_split=None):
+    """
+    Feed tasks to the pool one by one, so free drivers pick up the next task
+    instead of waiting on a fixed chunk. Heaviest known tasks go first
+    plan: RunPlan with (mode, task, date window) of all files of the run
+    to_run: indexes of the items to run, the rest were taken from the journal
+    watermarks: QueryWatermarks updated with the newest numbers of an incremental run
+    search_tabs: tasks run by each driver at once in its tabs, groups of them are fed instead
+    on_split: called with (index of the item, Shards) of a task split by date,
+        returns indexes of the new items to run
+    yield: (index of the item, (number, url) collected by the task) as each task completes
+    """
+    done = queue.SimpleQueue()
+    running = 0
+
+    def submit(indexes):
+        nonlocal running
+        entries = [(i, *plan.items[i]) for i in indexes]
+        if search_tabs > 1:
+            # neighbouring tasks are of similar size, so tabs of a group finish about the same time
+            for k in range(0, len(entries), search_tabs):
+                pool.apply_async(mp_tabs_job, (entries[k:k + search_tabs], job), 
+                                 callback=done.put, error_callback=done.put)
+                running += 1
+        else:
+            for entry in entries:
+                pool.apply_async(job, (entry, ), callback=lambda res: done.put([res]), error_callback=done.put)
+                running += 1
+
+    # tasks are handed out dynamically, results come back in completion order.
+    # windows of a split task are fed behind the tasks already queued
+    to_run = set(to_run)
+    submit([i for i in order_tasks(plan.items, task_history, fz) if i in to_run])
+    while running:
+        results = done.get()
+        running -= 1
+        if isinstance(results, BaseException):
+            raise results
+        for i, res in results:
+            mode, task, date_window = plan.items[i]
+            if isinstance(res, Shards):
+                task_history.update(task, mode, fz, res.count)
+                submit(on_split(i, res))
+                continue
+            task_collected = unpack_collected(res)
+            if date_window is None:
+                task_history.update(task, mode, fz, len(task_collected))
+                if watermarks is not None:
+                    watermarks.update(task, mode, fz, [num_url[0] for num_url in task_collected])
+            yield i, task_collected
+    task_history.save()
+    if watermarks is not None:
+        watermarks.save()
+
+
+def make_pool(num_proc, driver_kwds=None, session_kwds=None, enrich_queue=None):
+    """
+    Pool with exactly one driver and/or http session in each subprocess, see init_worker.
+    Tasks and results go to subprocesses directly without a manager process
+    """
+    return mp.Pool(processes=num_proc, initializer=init_worker, initargs=(driver_kwds, session_kwds, enrich_queue))
+
+
+def close_pool(pool, terminate=False):
+    """
+    Wait for subprocesses to exit, their finalizers quit drivers and close http sessions
+    terminate: run failed, queued tasks are dropped instead of being run for nothing.
+        Browsers of the subprocesses are quit by their SIGTERM handler, whatever outlives them is killed
+    """
+    if not terminate:
+        pool.close()
+        pool.join()
+        return
+    browsers = pool_browsers(pool)
+    pool.terminate()
+    pool.join()
+    kill_processes(browsers)
+
+
+def report_run(conf, fz, metrics_dir, duration):
+    """Aggregate stage stats of all processes into JSON run report and optional Prometheus textfile"""
+    total, per_pid = metrics.aggregate(metrics_dir)
+    run_info = {
+        'fz': fz, 
+        'finished': datetime.now().isoformat(timespec='seconds'), 
+        'duration': duration}
+
+    report_dir = conf['logging'].get('report_dir', None)
+    if report_dir:
+        report_path = Path(report_dir) / f'report_{datetime.now().strftime("%d_%m_%Y_%H_%M_%S")}.json'
+        metrics.write_report(report_path, total, per_pid, run_info, metrics.load_samples(metrics_dir))
+        print(f'Отчет о запуске записан в {report_path}')
+    textfile_path = conf['logging'].get('metrics_textfile', None)
+    if textfile_path:
+        metrics.write_textfile(textfile_path, total, run_info)
+
+    # lean mode traffic of all drivers
+    if 'requests_loaded' in total:
+        print(f"Загружено {total['requests_loaded'].items} запросов, "
+              f"{total['bytes_loaded'].items / 2 ** 20:.1f} МБ, заблокировано {total['requests_blocked'].items} запросов")
+
+    if 'driver_recycle' in total:
+        print(f"Браузеры перезапущены {total['driver_recycle'].count} раз")
+
+    for name, stats in sorted(total.items()):
+        logging.warning(f'Stage {name}: {stats.count} runs, {stats.seconds:.1f} s, '
+                        f'max {stats.max_seconds:.1f} s, {stats.retries} retries, {stats.items} items')
 
 
 def main(argv):
+    run_started = time.perf_counter()
     ap = get_args(argv)
-    conf = get_conf(CONFIG_PATH)
+    conf = get_conf(ap.config)
     init_logging(conf['logging'].get('log_path'))
     db_conn = DBConnection(**conf['database'])
     print('Установлено соединение с БД')
@@ -161,99 +477,263 @@ def main(argv):
     num_proc = conf['runtime'].getint('num_proc')
     if getattr(ap, 'num_proc', None) is not None:
         num_proc = ap.num_proc 
+    num_proc_enrich = conf['runtime'].getint('num_proc_enrich', num_proc)
+    if getattr(ap, 'num_proc_enrich', None) is not None:
+        num_proc_enrich = ap.num_proc_enrich
     search_interval = conf['runtime'].getint('search_interval_days')
     if getattr(ap, 'search_interval_days', None) is not None:
         search_interval = ap.search_interval_days
     output_folder = conf['data'].get('output_folder')
-
-    # install latest chromedriver version
-    driver_path = ChromeDriverManager().install()
-
-    with mp.Manager() as manager:
-        # spawn multiple drivers
-        with manager.Pool(processes=num_proc) as pool:
-            try:
-                # create subprocesses with distinct drivers
-                driver_init_res = []
-                for _ in range(num_proc):
-                    driver_init_res.append(pool.apply_async(
-                        init_driver, 
-                        kwds={'driver_path': driver_path, 'headless': ap.headless=='y'}))
-                for res in driver_init_res:
-                    res.get()
-
-                # launch in different modes with different params. None mode means launch everything
-                if mode is None or mode == 'kw':
-                    input_folder = conf['data'].get('input_folder_keyword')
-                    kw_policy = conf['runtime'].get('kw_search_policy')
-                    if getattr(ap, 'kw_policy', None) is not None:
-                        kw_policy = ap.kw_policy
-
-                    # del_files = []
-                    for (input_file, output_file) in _in_out_file_gen(input_folder, output_folder, 'по_словам_'):
-                        print(f'Поиск по ключевым словам из файла {input_file}')
-                        input_data = get_input_data(input_file)
-
-                        mp_kw_job_partial = partial(mp_kw_job, fz=fz, search_interval=search_interval, kw_policy=kw_policy)
-                        chunks_urls = chunk_into_n(input_data, num_proc)
-                        collected_num_url = pool.map(mp_kw_job_partial, chunks_urls, 1)
-                        collected_num_url = list(set(chain(*collected_num_url)))
-                        
-                        if fz == '44':
-                            collected_nums = [col[0] for col in collected_num_url]
-                            output_collected(output_file, collected_nums, db_conn, fz)
-
-                        elif fz == '223':
-                            chunks_info = chunk_into_n(collected_num_url, num_proc)
-                            collected_info = pool.map(parse_nums_info_job, chunks_info, 1)
-                            output_collected(output_file, list(chain(*collected_info)), db_conn, fz)
-
-                        filter_unique(output_file)
-
-                    #     del_files.append(input_file)
-                    # for file in del_files:
-                    #     file.unlink()
-                    
-
-                if mode is None or mode == 'okpd':
-                    input_folder = conf['data'].get('input_folder_okpd')
-
-                    # del_files = []
-                    for (input_file, output_file) in _in_out_file_gen(input_folder, output_folder, 'по_окпд_'):
-                        print(f'Поиск по кодам ОКПД из файла {input_file}')
-                        input_data = get_input_data(input_file)
-
-                        okpd_kw_job_partial = partial(mp_okpd_job, fz=fz, search_interval=search_interval)
-                        chunks_urls = chunk_into_n(input_data, num_proc)
-                        collected_num_url = pool.map(okpd_kw_job_partial, chunks_urls, 1)
-                        collected_num_url = list(set(chain(*collected_num_url)))
-
-                        if fz == '44':
-                            collected_nums = [col[0] for col in collected_num_url]
-                            output_collected(output_file, collected_nums, db_conn, fz)
-
-                        elif fz == '223':
-                            chunks_info = chunk_into_n(collected_num_url, num_proc)
-                            collected_info = pool.map(parse_nums_info_job, chunks_info, 1)
-                            output_collected(output_file, list(chain(*collected_info)), db_conn, fz)
-
-                        filter_unique(output_file)
-
-                    #     del_files.append(input_file)
-                    # for file in del_files:
-                    #     file.unlink()
-                        
-            finally:
-                # quit all drivers
-                driver_quit_res = []
-                for _ in range(num_proc):
-                    driver_quit_res.append(pool.apply_async(quit_driver))
-                for res in driver_quit_res:
-                    res.get()
-
-                pool.terminate()
-                pool.join()
-
+    engine = conf['runtime'].get('engine', 'browser')
+    if getattr(ap, 'engine', None) is not None:
+        engine = ap.engine
+    website_url = conf['runtime'].get('website_url', WEBSITE_URL)
+    html_parser = conf['runtime'].get('html_parser', 'html.parser')
+    task_history = TaskSizeHistory(conf['data'].get('task_history_path', None))
+    settings = JobSettings(
+        fz=fz, 
+        search_interval=search_interval, 
+        engine=engine, 
+        tabs=conf['runtime'].getint('collect_tabs', 1), 
+        fill_mode=conf['runtime'].get('fill_mode', 'modal'), 
+        shard_pages=conf['runtime'].getint('shard_pages', 0) or None)
+
+    # http engine builds results url itself, its query is checked against the one a browser search produced
+    settings.search_url_path = conf['data'].get('search_url_path', r'.\RTSCache\search_url.json')
+    if engine == 'http':
+        check_query_fields(settings.search_url_path, website_url)
+
+    # several searches run at once in tabs of each browser, their pages are not split between more tabs
+    search_tabs = conf['runtime'].getint('search_tabs', 1) if engine == 'browser' else 1
+    if search_tabs > 1:
+        settings.tabs = 1
+
+    # incremental run pages newest first and stops at results known from the previous run
+    incremental = conf['runtime'].getboolean('incremental', False)
+    if getattr(ap, 'incremental', None) is not None:
+        incremental = ap.incremental == 'y'
+    watermarks = None
+    if incremental:
+        settings.watermark_path = conf['data'].get('watermark_path', r'.\RTSCache\watermarks.json')
+        watermarks = QueryWatermarks(settings.watermark_path)
+
+    # search drivers are not needed for http engine, 223 info from zakupki is resolved
+    # by drivers or by concurrent http requests following the redirects
+    search_drivers = engine == 'browser'
+    enrich_engine = conf['runtime'].get('enrich_engine', 'browser')
+    enrich_drivers = fz == '223' and enrich_engine == 'browser'
+
+    # chromedriver is pinned in local cache after the first install
+    if search_drivers or enrich_drivers:
+        driver_cache_dir = conf.get('browser', 'driver_cache_dir', fallback=r'.\RTSCache\driver')
+        driver_version = conf.get('browser', 'driver_version', fallback=None) or None
+        profile_dir = conf.get('browser', 'profile_dir', fallback=None) or None
+        driver_kwds = {
+            'driver_path': install_driver(driver_cache_dir, driver_version), 
+            'headless': ap.headless=='y', 
+            'html_parser': html_parser, 
+            'profile_dir': profile_dir, 
+            'lean': conf.getboolean('browser', 'lean_mode', fallback=False), 
+            'recycle_rss_mb': conf.getint('browser', 'recycle_rss_mb', fallback=0) or None, 
+            'recycle_pages': conf.getint('browser', 'recycle_pages', fallback=0) or None, 
+            'website_url': website_url, 
+            'driver_cache_dir': driver_cache_dir, 
+            'driver_version': driver_version}
+        if blocked_urls := conf.get('browser', 'blocked_urls', fallback=None):
+            driver_kwds['blocked_urls'] = [pattern.strip() for pattern in blocked_urls.split(',') if pattern.strip()]
+        # timeouts of waits are learned from durations observed by each driver
+        if conf['runtime'].getboolean('adaptive_waits', False):
+            driver_kwds['wait_policy'] = {
+                'path': conf['data'].get('wait_stats_dir', None), 
+                'percentile': conf['runtime'].getint('wait_percentile', 95), 
+                'factor': conf['runtime'].getfloat('wait_factor', 3.0)}
+    session_kwds = {'base_url': website_url, 'pool_size': 10, 'html_parser': html_parser}
+    enrich_session_kwds = {
+        'base_url': website_url, 
+        'pool_size': conf['runtime'].getint('enrich_concurrency', 10), 
+        'html_parser': html_parser, 
+        # resolver retries each number itself, adapter retries would multiply with its own
+        'retries': 0}
+
+    # numbers already imported and resolved 223 info are remembered between runs
+    cache = None
+    if cache_path := conf['data'].get('known_cache_path', None):
+        cache = KnownCache(cache_path, conf['runtime'].getint('known_cache_ttl_days', 7), 
+                           conf['runtime'].getint('known_numbers_ttl_days', 90))
+
+    # finished tasks, files and collected pages are journaled, so a stopped run can be resumed
+    run_root = conf['data'].get('run_journal_dir', r'.\RTSCache\runs')
+    journal = None
+    if ap.resume == 'y':
+        # journal of a run of another law or mode has other files and tasks done
+        journal = RunJournal.latest(run_root, fz=fz, mode=mode)
+        if journal is None:
+            print(f'Незавершенный запуск по ФЗ{fz} в режиме {mode or "kw и okpd"} не найден, начинаю заново')
+        else:
+            print(f'Продолжаю запуск {journal.run_dir.name}')
+            settings.resume = True
+    if journal is None:
+        journal = RunJournal.create(run_root)
+        journal.set_meta(
+            fz=fz, 
+            mode=mode, 
+            window=[day.isoformat() for day in default_window(search_interval)], 
+            index_path=str(Path(output_folder) / f'.seen_{datetime.now().strftime("%d_%m_%Y_%H_%M_%S")}.sqlite'))
+    settings.run_dir = str(journal.run_dir)
+    # task keys and searches use the window the run started with, so a run resumed on another day matches its journal
+    settings.date_window = journal.date_window() or default_window(search_interval)
+
+    # stage stats of every process are dumped to the run folder and reported at the end
+    metrics_dir = str(journal.run_dir / 'metrics')
+    metrics.init_metrics(metrics_dir)
+    if search_drivers or enrich_drivers:
+        driver_kwds['metrics_dir'] = metrics_dir
+    session_kwds['metrics_dir'] = metrics_dir
+    enrich_session_kwds['metrics_dir'] = metrics_dir
+
+    # numbers are deduplicated across all output files of the run, resumed run keeps the index
+    writer = OutputWriter(journal.meta['index_path'], db_conn, fz, 
+                          conf['runtime'].getint('output_batch_size', 500), cache)
+
+    # 223 numbers found by search subprocesses are streamed to enrichment through the queue
+    enrich_queue = mp.Queue() if fz == '223' else None
+    settings.stream_pages = enrich_queue is not None
+
+    # spawn subprocesses with distinct drivers
+    pool = make_pool(num_proc, 
+                     driver_kwds if search_drivers else None, 
+                     session_kwds if engine == 'http' else None, 
+                     enrich_queue)
+    enrich_pool = None
+    enrich = None
+    completed = False
+    try:
+        # 223 numbers are enriched by a separate pool while search goes on
+        if enrich_queue is not None:
+            if enrich_drivers:
+                enrich_pool = make_pool(num_proc_enrich, driver_kwds)
+                enrich_job = parse_nums_info_job
+            else:
+                enrich_pool = make_pool(num_proc_enrich, session_kwds=enrich_session_kwds)
+                enrich_job = partial(resolve_nums_info_job, retries=conf['runtime'].getint('enrich_retries', 2))
+            enrich = EnrichPipeline(enrich_pool, enrich_queue, enrich_job, 
+                                    accept=lambda notif_num: is_valid_num(notif_num, fz), 
+                                    cache=cache, fz=fz, batch=not enrich_drivers)
+
+        # tasks of all files of both modes run as one stream, None mode means launch everything
+        plan = RunPlan()
+        if mode is None or mode == 'kw':
+            input_folder = conf['data'].get('input_folder_keyword')
+            settings.kw_policy = conf['runtime'].get('kw_search_policy')
+            if getattr(ap, 'kw_policy', None) is not None:
+                settings.kw_policy = ap.kw_policy
+
+            for (input_file, output_file) in _in_out_file_gen(input_folder, output_folder, 'по_словам_'):
+                if journal.is_file_done(input_file):
+                    continue
+                print(f'Поиск по ключевым словам из файла {input_file}')
+                tasks = make_tasks(normalize_input(get_input_data(input_file), 'kw'), 'kw', settings.kw_policy)
+                plan.add_file(PlannedFile(input_file, output_file, 'kw', tasks))
+
+        if mode is None or mode == 'okpd':
+            input_folder = conf['data'].get('input_folder_okpd')
+            settings.okpd_index_path = conf['data'].get('okpd_index_path', None)
+
+            for (input_file, output_file) in _in_out_file_gen(input_folder, output_folder, 'по_окпд_'):
+                if journal.is_file_done(input_file):
+                    continue
+                print(f'Поиск по кодам ОКПД из файла {input_file}')
+                tasks = make_tasks(normalize_input(get_input_data(input_file), 'okpd'), 'okpd')
+                plan.add_file(PlannedFile(input_file, output_file, 'okpd', tasks))
+
+            # harvest okpd tree once, drivers select codes by index
+            if engine == 'browser' and settings.okpd_index_path is not None and \
+                    any(planned.mode == 'okpd' for planned in plan.files):
+                okpd_index_max_age = conf['runtime'].getint('okpd_index_max_age_days', 30)
+                pool.apply(mp_okpd_index_job, (settings.okpd_index_path, okpd_index_max_age))
+
+        # searches repeated across files run once, codes under a parent code of the same file are not searched
+        plan.drop_covered_codes()
+
+        def route(planned, task_collected, shared):
+            if fz == '44':
+                nums = [col[0] for col in task_collected]
+                writer.write(planned.output_file, nums, nums if shared else ())
+            elif fz == '223':
+                planned.collected.update(task_collected)
+                if shared:
+                    planned.shared.update(col[0] for col in task_collected)
+
+        def finish_file(planned):
+            if fz == '223':
+                writer.write(planned.output_file, enrich.finish_file(list(planned.collected)), planned.shared)
+            writer.close_file(planned.output_file)
+            journal.finish_file(planned.input_file)
+
+        def complete(i, task_collected):
+            # results of a search requested by several files go to each of them
+            for planned in plan.owners[i]:
+                route(planned, task_collected, len(plan.owners[i]) > 1)
+            for planned in plan.task_done(i):
+                finish_file(planned)
+
+        if enrich is not None:
+            enrich.start()
+        for planned in plan.files:
+            # resumed file is appended to the output it was written to before the stop
+            planned.output_file = journal.file_output(planned.input_file) or planned.output_file
+            journal.start_file(planned.input_file, planned.output_file)
+            writer.open_file(planned.output_file)
+            for task in planned.tasks:
+                plan.add_task(planned, task)
+            if planned.pending == 0:
+                finish_file(planned)
+
+        # tasks completed before a stop are taken from the journal
+        to_run = []
+        for i, (task_mode, task, _) in enumerate(plan.items):
+            task_collected = journal.task_result(task_key(task, task_mode, fz, settings.date_window))
+            if task_collected is None:
+                to_run.append(i)
+            else:
+                complete(i, task_collected)
+
+        def on_split(i, shards):
+            # windows completed before a stop are taken from the journal
+            to_run = []
+            for j in plan.split(i, shards.windows):
+                task_mode, task, date_window = plan.items[j]
+                task_collected = journal.task_result(task_key(task, task_mode, fz, date_window))
+                if task_collected is None:
+                    to_run.append(j)
+                else:
+                    complete(j, task_collected)
+            return to_run
+
+        print(f'Запланировано {len(to_run)} задач из {len(plan.files)} файлов, '
+              f'повторов {plan.requested - len(plan.items)}, кодов под родительским кодом {plan.covered}')
+        # a file is finished as soon as its last task completes
+        job = partial(mp_task_job, settings=settings)
+        for i, task_collected in run_tasks(pool, job, plan, to_run, task_history, fz, watermarks, search_tabs, 
+                                           on_split):
+            task_mode, task, date_window = plan.items[i]
+            journal.task_done(task_key(task, task_mode, fz, date_window or settings.date_window), task_collected)
+            complete(i, task_collected)
+        completed = True
+
+    finally:
+        if enrich is not None:
+            enrich.stop()
+        # quit all drivers
+        close_pool(pool, terminate=not completed)
+        if enrich_pool is not None:
+            close_pool(enrich_pool, terminate=not completed)
+
+    writer.close()
+    report_run(conf, fz, metrics_dir, time.perf_counter() - run_started)
+    journal.complete()
+    if cache is not None:
+        cache.close()
     db_conn.close()
 
 
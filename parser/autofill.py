@@ -1,10 +1,8 @@
 from selenium.webdriver.common.by import By
-from selenium.webdriver.support.wait import WebDriverWait
 import selenium.webdriver.support.expected_conditions as EC
 from selenium import webdriver
 from selenium.webdriver.common.keys import Keys
-from selenium.common.exceptions import TimeoutException, ElementClickInterceptedException
-from bs4 import BeautifulSoup
+from selenium.common.exceptions import TimeoutException, ElementClickInterceptedException, JavascriptException
 from dataclasses import dataclass, field
 import dataclasses
 from typing import List, Optional, Union
@@ -17,11 +15,158 @@ import sys
 import chardet
 from pathlib import Path
 from concurrent import futures
-
-from .utils import xpath_soup, native_click, get_pid
-
-
-FILTER_URL = r"https://www.rts-tender.ru/poisk/search?keywords=&isFilter=1"
+from urllib.parse import urljoin
+
+from .utils import native_click, get_pid
+from .waits import until
+from . import metrics
+from .modal import FilterModal, ModalNotFound
+from . import okpd_index
+from .okpd_index import OkpdIndex, select_codes, harvest, tree_fingerprint
+
+
+FILTER_PATH = r"poisk/search?keywords=&isFilter=1"
+
+# everything warm fill relies on: collapsed sections, checked options, dates and keywords.
+# Also remembers history position of the modal page to get back to it after the search
+_MODAL_STATE_SCRIPT = r"""
+var main = document.querySelector('.modal-settings-filter__main');
+if (main === null) return null;
+var state = {collapsed: 0, checked: [], dates: [], keywords: ''};
+main.querySelectorAll('.modal-settings-section').forEach(function(section) {
+    var title = section.querySelector('.filter-title .title-collapse');
+    var name = title ? title.textContent.trim() : '';
+    if (section.querySelector('.filter-title .title-collapse--less')) state.collapsed += 1;
+    section.querySelectorAll('input[type=checkbox]').forEach(function(input) {
+        if (!input.checked) return;
+        var cell = input.closest('.grid-column-4-1, li') || input.parentElement;
+        state.checked.push(name + '/' + cell.textContent.trim().slice(0, 100));
+    });
+});
+main.querySelectorAll('input.datepicker').forEach(function(input) { state.dates.push(input.value); });
+var controls = document.querySelector('.modal-settings-search .main-search__controls');
+if (controls) {
+    var input = controls.querySelector('input');
+    state.keywords = controls.textContent.trim() + '/' + (input ? input.value : '');
+}
+return state;
+"""
+
+_KEYWORD_CLEAR_SCRIPT = r"""
+var controls = document.querySelector('.modal-settings-search .main-search__controls');
+if (controls === null) return false;
+Array.from(controls.querySelectorAll('button, span, i, a')).filter(function(el) {
+    return /(remove|close|delete|clear)/i.test(el.getAttribute('class') || '');
+}).forEach(function(el) { el.click(); });
+var input = controls.querySelector('input');
+if (input) {
+    Object.getOwnPropertyDescriptor(HTMLInputElement.prototype, 'value').set.call(input, '');
+    input.dispatchEvent(new Event('input', {bubbles: true}));
+}
+return true;
+"""
+
+_WARM_STATE = {}    # driver session id or tab window -> state of the last warm fill. Local to each subprocess
+
+# prepares the modal (uncollapse, show more, clear all) and fills checkbox, date and keyword params
+# in one call. Returns {widget type value: [options which cant be filled]} or null on failure
+_BATCH_FILL_SCRIPT = r"""
+var payload = arguments[0], submit = arguments[1], done = arguments[arguments.length - 1];
+
+function lower(s) { return (s || '').toLowerCase(); }
+function sections() {
+    return Array.from(document.querySelectorAll('.modal-settings-filter__main .modal-settings-section'));
+}
+function titleOf(section) {
+    var title = section.querySelector('.filter-title .title-collapse');
+    return title ? lower(title.textContent) : '';
+}
+function setValue(input, value) {
+    // react tracks value through the native setter
+    var setter = Object.getOwnPropertyDescriptor(HTMLInputElement.prototype, 'value').set;
+    setter.call(input, value);
+    input.dispatchEvent(new Event('input', {bubbles: true}));
+    input.dispatchEvent(new Event('change', {bubbles: true}));
+}
+function press(el, name, code) {
+    ['keydown', 'keypress', 'keyup'].forEach(function(type) {
+        el.dispatchEvent(new KeyboardEvent(type, {key: name, code: name, keyCode: code, which: code, bubbles: true}));
+    });
+}
+function step(fn) {
+    // let widgets rerender between steps
+    setTimeout(function() {
+        try { fn(); } catch (e) { done(null); }
+    }, 50);
+}
+
+step(function() {
+    sections().forEach(function(section) {
+        var collapsed = section.querySelector('.filter-title .title-collapse--less');
+        if (collapsed) collapsed.click();
+    });
+    step(function() {
+        sections().forEach(function(section) {
+            section.querySelectorAll('.modal-settings-row').forEach(function(row) {
+                var a = row.querySelector('a');
+                if (a && lower(row.textContent).indexOf('показать еще') !== -1) a.click();
+            });
+            section.querySelectorAll('.modal-settings-row.filter-helpers a').forEach(function(a) {
+                if (lower(a.textContent).indexOf('снять всё') !== -1) a.click();
+            });
+        });
+        step(function() {
+            var result = {};
+            payload.entries.forEach(function(entry) {
+                var failed = entry.options.slice();
+                var section = sections().find(function(s) { return titleOf(s).indexOf(lower(entry.name)) !== -1; });
+                if (section && (entry.type === 'grid' || entry.type === 'list')) {
+                    section.querySelectorAll('.grid-column-4-1').forEach(function(cell) {
+                        var label = cell.querySelector('label'), input = cell.querySelector('input');
+                        if (!label || !input) return;
+                        entry.options.forEach(function(option) {
+                            if (lower(label.textContent).indexOf(lower(option)) === -1) return;
+                            if (!input.checked) label.click();
+                            if (input.checked) failed = failed.filter(function(o) { return o !== option; });
+                        });
+                    });
+                }
+                if (section && entry.type === 'date_range') {
+                    section.querySelectorAll('.grid-column-2').forEach(function(col) {
+                        var title = col.querySelector('.form-group__title');
+                        var pickers = col.querySelectorAll('input.datepicker');
+                        entry.options.forEach(function(option) {
+                            if (!title || lower(title.textContent).indexOf(lower(option)) === -1) return;
+                            entry.extra.forEach(function(value, i) { if (pickers[i]) setValue(pickers[i], value); });
+                            // close blocking react widget
+                            press(document.body, 'Escape', 27);
+                            if (pickers.length >= entry.extra.length) {
+                                failed = failed.filter(function(o) { return o !== option; });
+                            }
+                        });
+                    });
+                }
+                result[entry.type] = (result[entry.type] || []).concat(failed);
+            });
+
+            var input = document.querySelector('.modal-settings-search .main-search__controls input');
+            result['text'] = payload.keywords.slice();
+            if (input) {
+                payload.keywords.forEach(function(keyword) {
+                    input.focus();
+                    setValue(input, keyword);
+                    press(input, 'Enter', 13);
+                });
+                result['text'] = [];
+            }
+
+            var searchBtn = document.querySelector('.bottomCenterSearch button');
+            done(result);
+            if (submit && searchBtn) setTimeout(function() { searchBtn.click(); }, 0);
+        });
+    });
+});
+"""
 
 class WidgetType(Enum):
     GRID = 'grid'
@@ -113,6 +258,23 @@ class FillRetryEndless(ParserError):
     pass
 
 
+def publish_interval(publish_date):
+    """
+    publish_date: days back from today or explicit (date from, date to) window
+    return: [date from, date to]
+    """
+    if isinstance(publish_date, tuple):
+        return list(publish_date)
+    return [date.today() - timedelta(days=publish_date), date.today()]
+
+
+def filter_url():
+    """Filter page of the site the subprocess driver searches"""
+    # site is set when the driver starts
+    from .driver import SITE_URL
+    return urljoin(SITE_URL, FILTER_PATH)
+
+
 def get_input_data(input):
     if isinstance(input, Path):
         with open(input, 'rb') as f:
@@ -127,7 +289,12 @@ def get_input_data(input):
     return input_data
 
 
-def fill(driver, input_data, mode, fz, search_interval, kw_policy=None, okdp_policy=None):
+def fill(driver, input_data, mode, fz, search_interval, kw_policy=None, okdp_policy=None, fill_mode='modal', 
+         date_window=None):
+    """
+    Fill search params and go to results
+    date_window: optional (date from, date to) publish window searched instead of search_interval days back from today
+    """
     if mode is None:
         print("No mode provided")
         # logging.error("No mode provided")
@@ -135,11 +302,44 @@ def fill(driver, input_data, mode, fz, search_interval, kw_policy=None, okdp_pol
     if input_data is None or not input_data:
         return None
 
-    search_url = FILTER_URL
+    search_url = filter_url()
+
+    search_params = make_search_params(input_data, mode, fz, search_interval, kw_policy, okdp_policy, date_window)
+
+    with metrics.timed('fill'):
+        if fill_mode == 'batch':
+            failure = fill_search_params_batched(
+                driver, 
+                search_url,
+                search_params)
+        elif fill_mode == 'warm':
+            failure = fill_search_params_warm(
+                driver, 
+                search_url,
+                search_params)
+        else:
+            failure = fill_search_params(
+                driver, 
+                search_url,
+                search_params)
+
+    try:
+        with metrics.timed('search_click'):
+            until(driver, 'search_submit', 10, lambda driver: driver.current_url != search_url)
+    except TimeoutException:
+        print(f'Драйвер {get_pid()}: первышен лимит времени при переходе на страницу результатов. Перезапускаю заполнение параметров')
+        metrics.retry('fill')
+        driver.refresh()
+        return fill(driver, input_data, mode, fz, search_interval, kw_policy, okdp_policy, fill_mode, date_window)
+
+    return failure
+
 
+def make_search_params(input_data, mode, fz, search_interval, kw_policy=None, okdp_policy=None, date_window=None):
+    """Translate launch settings into search params"""
     search_params = SearchParams()
     # fill new search params from input
-    search_params.publish_date.extra = search_interval
+    search_params.publish_date.extra = tuple(date_window) if date_window is not None else search_interval
 
     if mode == 'kw' and kw_policy is not None:
         search_params.keyword.options = input_data
@@ -161,24 +361,12 @@ def fill(driver, input_data, mode, fz, search_interval, kw_policy=None, okdp_pol
     elif fz == '223':
         search_params.regulation.options = ['223-фз']
 
-    failure = fill_search_params(
-        driver, 
-        search_url,
-        search_params)
-
-    try:
-        WebDriverWait(driver, 10).until(lambda driver: driver.current_url != search_url)
-    except TimeoutException:
-        print(f'Драйвер {get_pid()}: первышен лимит времени при переходе на страницу результатов. Перезапускаю заполнение параметров')
-        driver.refresh()
-        return fill(driver, input_data, mode, search_interval, kw_policy, okdp_policy)
-
-    return failure
+    return search_params
 
 
 def _nested_list_dfs(ul, code, is_root=False):
     # use xpath to only iterate top level descendants 
-    lis = WebDriverWait(ul, 10).until(EC.visibility_of_all_elements_located((By.XPATH, './li')))
+    lis = until(ul, 'okpd_tree_list', 10, EC.visibility_of_all_elements_located((By.XPATH, './li')))
     for li in lis:
         # uncollapse list if collapsed
         if 'settings-tree--show' not in li.get_attribute('class'):
@@ -195,11 +383,11 @@ def _nested_list_dfs(ul, code, is_root=False):
                 if code.startswith(label) or ((len(label) == len(code)) and code.startswith(label[:-1]) and label.endswith('0')):
                     if code == label:
                         return li.find_element(By.TAG_NAME, 'label')
-                    ul = WebDriverWait(li, 5).until(EC.presence_of_element_located((By.TAG_NAME, 'ul')))
+                    ul = until(li, 'okpd_tree_subtree', 5, EC.presence_of_element_located((By.TAG_NAME, 'ul')))
                     if (ret := _nested_list_dfs(ul, code)) is not None:
                         return ret
             else:
-                ul = WebDriverWait(li, 5).until(EC.presence_of_element_located((By.TAG_NAME, 'ul')))
+                ul = until(li, 'okpd_tree_subtree', 5, EC.presence_of_element_located((By.TAG_NAME, 'ul')))
                 root_match = _nested_list_dfs(ul, code)
                 if root_match is not None:
                     return root_match
@@ -210,33 +398,33 @@ def _nested_list_dfs(ul, code, is_root=False):
 
 def _code_searchbox_input(code, searchbox, driver):
     # clear previous
-    clear_btn = WebDriverWait(searchbox, 10).until(
+    clear_btn = until(searchbox, 'code_clear', 10, 
         EC.element_to_be_clickable((By.CLASS_NAME, "cstm-button-clear"))
     )
     native_click(clear_btn, driver)
 
     # senf code to input field
-    input = WebDriverWait(searchbox, 10).until(
+    input = until(searchbox, 'code_input', 10, 
         EC.element_to_be_clickable((By.TAG_NAME, "input"))
     )
     input.send_keys(code)
 
     # wait for autocomplete to appear
-    autocomp = WebDriverWait(searchbox, 20).until(
+    autocomp = until(searchbox, 'code_autocomplete', 20, 
         EC.presence_of_element_located((By.CLASS_NAME, "cstm-search__autocomplite"))
     )
-    suggest = WebDriverWait(autocomp, 20).until(
+    suggest = until(autocomp, 'code_suggest', 20, 
         EC.presence_of_element_located((By.CLASS_NAME, "cstm-search__suggest"))
     )
 
     # discover option with needed code
-    WebDriverWait(suggest, 20).until(
+    until(suggest, 'code_option', 20, 
         EC.text_to_be_present_in_element((By.TAG_NAME, "b"), code)
     )
     native_click(suggest, driver)
 
 
-def fill_parameter(driver, el, search_entry: SearchEntry):
+def fill_parameter(driver, el, search_entry: SearchEntry, modal: FilterModal):
     if el is None:
         print(f"Драйвер {get_pid()}: не удалось заполнить параметр {search_entry.name}")
         return
@@ -257,13 +445,12 @@ def fill_parameter(driver, el, search_entry: SearchEntry):
                     for match_option in search_entry.options:
                         if str.lower(match_option) in str.lower(grid_val_label):
                             checkbox = grid_val.find("input")
-                            checkbox_interact = driver.find_element(By.XPATH, xpath_soup(checkbox))
+                            checkbox_interact = modal.element(checkbox)
 
                             # check checkbox if it is not selected but is in our list
                             if not checkbox_interact.is_selected():
                                 checkbox_label = grid_val.find("label")
-                                checkbox_label_interact = driver.find_element(
-                                    By.XPATH, xpath_soup(checkbox_label))
+                                checkbox_label_interact = modal.element(checkbox_label)
                                 checkbox_label_interact.click()
         case WidgetType.DATE_RANGE:
             grid_row = el.find("div", {"class", "grid-row"})
@@ -271,10 +458,10 @@ def fill_parameter(driver, el, search_entry: SearchEntry):
                 col_title_text = grid_col.find("div", {"class", "form-group__title"}).get_text()
                 for match_option in search_entry.options:
                     if str.lower(match_option) in str.lower(col_title_text):
-                        date_interval = [date.today() - timedelta(days=search_entry.extra), date.today()]
+                        date_interval = publish_interval(search_entry.extra)
                         datepicker_cells = grid_col.find_all("input", {"class": "datepicker"})
                         for datepicker, date_val in zip(datepicker_cells, date_interval):
-                            datepicker_interact = driver.find_element(By.XPATH, xpath_soup(datepicker))
+                            datepicker_interact = modal.element(datepicker)
                             datepicker_interact.send_keys(date_val.strftime("%d-%m-%Y"))
                             # close blocking react widget
                             webdriver.ActionChains(driver).send_keys(Keys.ESCAPE).perform()
@@ -282,9 +469,21 @@ def fill_parameter(driver, el, search_entry: SearchEntry):
             if search_entry.extra == 'tree':
                 # element for checkbox input
                 code_tree = el.find("div", {"class": "settings-tree"}).find("ul")
-                ul = driver.find_element(By.XPATH, xpath_soup(code_tree))
-
-                for code in search_entry.options:
+                ul = modal.element(code_tree)
+
+                dfs_codes = search_entry.options
+                if (index := okpd_index.INDEX) is not None:
+                    selected = select_codes(driver, ul, index, search_entry.options)
+                    for code in search_entry.options:
+                        if selected[code]:
+                            print(f'Найден код {code} в индексе дерева')
+                        elif code not in index:
+                            print(f'Не удалось найти код {code} в индексе дерева')
+                            failed.append(code)
+                    # index is out of date for these, walk the tree
+                    dfs_codes = [code for code in search_entry.options if not selected[code] and code in index]
+
+                for code in dfs_codes:
                     checkbox = _nested_list_dfs(ul, code, is_root=True)
                     if checkbox is not None:
                         print(f'Найден код {code} в дереве')
@@ -295,14 +494,14 @@ def fill_parameter(driver, el, search_entry: SearchEntry):
 
             if search_entry.extra == 'text':
                 searchbox = el.find("div", {"class": "form-control-search"})
-                searchbox_interact = driver.find_element(By.XPATH, xpath_soup(searchbox))
+                searchbox_interact = modal.element(searchbox)
                 code = search_entry.options
                 assert isinstance(code, str)
                 _code_searchbox_input(code, searchbox_interact, driver)
                 print(f'Найден код {code} в строке поиска')
 
         case WidgetType.TEXT:
-            input_interact = driver.find_element(By.XPATH, xpath_soup(el))
+            input_interact = modal.element(el)
             for option in search_entry.options:    
                 input_interact.send_keys(option)
                 webdriver.ActionChains(driver).send_keys(Keys.ENTER).perform()
@@ -310,53 +509,39 @@ def fill_parameter(driver, el, search_entry: SearchEntry):
     return failed
 
 
-def show_more(driver):
+def show_more(driver, modal: FilterModal):
     """Click show more in all search options"""
-    soup = BeautifulSoup(driver.page_source, 'html.parser')
-    filter_el = soup.find("div", {"class": "modal-settings-filter__main"})
-    filter_options = filter_el.find_all("div", {"class": "modal-settings-section"})
-    for filter_option in filter_options:
-        for msr in filter_option.find_all("div", {"class": "modal-settings-row"}):
-            if (msr_a := msr.find("a")) is not None:
-                if 'показать еще' in str.lower(msr.get_text()):
-                    msr_a_interact = driver.find_element(By.XPATH, xpath_soup(msr_a))
-                    msr_a_interact.click()
+    modal.refresh()
+    for section in modal.sections:
+        for msr_a in section.show_more_links:
+            msr_a_interact = modal.element(msr_a)
+            msr_a_interact.click()
 
 
 
-def uncollapse_options(driver):
+def uncollapse_options(driver, modal: FilterModal):
     """Make collapsed options visible"""
     try:
-        WebDriverWait(driver, 2).until(EC.visibility_of_all_elements_located((By.CLASS_NAME, 'title-collapse--more')))
-        WebDriverWait(driver, 2).until(EC.visibility_of_all_elements_located((By.CLASS_NAME, 'title-collapse--less')))
+        until(driver, 'show_more', 2, EC.visibility_of_all_elements_located((By.CLASS_NAME, 'title-collapse--more')))
+        until(driver, 'show_less', 2, EC.visibility_of_all_elements_located((By.CLASS_NAME, 'title-collapse--less')))
     except TimeoutException:
         print(f'Драйвер {get_pid()}: не удалось найти все опции фильтра')
         # uncollapse_options(driver)
         raise FillError
     
-    soup = BeautifulSoup(driver.page_source, 'html.parser')
-    filter_el = soup.find("div", {"class": "modal-settings-filter__main"})
-    filter_options = filter_el.find_all("div", {"class": "modal-settings-section"})
-    for filter_option in filter_options:
+    modal.refresh()
+    for section in modal.sections:
 
         # this field might be collapsed
-        filter_title_el = filter_option.find(
-            "div", {"class": "filter-title"}).find(
-                "div", {"class": "title-collapse title-collapse--more"}
-        )
-        if filter_title_el is None:
-            filter_title_el = filter_option.find(
-                "div", {"class": "filter-title"}).find(
-                    "div", {"class": "title-collapse title-collapse--less"}
-            )
+        if section.collapsed:
             # click to uncollapse
-            filter_title_interact = WebDriverWait(driver, 10).until(
-                EC.element_to_be_clickable((By.XPATH, xpath_soup(filter_title_el)))
+            filter_title_interact = until(driver, 'section_title', 10, 
+                EC.element_to_be_clickable(modal.element(section.collapsed_title))
             )
             native_click(filter_title_interact, driver)
 
             # make sure element is uncollapsed
-            WebDriverWait(filter_title_interact, 10).until(
+            until(filter_title_interact, 'section_uncollapse', 10, 
                 EC.text_to_be_present_in_element_attribute(
                     (By.XPATH, "."), 
                     "class", 
@@ -365,18 +550,13 @@ def uncollapse_options(driver):
             )
 
 
-def remove_selection(driver):
+def remove_selection(driver, modal: FilterModal):
     """Remove checkbox selection in all options"""
-    soup = BeautifulSoup(driver.page_source, 'html.parser')
-    filter_el = soup.find("div", {"class": "modal-settings-filter__main"})
-    filter_options = filter_el.find_all("div", {"class": "modal-settings-section"})
-    for filter_option in filter_options:
-        for msr in filter_option.find_all("div", {"class": "modal-settings-row filter-helpers"}):
-            if msr_a_all := msr.find_all("a"):
-                for msr_a in msr_a_all:
-                    if 'снять всё' in str.lower(msr_a.get_text()):
-                        msr_a_interact = driver.find_element(By.XPATH, xpath_soup(msr_a))
-                        msr_a_interact.click()
+    modal.refresh()
+    for section in modal.sections:
+        for msr_a in section.clear_links:
+            msr_a_interact = modal.element(msr_a)
+            msr_a_interact.click()
 
 
 def get_modal_settings_row(filter_option, search_entry: SearchEntry):
@@ -415,65 +595,68 @@ def click_search(driver):
     search_btn.click()
 
 
-def fill_search_params(driver, search_url, search_params):
-    # try:
-    #     driver.get(search_url)
-    #     # refresh if filter page load is stuck
-    #     WebDriverWait(driver, 10).until(EC.text_to_be_present_in_element_attribute(
-    #         (By.CLASS_NAME, 'consultation_modal'), 'style', 'display: none'))
-    # except TimeoutException:
-    #     print(f'Драйвер {get_pid()}: превышен лимит времени при переходе на страницу фильтров. Перезапускаю заполнение параметров')
-    #     driver.refresh()
-    #     return fill_search_params(driver, search_url, search_params)
-
-    # print(f'driver {get_pid()} redirected to serach_url')
-    # the below functions need to be called separately to recreate soup each time
-
+def prepare_filter_modal(driver, search_url):
+    """
+    Open filter page with all options uncollapsed and selection cleared
+    return: FilterModal
+    """
+    # the below functions share one modal snapshot, it is retaken only when modal DOM changes
     def __fill_prep(driver, search_url):
         driver.get(search_url)
-        WebDriverWait(driver, 10).until(EC.text_to_be_present_in_element_attribute(
+        until(driver, 'filter_page', 10, EC.text_to_be_present_in_element_attribute(
             (By.CLASS_NAME, 'consultation_modal'), 'style', 'display: none'))
 
-        uncollapse_options(driver)
-        show_more(driver)
-        remove_selection(driver)    
+        modal = FilterModal(driver)
+        uncollapse_options(driver, modal)
+        show_more(driver, modal)
+        remove_selection(driver, modal)
+        return modal
 
     no_err = False
     err_cnt, max_err_cnt = 0, 10
+    prep_started = time.perf_counter()
     while no_err != True and err_cnt < max_err_cnt:
 
         with futures.ThreadPoolExecutor() as executor:    
             future = executor.submit(__fill_prep, driver, search_url)
             try:
-                future.result(timeout=20)
+                modal = future.result(timeout=20)
                 no_err = True
-            except (futures.TimeoutError, TimeoutException, ElementClickInterceptedException, FillError):
+            except (futures.TimeoutError, TimeoutException, ElementClickInterceptedException, FillError, ModalNotFound):
                 print(f'Драйвер {get_pid()}: не удалось подготовить фильтры для заполнения. Перезапускаю заполнение')
+                metrics.retry('fill_prep')
                 driver.refresh()
                 err_cnt += 1
+    metrics.record('fill_prep', time.perf_counter() - prep_started)
             
     if err_cnt == max_err_cnt:
         raise FillRetryEndless
 
+    return modal
+
+
+def fill_search_params(driver, search_url, search_params, submit=True):
+    # try:
+    #     driver.get(search_url)
+    #     # refresh if filter page load is stuck
+    #     WebDriverWait(driver, 10).until(EC.text_to_be_present_in_element_attribute(
+    #         (By.CLASS_NAME, 'consultation_modal'), 'style', 'display: none'))
+    # except TimeoutException:
+    #     print(f'Драйвер {get_pid()}: превышен лимит времени при переходе на страницу фильтров. Перезапускаю заполнение параметров')
+    #     driver.refresh()
+    #     return fill_search_params(driver, search_url, search_params)
+
+    modal = prepare_filter_modal(driver, search_url)
+
     # print(f'driver {get_pid()} is ready to fill')
 
     # store fill success/failure results
     fill_failure = {}
 
-    soup = BeautifulSoup(driver.page_source, 'html.parser')
-    filter_el = soup.find("div", {"class": "modal-settings-filter__main"})
-    filter_options = filter_el.find_all("div", {"class": "modal-settings-section"})
-    
-    for filter_option in filter_options:
-        filter_title_el = filter_option.find(
-            "div", {"class": "filter-title"}).find(
-                "div", {"class": "title-collapse title-collapse--more"})
-        try:
-            filter_title_el_text = filter_title_el.get_text()
-        except AttributeError:
-            pass
-            # print(f'DOM object {filter_option.find("div", {"class": "filter-title"})} has no attribute <div> with classes "title-collapse title-collapse--more"')
-            # logging.error(f'DOM object {filter_option.find("div", {"class": "filter-title"})} has no attribute <div> with classes "title-collapse title-collapse--more"')
+    modal.refresh()
+    for section in modal.sections:
+        filter_option = section.el
+        filter_title_el_text = section.title
 
         # look for match of input field title with our options
         for search_entry in vars(search_params).values():
@@ -488,21 +671,198 @@ def fill_search_params(driver, search_url, search_params):
                 fill_res = fill_parameter(
                     driver, 
                     modal_settings_row, 
-                    search_entry)
+                    search_entry,
+                    modal)
                 fill_failure[search_entry.type] = fill_res
                 
     # separate fill logic for text
-    input = soup.find("div", {"class": "modal-settings-search"}).find(
-        "div", {"class": "main-search__controls"}).find(
-            "input"
-        )
+    input = modal.search_input
     keyword_search_params = search_params.keyword
-    fill_res = fill_parameter(driver, input, keyword_search_params)
+    fill_res = fill_parameter(driver, input, keyword_search_params, modal)
     fill_failure[search_entry.type] = fill_res
                 
-    click_search(driver)
+    if submit:
+        click_search(driver)
 
     return fill_failure
 
-    
-    
\ No newline at end of file
+
+def _batch_payload(search_params):
+    entries = []
+    for search_entry in vars(search_params).values():
+        if search_entry.type in (WidgetType.GRID, WidgetType.LIST):
+            entries.append({'name': search_entry.name, 'type': search_entry.type.value,
+                            'options': list(search_entry.options), 'extra': None})
+        if search_entry.type is WidgetType.DATE_RANGE:
+            date_interval = publish_interval(search_entry.extra)
+            entries.append({'name': search_entry.name, 'type': search_entry.type.value,
+                            'options': list(search_entry.options),
+                            'extra': [date_val.strftime("%d-%m-%Y") for date_val in date_interval]})
+
+    return {'entries': entries, 'keywords': list(search_params.keyword.options)}
+
+
+def fill_search_params_batched(driver, search_url, search_params):
+    """
+    Prepare modal and fill checkbox, date and keyword params with one script call.
+    OKPD tree or searchbox is still filled through the modal snapshot
+    """
+    okpd_entry = search_params.okpd
+    fill_okpd = bool(okpd_entry.options)
+
+    err_cnt, max_err_cnt = 0, 10
+    while True:
+        try:
+            driver.get(search_url)
+            until(driver, 'filter_page', 10, EC.text_to_be_present_in_element_attribute(
+                (By.CLASS_NAME, 'consultation_modal'), 'style', 'display: none'))
+            driver.set_script_timeout(20)
+            batch_res = driver.execute_async_script(
+                _BATCH_FILL_SCRIPT, _batch_payload(search_params), not fill_okpd)
+            if batch_res is None:
+                raise FillError
+            break
+        except (TimeoutException, JavascriptException, FillError):
+            print(f'Драйвер {get_pid()}: не удалось подготовить фильтры для заполнения. Перезапускаю заполнение')
+            err_cnt += 1
+            if err_cnt == max_err_cnt:
+                raise FillRetryEndless
+
+    # store fill success/failure results
+    fill_failure = {WidgetType(widget_type): failed for (widget_type, failed) in batch_res.items()}
+
+    if fill_okpd:
+        modal = FilterModal(driver)
+        section = modal.find_section(okpd_entry.name)
+        modal_settings_row = get_modal_settings_row(section.el, okpd_entry) if section is not None else None
+        fill_failure[okpd_entry.type] = fill_parameter(driver, modal_settings_row, okpd_entry, modal)
+        click_search(driver)
+
+    return fill_failure
+
+
+def build_okpd_index(driver, index_path, max_age_days=30):
+    """
+    Harvest OKPD tree into the index file unless the stored index still matches the site
+    return: number of indexed codes
+    """
+    modal = prepare_filter_modal(driver, filter_url())
+    section = modal.find_section(SearchParams().okpd.name)
+    if section is None or (code_tree := section.el.find("div", {"class": "settings-tree"})) is None:
+        print(f'Драйвер {get_pid()}: не найдено дерево ОКПД')
+        return 0
+    tree_ul = modal.element(code_tree.find("ul"))
+
+    index = OkpdIndex.load(index_path)
+    if index is not None and index.is_fresh(tree_fingerprint(driver, tree_ul), max_age_days):
+        return len(index)
+
+    print(f'Драйвер {get_pid()}: собираю индекс дерева ОКПД')
+    index = harvest(driver, tree_ul)
+    index.save(index_path)
+    print(f'Драйвер {get_pid()}: индекс дерева ОКПД собран, {len(index)} кодов')
+    return len(index)
+
+
+def _search_params_values(search_params):
+    values = {}
+    for key, search_entry in vars(search_params).items():
+        options = search_entry.options if isinstance(search_entry.options, str) else tuple(search_entry.options)
+        values[key] = (options, search_entry.extra)
+    # date filter is relative to today
+    values['publish_date'] += (date.today(), )
+    return values
+
+
+def _modal_state(driver):
+    try:
+        return driver.execute_script(_MODAL_STATE_SCRIPT)
+    except JavascriptException:
+        return None
+
+
+def _clear_section(driver, modal, section, search_entry):
+    """Reset params of one modal section before filling it again"""
+    if search_entry.type is WidgetType.DATE_RANGE:
+        for datepicker in section.datepickers:
+            for datepicker_cell in datepicker.inputs:
+                datepicker_interact = modal.element(datepicker_cell)
+                datepicker_interact.send_keys(Keys.CONTROL, 'a')
+                datepicker_interact.send_keys(Keys.BACKSPACE)
+        webdriver.ActionChains(driver).send_keys(Keys.ESCAPE).perform()
+    elif section.clear_links:
+        for msr_a in section.clear_links:
+            modal.element(msr_a).click()
+    else:
+        for checkbox in section.checkboxes:
+            if modal.element(checkbox.input).is_selected():
+                modal.element(checkbox.label).click()
+
+
+def _fill_changed_params(driver, search_params, prev_values, prev_failure):
+    modal = FilterModal(driver)
+    values = _search_params_values(search_params)
+    fill_failure = dict(prev_failure)
+
+    for key, search_entry in vars(search_params).items():
+        if values[key] == prev_values.get(key):
+            continue
+
+        if search_entry.type is WidgetType.TEXT:
+            driver.execute_script(_KEYWORD_CLEAR_SCRIPT)
+            modal.refresh()
+            fill_failure[search_entry.type] = fill_parameter(driver, modal.search_input, search_entry, modal)
+            continue
+
+        if (section := modal.find_section(search_entry.name)) is None:
+            continue
+        _clear_section(driver, modal, section, search_entry)
+        modal.refresh()
+        section = modal.find_section(search_entry.name)
+        fill_failure[search_entry.type] = fill_parameter(
+            driver, 
+            get_modal_settings_row(section.el, search_entry), 
+            search_entry,
+            modal)
+
+    return fill_failure
+
+
+def _warm_key(driver):
+    """Tab sessions of one browser share its session id, each keeps its own modal"""
+    return getattr(driver, 'tab_handle', None) or driver.session_id
+
+
+def fill_search_params_warm(driver, search_url, search_params):
+    """
+    Go back to the modal prepared by the previous fill on this driver and change only params
+    that differ. Falls back to the full fill if the modal is not in the state it was left in
+    """
+    prev = _WARM_STATE.pop(_warm_key(driver), None)
+
+    fill_failure = None
+    if prev is not None:
+        prev_values, prev_failure, prev_modal_state, modal_history_idx = prev
+        try:
+            driver.execute_script(
+                "window.history.go(arguments[0] - (window.history.length - 1));", modal_history_idx)
+            until(driver, 'modal_history', 10, lambda driver: _modal_state(driver) is not None)
+            if _modal_state(driver) == prev_modal_state:
+                fill_failure = _fill_changed_params(driver, search_params, prev_values, prev_failure)
+        except (TimeoutException, ElementClickInterceptedException, ModalNotFound):
+            pass
+
+        if fill_failure is None:
+            print(f'Драйвер {get_pid()}: фильтры изменились с прошлого поиска, перезагружаю страницу фильтров')
+
+    if fill_failure is None:
+        fill_failure = fill_search_params(driver, search_url, search_params, submit=False)
+
+    _WARM_STATE[_warm_key(driver)] = (
+        _search_params_values(search_params),
+        fill_failure,
+        _modal_state(driver),
+        driver.execute_script("return window.history.length - 1;"))
+    click_search(driver)
+
+    return fill_failure
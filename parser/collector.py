@@ -1,16 +1,32 @@
-from bs4 import BeautifulSoup
 from selenium.webdriver.common.by import By
-from selenium.webdriver.support.wait import WebDriverWait
 import selenium.webdriver.support.expected_conditions as EC
 from selenium.common.exceptions import (
     TimeoutException, 
     ElementClickInterceptedException, 
     StaleElementReferenceException)
 import re
+import time
+import logging
+from math import ceil
+from datetime import datetime
+from urllib.parse import urlparse, urlunparse, urljoin, parse_qsl, urlencode
 from typing import Tuple, Callable
 from dataclasses import dataclass
 
-from .utils import xpath_soup, native_click, get_pid
+from .utils import xpath_soup, native_click, get_pid, make_soup
+from .waits import until
+from . import metrics
+from .driver import count_page
+from .tabs import PAGE_LOAD_TIMEOUT
+
+
+RES_PER_PAGE = 10
+# page parameter of the http engine, browser takes it from pager links of the results page
+PAGE_PARAM = 'page'
+# results ordering for incremental runs, it is verified on the first page of every query, see sorted_stop
+SORT_PARAM = 'sort'
+SORT_NEWEST = 'publishDate_desc'
+_DATE_RE = re.compile(r"\b(\d{2}\.\d{2}\.\d{4})\b")
 
 
 @dataclass
@@ -20,20 +36,18 @@ class CollectRes:
     pfid: str = ''
 
 
-def filter_unique(path):
-    if path.is_file():
-        with open(path, 'r') as f:
-            records = set([l.strip() for l in f.readlines()])
-        with open(path, 'w') as f:
-            for rec in records:
-                f.write(f'{rec}\n')
+class TooManyPages(Exception):
+    """Result set has more pages than the task is allowed to collect"""
+    def __init__(self, count):
+        super().__init__(count)
+        self.count = count
 
 
 def close_popup(driver):
     popup_close_btn = driver.find_element(By.CLASS_NAME, 'consultation_modal').find_element(
         By.CLASS_NAME, 'modal-close'
     )
-    WebDriverWait(driver, 10).until(EC.element_to_be_clickable(popup_close_btn)).click()
+    until(driver, 'popup_close', 10, EC.element_to_be_clickable(popup_close_btn)).click()
 
 
 
@@ -44,11 +58,11 @@ def next_page(driver, page_num):
     """
     pager_interact = driver.find_element(By.ID, 'pager')
     try:
-        WebDriverWait(pager_interact, 2).until(EC.visibility_of_all_elements_located((By.TAG_NAME, "li")))
+        until(pager_interact, 'pager', 2, EC.visibility_of_all_elements_located((By.TAG_NAME, "li")))
     except TimeoutException:    # no pages hence empty search result
         return False
 
-    soup = BeautifulSoup(driver.page_source, 'html.parser')
+    soup = make_soup(driver.page_source)
     li_pages = soup.find('ul', {'id': 'pager'}).find_all('li')
     for page in li_pages:
         try:
@@ -56,17 +70,17 @@ def next_page(driver, page_num):
             if next_link.get_text() == str(page_num):
                 current_url = driver.current_url
                 try:
-                    el_click = WebDriverWait(driver, 20).until(
+                    el_click = until(driver, 'pager_link', 20, 
                         EC.element_to_be_clickable((By.XPATH, xpath_soup(next_link))))
                     native_click(el_click, driver)
                 except ElementClickInterceptedException:
                     close_popup(driver)
-                    el_click = WebDriverWait(driver, 20).until(
+                    el_click = until(driver, 'pager_link', 20, 
                         EC.element_to_be_clickable((By.XPATH, xpath_soup(next_link)))).click()
                     native_click(el_click, driver)
                 # only return when successfully redirected
                 try:
-                    WebDriverWait(driver, 20).until(lambda driver: driver.current_url != current_url)
+                    until(driver, 'page_change', 20, lambda driver: driver.current_url != current_url)
                 except TimeoutException:
                     driver.refresh()
                     return next_page(driver, page_num)
@@ -82,24 +96,73 @@ def _clean_label(txt):
     return re.search(r"№\s?(\d+)", txt).group(1)
 
 
+def _reported_empty(driver):
+    """Result counter is rendered and reports zero notifications"""
+    count_text = driver.execute_script(
+        "var span = document.querySelector('#Notifications .main-tabs__count span');"
+        "return span ? span.textContent : null;")
+    if not count_text:
+        return False
+    digits = ''.join([c for c in count_text if c.isnumeric()])
+    return digits != '' and int(digits) == 0
+
+
+def _cards_or_empty(driver):
+    """
+    Expectation for card items to be visible. Ends early when the counter reports no results
+    return: 'cards', 'empty' or False while waiting
+    """
+    def _predicate(content):
+        try:
+            cards = content.find_elements(By.CLASS_NAME, "card-item")
+            if cards and all(card.is_displayed() for card in cards):
+                return 'cards'
+        except StaleElementReferenceException:
+            return False
+        return 'empty' if _reported_empty(driver) else False
+
+    return _predicate
+
+
 def collect_page_contents(driver):
     """
     Returns page contents in the form of list of tuples (number, url)
     return: Tuple[str, str]
     """
+    started = time.perf_counter()
+    collected = _collect_page_contents(driver)
+    metrics.record('collect_page', time.perf_counter() - started, len(collected))
+    count_page(driver)
+    return collected
+
+
+def _collect_page_contents(driver):
     collected = []
 
     # card items dont seem to appear immidiately
-    content_interact = WebDriverWait(driver, 5).until(EC.visibility_of_element_located((By.ID, 'content')))
+    content_interact = until(driver, 'content', 5, EC.visibility_of_element_located((By.ID, 'content')))
     # content_interact = driver.find_element(By.ID, 'content')
     try:
-        WebDriverWait(content_interact, 3).until(EC.visibility_of_all_elements_located((By.CLASS_NAME, "card-item")))
+        found = until(content_interact, 'cards', 3, _cards_or_empty(driver))
     except TimeoutException:    # if no card items then search result is empty
         return collected
+    if found == 'empty':
+        return collected
+
+    return parse_page_contents(driver.page_source)
 
-    # parse html tree
-    soup = BeautifulSoup(driver.page_source, 'html.parser')
+
+def parse_page_contents(html):
+    """
+    Parses card items of the results page html
+    return: List[Tuple[str, str]] of (number, url)
+    """
+    collected = []
+
+    soup = make_soup(html)
     content = soup.find('div', {'id': 'content'})
+    if content is None:
+        return collected
     for card in content.find_all('div', {'class': 'card-item'}):
         url_tag = card.find('div', {'class': 'card-item__about'}).find('a')
         href = url_tag.get('href')
@@ -109,13 +172,38 @@ def collect_page_contents(driver):
     return collected
 
 
-def collect_num_info(driver, num_url):
+def parse_result_count(html):
+    """
+    Parses total number of notifications from the results page html
+    return: int or None if the counter is not present
+    """
+    soup = make_soup(html)
+    count_btn = soup.find(id='Notifications')
+    if count_btn is None:
+        return None
+    count_tab = count_btn.find(class_='main-tabs__count')
+    if count_tab is None or count_tab.find('span') is None:
+        return None
+    count_text = ''.join([c for c in count_tab.find('span').get_text() if c.isnumeric()])
+    if not count_text:
+        return None
+    return int(count_text)
+
+
+def collect_num_info(driver, num_url, retries=2):
+    with metrics.timed('num_info', 1):
+        col_res = _collect_num_info(driver, num_url, retries)
+    count_page(driver)
+    return col_res
+
+
+def _collect_num_info(driver, num_url, retries=2):
     notif_num, url = num_url
 
     # redirect
     driver.get(url)
     try:
-        WebDriverWait(driver, 4).until(lambda driver: 'zakupki' in driver.current_url)
+        until(driver, 'zakupki_redirect', 4, lambda driver: 'zakupki' in driver.current_url)
     except TimeoutException:
         print(f'Драйвер {get_pid()}: ссылка для извещения {notif_num} не ведет на сайт закупок')
         return CollectRes(notif_num)
@@ -130,7 +218,7 @@ def collect_num_info(driver, num_url):
     
     # get pfid
     try:
-        pfid_candidate_tags = WebDriverWait(driver, 5).until(EC.visibility_of_element_located(
+        pfid_candidate_tags = until(driver, 'zakupki_pfid', 5, EC.visibility_of_element_located(
             (By.CLASS_NAME, 'search-results'))).find_element(
                 By.CLASS_NAME, 'registry-entry__header-top__icon').find_elements(
                     By.TAG_NAME, 'a')
@@ -138,8 +226,12 @@ def collect_num_info(driver, num_url):
         pfid_url = pfid_tag.get_attribute('href')
         pfid = re.search(r"pfid=(\d+)", pfid_url).group(1)
     except TimeoutException:
+        if retries <= 0:
+            print(f'Драйвер {get_pid()}: не удалось получить pfid извещения {notif_num}')
+            return CollectRes(notif_num, noticeinfoid)
+        metrics.retry('num_info')
         driver.refresh()
-        return collect_num_info(driver, num_url)
+        return _collect_num_info(driver, num_url, retries - 1)
 
     return CollectRes(notif_num, noticeinfoid, pfid)
 
@@ -160,51 +252,326 @@ def element_text_is_not_empty(locator: Tuple[str, str]) -> Callable:
     return _predicate
 
 
-def progress_bar_len(driver, res_per_page=10):
-    count_btn = WebDriverWait(driver, 10).until(EC.presence_of_element_located((By.ID, "Notifications")))
-    count_tab = WebDriverWait(count_btn, 10).until(EC.presence_of_element_located((By.CLASS_NAME, "main-tabs__count")))
-    WebDriverWait(count_tab, 10).until(element_text_is_not_empty((By.TAG_NAME, "span")))
+def result_count(driver):
+    """Total number of notifications reported by the results page"""
+    count_btn = until(driver, 'result_count', 10, EC.presence_of_element_located((By.ID, "Notifications")))
+    count_tab = until(count_btn, 'result_count_tab', 10, EC.presence_of_element_located((By.CLASS_NAME, "main-tabs__count")))
+    until(count_tab, 'result_count_text', 10, element_text_is_not_empty((By.TAG_NAME, "span")))
     count_text = count_tab.find_element(By.TAG_NAME, "span").text
-    count = int(''.join([c for c in count_text if c.isnumeric()]))
+    return int(''.join([c for c in count_text if c.isnumeric()]))
+
+
+def _replace_param(url, param, value=None):
+    parsed = urlparse(url)
+    query = [(k, v) for (k, v) in parse_qsl(parsed.query, keep_blank_values=True) if k != param]
+    if value is not None:
+        query.append((param, value))
+    return urlunparse(parsed._replace(query=urlencode(query)))
+
+
+def page_url(url, page_num, param=PAGE_PARAM):
+    """Results page url addressed by page index"""
+    return _replace_param(url, param, str(page_num) if page_num > 1 else None)
+
+
+def pager_page_param(html, url):
+    """
+    Query parameter pager links of the results page address pages by
+    return: parameter name or None if the pager has no link to page 2 telling it
+    """
+    soup = make_soup(html)
+    pager = soup.find('ul', {'id': 'pager'})
+    if pager is None:
+        return None
+    query = dict(parse_qsl(urlparse(url).query, keep_blank_values=True))
+    for link in pager.find_all('a', {'class': 'page-link'}):
+        href = link.get('href')
+        if link.get_text().strip() != '2' or not href or href.startswith(('#', 'javascript')):
+            continue
+        link_query = parse_qsl(urlparse(urljoin(url, href)).query, keep_blank_values=True)
+        for k, v in link_query:
+            if v == '2' and query.get(k) != '2':
+                return k
+    return None
+
+
+def newest_first_url(url):
+    """Results url sorted by publish date, newest first"""
+    return _replace_param(url, SORT_PARAM, SORT_NEWEST)
+
+
+def known_page_stop(known):
+    """
+    Stop condition for incremental runs
+    known: numbers found by the query in the previous run
+    return: callback telling if a collected page is already known as a whole
+    """
+    def _stop(page_collected):
+        return bool(page_collected) and all(num_url[0] in known for num_url in page_collected)
+
+    return _stop
+
+
+def parse_publish_dates(html):
+    """
+    Publish dates of card items of the results page html, the first date a card shows
+    return: List[date] or None if some card shows no date
+    """
+    soup = make_soup(html)
+    content = soup.find('div', {'id': 'content'})
+    if content is None:
+        return None
+    dates = []
+    for card in content.find_all('div', {'class': 'card-item'}):
+        match = _DATE_RE.search(card.get_text(' '))
+        if match is None:
+            return None
+        try:
+            dates.append(datetime.strptime(match.group(1), '%d.%m.%Y').date())
+        except ValueError:
+            return None
+    return dates
+
+
+def sorted_stop(stop, html, page_collected):
+    """
+    Stop condition of an incremental run kept only when the first page shows results sorted newest first.
+    If the site ignored the sort, a page of known numbers does not mean the pages after it are known too.
+    Without dates on the cards the first page must have numbers which are not known
+    return: stop or None when all pages have to be collected
+    """
+    if stop is None:
+        return None
+    dates = parse_publish_dates(html)
+    if dates is not None:
+        newest_first = all(prev >= cur for prev, cur in zip(dates, dates[1:]))
+    else:
+        newest_first = not stop(page_collected)
+    if newest_first:
+        return stop
+    metrics.retry('sort_unverified')
+    logging.warning(f'Process {get_pid()}: results are not sorted newest first, collecting all pages')
+    return None
+
+
+def distinct_count(collected):
+    """Number of distinct notifications collected, a page read twice does not count"""
+    return len({num_url[0] for num_url in collected})
+
+
+def _start_load(driver, url):
+    """
+    Starts navigation of the current tab without waiting for page load
+    return: root element of the page being left
+    """
+    old_root = driver.find_element(By.TAG_NAME, 'html')
+    driver.execute_script("window.location.href = arguments[0];", url)
+    return old_root
+
+
+def _wait_load(driver, url, old_root):
+    """Waits until the tab shows the page of the url, so the page it left is not collected"""
+    try:
+        until(driver, 'tab_navigation', PAGE_LOAD_TIMEOUT, EC.staleness_of(old_root))
+        until(driver, 'tab_page_load', PAGE_LOAD_TIMEOUT,
+              lambda driver: driver.current_url == url and 
+              driver.execute_script("return document.readyState") == 'complete')
+    except TimeoutException:
+        metrics.retry('tab_page_load')
+        driver.get(url)
+
 
-    return int(count / res_per_page)
+def _collect_page_retry(driver, url):
+    collected = collect_page_contents(driver)
+    # planned page can't be empty, so it was not rendered in time
+    if not collected:
+        metrics.retry('collect_page')
+        driver.get(url)
+        collected = collect_page_contents(driver)
+    return collected
+
+
+def _page_done(collected, page_collected, on_page, journal=None, url=None):
+    collected.extend(page_collected)
+    if on_page is not None and page_collected:
+        on_page(page_collected)
+    if journal is not None and page_collected:
+        journal.record(url, page_collected)
+
+
+def _resumed_pages(collected, urls, on_page, journal):
+    """
+    Pages collected before the run stopped are taken from the journal
+    return: urls which still have to be loaded
+    """
+    if journal is None:
+        return urls
+    for url in urls:
+        if url in journal.done:
+            _page_done(collected, journal.done[url], on_page)
+    return [url for url in urls if url not in journal.done]
+
+
+def collect_pages(driver, urls, tabs=1, on_page=None, stop=None, journal=None):
+    """
+    Collects pages addressed by url. With several tabs pages of a batch load concurrently
+    on_page: optional callback receiving every collected page
+    stop: optional callback, pages after the one it returns True for are not collected
+    journal: optional PageJournal every collected page is recorded to
+    return: List[Tuple[str, str]] of (number, url)
+    """
+    collected = []
+    if tabs <= 1:
+        for url in urls:
+            driver.get(url)
+            page_collected = _collect_page_retry(driver, url)
+            _page_done(collected, page_collected, on_page, journal, url)
+            if stop is not None and stop(page_collected):
+                break
+        return collected
+
+    main_handle = driver.current_window_handle
+    handles = [main_handle]
+    for _ in range(min(tabs, len(urls)) - 1):
+        driver.switch_to.new_window('tab')
+        handles.append(driver.current_window_handle)
+
+    try:
+        for batch in [urls[i:i + len(handles)] for i in range(0, len(urls), len(handles))]:
+            # start navigation in every tab without waiting for page load
+            old_roots = []
+            for handle, url in zip(handles, batch):
+                driver.switch_to.window(handle)
+                old_roots.append(_start_load(driver, url))
+            stopped = False
+            for handle, url, old_root in zip(handles, batch, old_roots):
+                driver.switch_to.window(handle)
+                _wait_load(driver, url, old_root)
+                page_collected = _collect_page_retry(driver, url)
+                _page_done(collected, page_collected, on_page, journal, url)
+                if stop is not None and stop(page_collected):
+                    stopped = True
+                    break
+            if stopped:
+                break
+    finally:
+        for handle in handles[1:]:
+            driver.switch_to.window(handle)
+            driver.close()
+        driver.switch_to.window(main_handle)
+
+    return collected
 
 
-def collect(driver):
+def _collect_sequential(driver, on_page=None, stop=None):
+    """Walks the pager from the page the driver is on"""
     collected = []
 
-    collected.extend(collect_page_contents(driver))
+    page_collected = collect_page_contents(driver)
+    _page_done(collected, page_collected, on_page)
+    # empty first page means empty result set, pager is not waited for
+    if not page_collected:
+        return collected
+    stop = sorted_stop(stop, driver.page_source, page_collected)
     next_page_numb = 2
 
-    while next_page(driver, next_page_numb):
-        collected.extend(collect_page_contents(driver))
+    while not (stop is not None and stop(page_collected)) and next_page(driver, next_page_numb):
+        page_collected = collect_page_contents(driver)
+        _page_done(collected, page_collected, on_page)
         next_page_numb += 1
 
     return collected
 
 
-def output_collected(output_file, collected, db_conn, fz):
-    if fz == '44':
-        collected  = [col for col in collected if (len(col) == 19)]
-        collected = list(set(collected))
+def _collect_missing(driver, search_url, collected, on_page=None, stop=None):
+    """
+    Walks the pager of the search from its first page when planned page urls failed,
+    only numbers they did not collect are kept
+    return: List[Tuple[str, str]] of (number, url)
+    """
+    metrics.retry('collect_sequential')
+    seen = {num_url[0] for num_url in collected}
+    driver.get(search_url)
+    missing = [num_url for num_url in _collect_sequential(driver, stop=stop) if num_url[0] not in seen]
+    if on_page is not None and missing:
+        on_page(missing)
+    return missing
 
-    # collected = [col for col in collected if (len(col.notif_num) == 19) or 
-    #                                          (len(col.notif_num) == 11 and col.notif_num.startswith('3'))]
-    
-    elif fz == '223':
-        collected = [col for col in collected if (len(col.notif_num) == 11 and col.notif_num.startswith('3'))]
-    
-    new_collected = db_conn.get_new_numbers(collected, fz)
-    if new_collected:
-        with open(output_file, 'a') as f:
-            for col in new_collected:
-
-                if fz == '44':
-                    print_str = col
-                elif fz == '223':
-                    col_res_nonempty = [num for num in [col.notif_num, col.noticeinfoid, col.pfid] if num != '']
-                    print_str = ';'.join([num for num in col_res_nonempty])
-                print(print_str, file=f)
-    
-    print(f'Найдено {len(collected)} уникальных, из них {len(new_collected)} новых')
-    len(new_collected)
\ No newline at end of file
+
+def collect(driver, tabs=1, on_page=None, stop=None, journal=None, max_pages=None):
+    """
+    Collects all result pages. Page urls are planned from the reported result count and pager links,
+    the pager is walked instead when they do not lead to further pages
+    on_page: optional callback receiving every collected page
+    stop: optional callback for incremental runs. Results are sorted newest first
+        and pages after the one it returns True for are not collected
+    journal: optional PageJournal. Pages are recorded to it, pages it already has are not loaded
+    max_pages: optional page limit, TooManyPages is raised before collecting a larger result set
+    return: List[Tuple[str, str]] of (number, url)
+    """
+    if stop is not None:
+        driver.get(newest_first_url(driver.current_url))
+    try:
+        count = result_count(driver)
+    except TimeoutException:
+        # no result counter to plan pages with, walk the pager
+        return _collect_sequential(driver, on_page, stop)
+    if count == 0:
+        return []
+    if max_pages is not None and ceil(count / RES_PER_PAGE) > max_pages:
+        raise TooManyPages(count)
+
+    search_url = driver.current_url
+    collected = []
+    page_collected = collect_page_contents(driver)
+    _page_done(collected, page_collected, on_page, journal, search_url)
+    stop = sorted_stop(stop, driver.page_source, page_collected)
+    if stop is not None and stop(page_collected):
+        return collected
+    if count <= len(page_collected):
+        return collected
+
+    param = pager_page_param(driver.page_source, search_url)
+    if param is None:
+        logging.warning(f'Process {get_pid()}: no page parameter in pager links, walking pager for {search_url}')
+        collected.extend(_collect_missing(driver, search_url, collected, on_page, stop))
+        return collected
+    urls = [page_url(search_url, page_num, param) for page_num in range(2, ceil(count / RES_PER_PAGE) + 1)]
+    urls = _resumed_pages(collected, urls, on_page, journal)
+
+    # page 2 has to differ from page 1, otherwise the site ignores the page parameter
+    if urls and urls[0] == page_url(search_url, 2, param):
+        second_collected = collect_pages(driver, urls[:1])
+        if not {num_url[0] for num_url in second_collected} - {num_url[0] for num_url in page_collected}:
+            logging.warning(f'Process {get_pid()}: page 2 repeats page 1, walking pager for {search_url}')
+            collected.extend(_collect_missing(driver, search_url, collected, on_page, stop))
+            return collected
+        _page_done(collected, second_collected, on_page, journal, urls[0])
+        if stop is not None and stop(second_collected):
+            return collected
+        urls = urls[1:]
+    collected.extend(collect_pages(driver, urls, tabs, on_page, stop, journal))
+
+    # pages read twice or out of place repeat numbers, only distinct ones tell if the result set is complete
+    found = distinct_count(collected)
+    if stop is not None and found < count:
+        logging.info(f'Process {get_pid()}: stopped at known page, {found} of {count} for {search_url}')
+        return collected
+    if found < count:
+        logging.warning(f'Process {get_pid()}: planned pages gave {found} of {count}, walking pager for {search_url}')
+        collected.extend(_collect_missing(driver, search_url, collected, on_page))
+        found = distinct_count(collected)
+    if found < count:
+        print(f'Драйвер {get_pid()}: собрано {found} из {count} найденных, результат неполный')
+        logging.warning(f'Process {get_pid()}: truncated result set {found} of {count} for {search_url}')
+
+    return collected
+
+
+def is_valid_num(notif_num, fz):
+    """Notification number format of the law"""
+    if fz == '44':
+        return len(notif_num) == 19
+    if fz == '223':
+        return len(notif_num) == 11 and notif_num.startswith('3')
+    return False
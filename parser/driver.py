@@ -1,14 +1,287 @@
 from selenium import webdriver
+from selenium.webdriver.support.wait import WebDriverWait
+from selenium.common.exceptions import TimeoutException, WebDriverException, SessionNotCreatedException
+from webdriver_manager.chrome import ChromeDriverManager
+from webdriver_manager.core.driver_cache import DriverCacheManager
+from webdriver_manager.core.os_manager import OperationSystemManager, ChromeType
+from urllib3.exceptions import HTTPError
 import multiprocessing as mp
+from pathlib import Path
+import json
+import sys
 import time
+import logging
+
+try:
+    import psutil
+except ImportError:     # memory budget of drivers is not checked without it
+    psutil = None
+
+from .utils import set_html_parser, get_pid
+from .waits import init_policy, save_policy
+from . import metrics
 
 
 WEBSITE_URL = r'https://www.rts-tender.ru/'
 
 DRIVER = None   # this variable is local to each subprocess
+SITE_URL = WEBSITE_URL  # site the driver searches, local to each subprocess
+_PROFILE_LOCK = None    # held while the driver uses its profile slot
+_TRAFFIC_STATS = False  # network events are read from performance log in lean mode
+_INIT_KWDS = None   # the driver is restarted with the same arguments when recycled
+_PAGES = 0  # pages loaded by the current browser
+
+# resources lean mode does not load. Consultation modal is left, filter page waits for it to hide
+LEAN_BLOCKED_URLS = [
+    '*.png', '*.jpg', '*.jpeg', '*.gif', '*.webp', '*.svg', '*.ico',
+    '*.woff', '*.woff2', '*.ttf', '*.otf', '*.eot',
+    '*.mp4', '*.webm',
+    '*google-analytics.com*', '*googletagmanager.com*', '*mc.yandex.ru*', '*top-fwz1.mail.ru*',
+    '*vk.com/rtrg*', '*facebook.net*', '*jivosite.com*', '*jivo.ru*',
+]
+
+# chrome features a scraping session does not use
+LEAN_ARGUMENTS = [
+    '--disable-extensions',
+    '--disable-background-networking',
+    '--disable-component-update',
+    '--disable-default-apps',
+    '--disable-sync',
+    '--disable-translate',
+    '--no-first-run',
+    '--mute-audio',
+    '--metrics-recording-only',
+    '--disable-features=Translate,OptimizationHints,MediaRouter,AutofillServerCommunication',
+    '--blink-settings=imagesEnabled=false',
+]
+
+
+def browser_major_version():
+    """Major version of installed chrome, None if it can't be detected"""
+    version = OperationSystemManager().get_browser_version_from_os(ChromeType.GOOGLE)
+    return version.split('.')[0] if version else None
+
+
+def install_driver(cache_dir, version=None, refresh=False):
+    """
+    Resolve chromedriver binary. Once installed, its path is pinned in the cache with the major version
+    of chrome it was resolved for, and reused without network access until another version is requested.
+    Without requested version the driver is resolved again once chrome updates to another major version
+    refresh: resolve again even if pinned, e.g. chrome refused the pinned driver
+    return: path to chromedriver
+    """
+    cache_dir = Path(cache_dir)
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    pin_path = cache_dir / 'driver.json'
+    browser_major = browser_major_version()
+
+    if pin_path.is_file() and not refresh:
+        with open(pin_path, encoding='utf-8') as f:
+            pin = json.load(f)
+        if Path(pin['path']).is_file() and version in (None, pin['version']) and \
+                (version is not None or browser_major is None or pin.get('browser_major') == browser_major):
+            return pin['path']
+
+    cache_manager = DriverCacheManager(root_dir=str(cache_dir), valid_range=365)
+    manager = ChromeDriverManager(driver_version=version, cache_manager=cache_manager)
+    driver_path = manager.install()
+    # drivers starting at once may resolve it together, pin is replaced as a whole
+    tmp_path = pin_path.with_suffix(f'.{get_pid()}.tmp')
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump({
+            'version': version or manager.driver.get_driver_version_to_download(), 
+            'path': driver_path, 
+            'browser_major': browser_major}, f)
+    tmp_path.replace(pin_path)
+
+    return driver_path
+
+
+def _try_lock(lock_path):
+    """Exclusive lock released by OS when the process dies. return: file handle or None"""
+    f = open(lock_path, 'a+')
+    try:
+        if sys.platform == 'win32':
+            import msvcrt
+            f.seek(0)
+            msvcrt.locking(f.fileno(), msvcrt.LK_NBLCK, 1)
+        else:
+            import fcntl
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        f.close()
+        return None
+    return f
+
+
+def _acquire_profile(profile_dir):
+    """
+    Pick the first free profile slot. Chrome can't share a profile between processes,
+    so each driver locks its slot. Slots persist with their disk cache between runs
+    return: profile path
+    """
+    global _PROFILE_LOCK
+    profile_dir = Path(profile_dir)
+    profile_dir.mkdir(parents=True, exist_ok=True)
+
+    slot = 0
+    while True:
+        if (lock := _try_lock(profile_dir / f'driver_{slot}.lock')) is not None:
+            _PROFILE_LOCK = lock
+            return profile_dir / f'driver_{slot}'
+        slot += 1
+
+
+def _wait_ready(driver, timeout=30):
+    """Readiness probe instead of fixed sleep"""
+    try:
+        WebDriverWait(driver, timeout).until(
+            lambda driver: driver.execute_script("return document.readyState") == 'complete')
+    except TimeoutException:
+        print(f'Драйвер {get_pid()}: стартовая страница не загрузилась за {timeout} с')
+
+
+def _lean_options(options):
+    """Trim chrome features and images through flags and prefs"""
+    for argument in LEAN_ARGUMENTS:
+        options.add_argument(argument)
+    options.add_experimental_option('prefs', {
+        'profile.managed_default_content_settings.images': 2,
+        'profile.default_content_setting_values.notifications': 2,
+        'profile.default_content_setting_values.geolocation': 2,
+    })
+    # network events give loaded bytes and blocked requests
+    options.set_capability('goog:loggingPrefs', {'performance': 'ALL'})
 
 
-def init_driver(driver_path, headless=True):
+def _block_urls(driver, blocked_urls):
+    driver.execute_cdp_cmd('Network.enable', {})
+    driver.execute_cdp_cmd('Network.setBlockedURLs', {'urls': blocked_urls})
+
+
+def record_traffic(driver):
+    """
+    Count requests, bytes and blocked requests from network events since the previous call.
+    Does nothing out of lean mode
+    """
+    if not _TRAFFIC_STATS:
+        return
+    loaded, loaded_bytes, blocked = 0, 0, 0
+    try:
+        entries = driver.get_log('performance')
+    except WebDriverException:
+        return
+    for entry in entries:
+        message = json.loads(entry['message'])['message']
+        if message['method'] == 'Network.loadingFinished':
+            loaded += 1
+            loaded_bytes += int(message['params'].get('encodedDataLength', 0))
+        elif message['method'] == 'Network.loadingFailed' and message['params'].get('blockedReason'):
+            blocked += 1
+    metrics.record('requests_loaded', 0, loaded)
+    metrics.record('bytes_loaded', 0, loaded_bytes)
+    metrics.record('requests_blocked', 0, blocked)
+
+
+def count_page(driver):
+    """Called after every page the driver loaded"""
+    global _PAGES
+    _PAGES += 1
+    record_traffic(driver)
+
+
+def browser_rss():
+    """
+    Resident memory of chromedriver and the browser processes it started
+    return: bytes or None without psutil
+    """
+    if psutil is None or DRIVER is None:
+        return None
+    try:
+        proc = psutil.Process(DRIVER.service.process.pid)
+        procs = [proc] + proc.children(recursive=True)
+    except (psutil.Error, AttributeError):
+        return None
+    rss = 0
+    for proc in procs:
+        try:
+            rss += proc.memory_info().rss
+        except psutil.Error:
+            pass
+    return rss
+
+
+def driver_alive():
+    """Health check, crashed browser or chromedriver does not answer"""
+    if DRIVER is None:
+        return False
+    try:
+        DRIVER.current_window_handle
+    except (WebDriverException, HTTPError):
+        return False
+    return True
+
+
+def recycle_driver_if_needed():
+    """
+    Called between tasks. Checks the driver is alive, samples browser memory and restarts
+    the driver once it died or passed its memory or page budget
+    return: True if the driver was restarted
+    """
+    if _INIT_KWDS is None:
+        return False
+    rss = browser_rss()
+    rss_mb = round(rss / 2 ** 20, 1) if rss is not None else None
+    metrics.sample('browser_memory', rss_mb=rss_mb, pages=_PAGES)
+
+    max_rss_mb, max_pages = _INIT_KWDS['recycle_rss_mb'], _INIT_KWDS['recycle_pages']
+    if not driver_alive():
+        reason = 'браузер не отвечает'
+    elif max_rss_mb and rss_mb is not None and rss_mb > max_rss_mb:
+        reason = f'память {rss_mb:.0f} МБ'
+    elif max_pages and _PAGES >= max_pages:
+        reason = f'загружено {_PAGES} страниц'
+    else:
+        return False
+
+    print(f'Драйвер {get_pid()}: перезапуск браузера, {reason}')
+    logging.warning(f'Process {get_pid()}: driver recycled at {rss_mb} MB after {_PAGES} pages')
+    pages = _PAGES
+    started = time.perf_counter()
+    quit_driver()
+    init_driver(**_INIT_KWDS)
+    metrics.record('driver_recycle', time.perf_counter() - started)
+    metrics.sample('driver_recycle', rss_mb=rss_mb, pages=pages)
+    return True
+
+
+def init_driver(driver_path, headless=True, html_parser='html.parser', profile_dir=None, wait_policy=None, 
+                metrics_dir=None, lean=False, blocked_urls=None, 
+                recycle_rss_mb=None, recycle_pages=None, website_url=WEBSITE_URL, 
+                driver_cache_dir=None, driver_version=None):
+    """
+    Start subprocess driver
+    wait_policy: optional WaitPolicy keyword arguments, timeouts of waits are then learned
+    metrics_dir: optional folder stage stats of the subprocess are dumped to when the driver quits
+    lean: block heavy resources and unused chrome features. Loaded bytes and blocked requests are counted
+    blocked_urls: url patterns blocked in lean mode, LEAN_BLOCKED_URLS by default
+    recycle_rss_mb, recycle_pages: budget of the browser, see recycle_driver_if_needed
+    website_url: site to search, a local stand-in serving the same pages can be used
+    driver_cache_dir, driver_version: see install_driver, chromedriver is resolved again
+        if chrome refuses it after an update
+    return: start up timings in seconds
+    """
+    global _INIT_KWDS, _PAGES, SITE_URL
+    _INIT_KWDS = dict(locals())
+    _PAGES = 0
+    SITE_URL = website_url
+
+    started = time.perf_counter()
+    set_html_parser(html_parser)
+    metrics.init_metrics(metrics_dir)
+    if wait_policy is not None:
+        init_policy(website_url, **wait_policy)
+
     service = webdriver.ChromeService(driver_path)
     options = webdriver.ChromeOptions()
 
@@ -23,23 +296,73 @@ def init_driver(driver_path, headless=True):
     options.add_argument('--disable-notifications')
     options.add_argument('--disable-popup-blocking')
 
+    # pages keep loading in background tabs, several tabs of one driver are used at once
+    options.add_argument('--disable-background-timer-throttling')
+    options.add_argument('--disable-backgrounding-occluded-windows')
+    options.add_argument('--disable-renderer-backgrounding')
+
     options.add_argument('--log-level=3')
     if headless:
         options.add_argument('--headless')
+
+    # reuse profile and its disk cache from previous runs
+    if profile_dir is not None:
+        options.add_argument(f'--user-data-dir={_acquire_profile(profile_dir).resolve()}')
+
+    global _TRAFFIC_STATS
+    _TRAFFIC_STATS = lean
+    if lean:
+        _lean_options(options)
     
     options.accept_insecure_certs = True
-    driver = webdriver.Chrome(service=service, options=options)
+    try:
+        driver = webdriver.Chrome(service=service, options=options)
+    except SessionNotCreatedException:
+        if driver_cache_dir is None or driver_version is not None:
+            raise
+        print(f'Драйвер {get_pid()}: chromedriver не подходит к версии chrome, устанавливаю заново')
+        driver_path = install_driver(driver_cache_dir, refresh=True)
+        _INIT_KWDS['driver_path'] = driver_path
+        driver = webdriver.Chrome(service=webdriver.ChromeService(driver_path), options=options)
+    browser_started = time.perf_counter()
+    if lean:
+        _block_urls(driver, blocked_urls if blocked_urls is not None else LEAN_BLOCKED_URLS)
     # driver.set_page_load_timeout(10)
-    driver.get(WEBSITE_URL)
+    driver.get(website_url)
     driver.execute_script(r"Object.defineProperty(navigator, 'webdriver', {get: () => undefined})")
-    time.sleep(10)
+    _wait_ready(driver)
+    ready = time.perf_counter()
+    record_traffic(driver)
     
     global DRIVER
     DRIVER = driver
 
     driver_id = mp.current_process().pid
-    print(f'Драйвер {driver_id} подключен')
+    print(f'Драйвер {driver_id} подключен за {ready - started:.1f} с')
+    metrics.record('driver_init', ready - started)
+    metrics.record('driver_browser_start', browser_started - started)
+    metrics.record('driver_first_page', ready - browser_started)
+
+    return {
+        'pid': driver_id,
+        'browser_start': browser_started - started,
+        'first_page': ready - browser_started,
+        'total': ready - started,
+    }
 
 
 def quit_driver():
-    DRIVER.quit()
\ No newline at end of file
+    global DRIVER, _PROFILE_LOCK
+    save_policy()
+    if DRIVER is not None:
+        record_traffic(DRIVER)
+        try:
+            DRIVER.quit()
+        except (WebDriverException, HTTPError):
+            # dead driver, whatever is left of it goes with chromedriver
+            DRIVER.service.stop()
+        DRIVER = None
+    metrics.dump()
+    if _PROFILE_LOCK is not None:
+        _PROFILE_LOCK.close()
+        _PROFILE_LOCK = None
\ No newline at end of file
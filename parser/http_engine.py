@@ -0,0 +1,264 @@
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from urllib.parse import urlencode, urljoin, urlparse, parse_qsl
+from pathlib import Path
+from math import ceil
+import json
+import os
+from datetime import date
+from concurrent import futures
+from functools import partial
+import time
+import logging
+
+from .driver import WEBSITE_URL
+from .autofill import make_search_params, publish_interval
+from .collector import parse_page_contents, parse_result_count, RES_PER_PAGE, PAGE_PARAM, SORT_PARAM, SORT_NEWEST, \
+    TooManyPages, distinct_count, sorted_stop
+from .utils import get_pid, set_html_parser
+from . import metrics
+
+
+SESSION = None   # this variable is local to each subprocess
+
+SEARCH_PATH = r'poisk/search'
+
+# query parameter names of the results page url, the same the filter modal produces on search.
+# They and their values are checked against a results url recorded from a browser search, see check_query_fields
+QUERY_FIELDS = {
+    'keywords': 'keywords',
+    'okpd': 'okpd2',
+    'regulation': 'law',
+    'publish_from': 'publishDateFrom',
+    'publish_to': 'publishDateTo',
+    'in_files': 'searchInFiles',
+    'exact': 'exactMatch',
+    'page': PAGE_PARAM,
+    'sort': SORT_PARAM,
+}
+REGULATION_VALUES = {'44-фз': '44', '223-фз': '223'}
+
+_RECORDED_MODES = set()  # modes this subprocess recorded the search url of, local to each subprocess
+
+
+class QueryFieldsMismatch(Exception):
+    """Results url built by http engine has other query parameters than the one filter modal produces"""
+
+
+class HttpSession:
+    def __init__(self, base_url=WEBSITE_URL, pool_size=10, timeout=20, retries=3):
+        """retries: adapter retries of failed requests, 0 if the caller retries itself"""
+        self.base_url = base_url if base_url.endswith('/') else base_url + '/'
+        self.pool_size = pool_size
+        self.timeout = timeout
+
+        self.session = requests.Session()
+        retry = Retry(total=retries, backoff_factor=0.5, status_forcelist=[429, 500, 502, 503, 504]) if retries else 0
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.session.headers.update({'User-Agent': 'Mozilla/5.0'})
+
+    def get(self, url):
+        resp = self.session.get(url, timeout=self.timeout)
+        resp.raise_for_status()
+        return resp.text
+
+    def close(self):
+        self.session.close()
+
+
+def init_session(base_url=WEBSITE_URL, pool_size=10, html_parser='html.parser', metrics_dir=None, retries=3):
+    set_html_parser(html_parser)
+    metrics.init_metrics(metrics_dir)
+
+    global SESSION
+    SESSION = HttpSession(base_url, pool_size, retries=retries)
+    print(f'Драйвер {get_pid()}: http сессия открыта')
+
+
+def close_session():
+    global SESSION
+    if SESSION is not None:
+        SESSION.close()
+        SESSION = None
+    metrics.dump()
+
+
+def _fetch_page(session, url):
+    """return: (page html, (number, url) parsed from it)"""
+    started = time.perf_counter()
+    page_html = session.get(url)
+    page_collected = parse_page_contents(page_html)
+    metrics.record('collect_page', time.perf_counter() - started, len(page_collected))
+    return page_html, page_collected
+
+
+def build_search_url(base_url, search_params, page=1, newest_first=False):
+    """
+    Builds results page url from search params instead of filling the filter modal
+    newest_first: sort results by publish date, newest first
+    return: url as string
+    """
+    query = []
+    for option in search_params.keyword.options:
+        query.append((QUERY_FIELDS['keywords'], option))
+    if 'искать в файлах' in map(str.lower, search_params.quick_settings.options):
+        query.append((QUERY_FIELDS['in_files'], 'true'))
+    if 'точное соответствие' in map(str.lower, search_params.quick_settings.options):
+        query.append((QUERY_FIELDS['exact'], 'true'))
+    for option in search_params.regulation.options:
+        query.append((QUERY_FIELDS['regulation'], REGULATION_VALUES[option]))
+
+    okpd_codes = search_params.okpd.options
+    if isinstance(okpd_codes, str):
+        okpd_codes = [okpd_codes]
+    for code in okpd_codes:
+        query.append((QUERY_FIELDS['okpd'], code))
+
+    date_from, date_to = publish_interval(search_params.publish_date.extra)
+    query.append((QUERY_FIELDS['publish_from'], date_from.strftime("%d.%m.%Y")))
+    query.append((QUERY_FIELDS['publish_to'], date_to.strftime("%d.%m.%Y")))
+
+    if newest_first:
+        query.append((QUERY_FIELDS['sort'], SORT_NEWEST))
+    if page > 1:
+        query.append((QUERY_FIELDS['page'], page))
+
+    return urljoin(base_url, SEARCH_PATH) + '?' + urlencode(query)
+
+
+def _load_recorded(path):
+    if path is None or not Path(path).is_file():
+        return {}
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def _is_production(url):
+    return urlparse(url).netloc == urlparse(WEBSITE_URL).netloc
+
+
+def record_search_url(path, url, mode, input_data, fz, kw_policy=None, okdp_policy=None, date_window=None):
+    """
+    Record results url the filter modal produced with the search it was produced for,
+    once for each mode. Http engine checks the query it builds against it.
+    Searches of local servers are not recorded, their urls are built from QUERY_FIELDS themselves
+    """
+    if path is None or mode in _RECORDED_MODES or not _is_production(url):
+        return
+    _RECORDED_MODES.add(mode)
+    recorded = _load_recorded(path)
+    if mode in recorded:
+        return
+    recorded[mode] = {'url': url, 'input_data': list(input_data), 'fz': fz, 
+                      'kw_policy': kw_policy, 'okdp_policy': okdp_policy, 
+                      'date_window': [day.isoformat() for day in date_window] if date_window is not None else None}
+    Path(path).parent.mkdir(parents=True, exist_ok=True)
+    # drivers of both modes may record at once, file is replaced as a whole
+    tmp_path = f'{path}.{get_pid()}'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(recorded, f, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+
+def _query_items(url):
+    """Parameters of the url with their values, page is left out"""
+    return sorted((key, value) for key, value in parse_qsl(urlparse(url).query, keep_blank_values=True) 
+                  if key != QUERY_FIELDS['page'])
+
+
+def check_query_fields(path, base_url):
+    """
+    Query of the results url is built without the filter modal, unknown parameters or values would be
+    ignored by the site and return unfiltered results. Its parameters and values must match the url
+    recorded from a browser search of the same site. Local servers serving recorded pages are not checked
+    """
+    if not _is_production(base_url):
+        return
+    recorded = _load_recorded(path)
+    if not recorded:
+        raise QueryFieldsMismatch(f'Параметры http поиска не проверены: выполните поиск с --engine browser, '
+                                  f'адрес страницы результатов будет записан в {path}')
+    for mode, search in recorded.items():
+        # dates of the recorded search are built again, so their values are compared as well
+        if search.get('date_window') is None:
+            raise QueryFieldsMismatch(f'Запись {path} устарела: удалите ее и выполните поиск с --engine browser')
+        date_window = tuple(date.fromisoformat(day) for day in search['date_window'])
+        search_params = make_search_params(search['input_data'], mode, search['fz'], 1, 
+                                           search['kw_policy'], search['okdp_policy'], date_window)
+        expected = _query_items(search['url'])
+        built = _query_items(build_search_url(base_url, search_params))
+        if built != expected:
+            missing = [item for item in expected if item not in built]
+            extra = [item for item in built if item not in expected]
+            raise QueryFieldsMismatch(f'Параметры http поиска ({mode}) не совпадают с сайтом: '
+                                      f'нет {missing}, лишние {extra}')
+
+
+def http_search(session, input_data, mode, fz, search_interval, kw_policy=None, okdp_policy=None, 
+                on_page=None, stop=None, journal=None, date_window=None, max_pages=None):
+    """
+    Browserless counterpart of fill + collect
+    on_page: optional callback receiving every collected page
+    stop: optional callback for incremental runs, see collect
+    journal: optional PageJournal, see collect
+    date_window, max_pages: see fill and collect
+    return: List[Tuple[str, str]] of (number, url)
+    """
+    if input_data is None or not input_data:
+        return []
+
+    search_params = make_search_params(input_data, mode, fz, search_interval, kw_policy, okdp_policy, date_window)
+
+    newest_first = stop is not None
+    first_url = build_search_url(session.base_url, search_params, newest_first=newest_first)
+    first_page, collected = _fetch_page(session, first_url)
+    count = parse_result_count(first_page)
+    if max_pages is not None and count is not None and ceil(count / RES_PER_PAGE) > max_pages:
+        raise TooManyPages(count)
+    if on_page is not None and collected:
+        on_page(collected)
+    if journal is not None and collected:
+        journal.record(first_url, collected)
+    stop = sorted_stop(stop, first_page, collected)
+    if not collected or count is None or (stop is not None and stop(collected)):
+        return collected
+
+    # the rest of the pages are addressed directly, so they are fetched concurrently
+    page_urls = [build_search_url(session.base_url, search_params, page, newest_first)
+                 for page in range(2, ceil(count / RES_PER_PAGE) + 1)]
+    # pages collected before the run stopped are taken from the journal
+    if journal is not None:
+        for url in page_urls:
+            if url in journal.done:
+                collected.extend(journal.done[url])
+                if on_page is not None:
+                    on_page(journal.done[url])
+        page_urls = [url for url in page_urls if url not in journal.done]
+
+    # incremental runs fetch a pool sized batch at a time to be able to stop early
+    batch_sz = session.pool_size if stop is not None else max(len(page_urls), 1)
+    stopped = False
+    with futures.ThreadPoolExecutor(max_workers=session.pool_size) as executor:
+        for i in range(0, len(page_urls), batch_sz):
+            batch = page_urls[i:i + batch_sz]
+            for url, (_, page_collected) in zip(batch, executor.map(partial(_fetch_page, session), batch)):
+                collected.extend(page_collected)
+                if on_page is not None and page_collected:
+                    on_page(page_collected)
+                if journal is not None and page_collected:
+                    journal.record(url, page_collected)
+                if stop is not None and stop(page_collected):
+                    stopped = True
+                    break
+            if stopped:
+                break
+
+    found = distinct_count(collected)
+    if found < count and not stopped:
+        print(f'Драйвер {get_pid()}: собрано {found} из {count} найденных, результат неполный')
+        logging.warning(f'Process {get_pid()}: truncated result set {found} of {count} for {first_url}')
+
+    return collected
@@ -0,0 +1,146 @@
+import json
+import shutil
+from datetime import date, datetime
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from .utils import get_pid
+
+
+_RESUMED_PAGES: Dict[str, Dict[str, list]] = {}     # this variable is local to each subprocess
+
+
+def task_key(task, mode, fz, date_window):
+    """Task identity in the journal: query, law and publish date window"""
+    date_from, date_to = date_window
+    return f'{mode}|{fz}|{date_from:%d.%m.%Y}-{date_to:%d.%m.%Y}|' + '|'.join(task)
+
+
+def _read_lines(path):
+    """Records of a jsonl file. Last line may be cut by a crash, it is skipped"""
+    if not Path(path).is_file():
+        return []
+    records = []
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            try:
+                records.append(json.loads(line))
+            except json.JSONDecodeError:
+                pass
+    return records
+
+
+def _append_line(path, record):
+    with open(path, 'a', encoding='utf-8') as f:
+        f.write(json.dumps(record, ensure_ascii=False) + '\n')
+
+
+class RunJournal:
+    """
+    Journal of a run kept in its own folder. Main process records started and finished files
+    and results of every finished task, search workers record collected pages to their own files.
+    Folder is removed when the run completes, so a folder left behind belongs to a run which stopped midway
+    """
+    def __init__(self, run_dir):
+        self.run_dir = Path(run_dir)
+        self.run_dir.mkdir(parents=True, exist_ok=True)
+        self.meta_path = self.run_dir / 'run.json'
+        self.tasks_path = self.run_dir / 'tasks.jsonl'
+        self.files_path = self.run_dir / 'files.jsonl'
+
+        self.meta = {}
+        if self.meta_path.is_file():
+            with open(self.meta_path, encoding='utf-8') as f:
+                self.meta = json.load(f)
+        self.tasks: Dict[str, List[tuple]] = {
+            rec['key']: [tuple(num_url) for num_url in rec['collected']] for rec in _read_lines(self.tasks_path)}
+        self.files: Dict[str, str] = {}
+        self.done_files = set()
+        for rec in _read_lines(self.files_path):
+            self.files[rec['input']] = rec['output']
+            if rec['done']:
+                self.done_files.add(rec['input'])
+
+    @classmethod
+    def create(cls, root):
+        return cls(Path(root) / datetime.now().strftime("%d_%m_%Y_%H_%M_%S"))
+
+    @classmethod
+    def latest(cls, root, **meta) -> Optional['RunJournal']:
+        """
+        Journal of the last run which did not complete
+        meta: values the run was created with, journals of runs with other values are passed over
+        """
+        root = Path(root)
+        if not root.is_dir():
+            return None
+        run_dirs = [path for path in root.iterdir() if (path / 'run.json').is_file()]
+        for run_dir in sorted(run_dirs, key=lambda path: path.stat().st_mtime, reverse=True):
+            journal = cls(run_dir)
+            if all(journal.meta.get(key) == value for key, value in meta.items()):
+                return journal
+        return None
+
+    def set_meta(self, **kwargs):
+        self.meta.update(kwargs)
+        with open(self.meta_path, 'w', encoding='utf-8') as f:
+            json.dump(self.meta, f, ensure_ascii=False)
+
+    def date_window(self):
+        """Publish date window the run searches, None for journals which did not keep it"""
+        if 'window' not in self.meta:
+            return None
+        return tuple(date.fromisoformat(day) for day in self.meta['window'])
+
+    def is_file_done(self, input_file):
+        return str(input_file) in self.done_files
+
+    def file_output(self, input_file):
+        """Output file the input file was written to before the stop, None if it was not started"""
+        return self.files.get(str(input_file))
+
+    def start_file(self, input_file, output_file):
+        if self.files.get(str(input_file)) == str(output_file):
+            return
+        self.files[str(input_file)] = str(output_file)
+        _append_line(self.files_path, {'input': str(input_file), 'output': str(output_file), 'done': False})
+
+    def finish_file(self, input_file):
+        self.done_files.add(str(input_file))
+        _append_line(self.files_path, {'input': str(input_file), 'output': self.files.get(str(input_file)), 'done': True})
+
+    def task_result(self, key):
+        """Results of a task finished before the stop, None if it has to run"""
+        return self.tasks.get(key)
+
+    def task_done(self, key, collected):
+        self.tasks[key] = collected
+        _append_line(self.tasks_path, {'key': key, 'collected': collected})
+
+    def complete(self):
+        shutil.rmtree(self.run_dir, ignore_errors=True)
+
+
+class PageJournal:
+    """
+    Pages collected by a search worker, addressed by url. When a run is resumed,
+    pages the stopped run collected are taken from the journal instead of loading them again
+    """
+    def __init__(self, run_dir, resume=False):
+        self.run_dir = Path(run_dir)
+        self.path = self.run_dir / f'pages_{get_pid()}.jsonl'
+        self.done = _resumed_pages(self.run_dir) if resume else {}
+
+    def record(self, url, page_collected):
+        _append_line(self.path, {'url': url, 'collected': page_collected})
+
+
+def _resumed_pages(run_dir):
+    """Pages of the stopped run, loaded once per subprocess"""
+    if str(run_dir) not in _RESUMED_PAGES:
+        pages = {}
+        for path in run_dir.glob('pages_*.jsonl'):
+            for rec in _read_lines(path):
+                pages[rec['url']] = [tuple(num_url) for num_url in rec['collected']]
+        _RESUMED_PAGES[str(run_dir)] = pages
+    return _RESUMED_PAGES[str(run_dir)]
@@ -0,0 +1,168 @@
+import json
+import os
+import time
+import threading
+from contextlib import contextmanager
+from dataclasses import dataclass, asdict
+from pathlib import Path
+from typing import Dict
+
+from .utils import get_pid
+
+
+_STAGES: Dict[str, 'StageStats'] = {}    # this variable is local to each subprocess
+METRICS_DIR = None
+_LOCK = threading.Lock()    # stages are also recorded from worker threads
+
+
+@dataclass
+class StageStats:
+    count: int = 0
+    seconds: float = 0.0
+    max_seconds: float = 0.0
+    retries: int = 0
+    items: int = 0
+
+    def merge(self, other: 'StageStats'):
+        self.count += other.count
+        self.seconds += other.seconds
+        self.max_seconds = max(self.max_seconds, other.max_seconds)
+        self.retries += other.retries
+        self.items += other.items
+
+
+def _stage(name):
+    if name not in _STAGES:
+        _STAGES[name] = StageStats()
+    return _STAGES[name]
+
+
+def init_metrics(metrics_dir):
+    """Subprocess stage stats are dumped to the folder when its driver or session is closed"""
+    global METRICS_DIR
+    METRICS_DIR = metrics_dir
+
+
+def record(name, seconds, items=0):
+    with _LOCK:
+        stats = _stage(name)
+        stats.count += 1
+        stats.seconds += seconds
+        stats.max_seconds = max(stats.max_seconds, seconds)
+        stats.items += items
+
+
+def retry(name):
+    with _LOCK:
+        _stage(name).retries += 1
+
+
+@contextmanager
+def timed(name, items=0):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(name, time.perf_counter() - started, items)
+
+
+def dump():
+    """Write stage stats of this process to its own file in the metrics folder"""
+    if METRICS_DIR is None or not _STAGES:
+        return
+    path = Path(METRICS_DIR)
+    path.mkdir(parents=True, exist_ok=True)
+    with _LOCK:
+        stages = {name: asdict(stats) for name, stats in _STAGES.items()}
+    with open(path / f'metrics_{get_pid()}.json', 'w', encoding='utf-8') as f:
+        json.dump(stages, f)
+
+
+def sample(series, **values):
+    """Append a timestamped point of a series, e.g. memory curve of a driver, to this process' samples file"""
+    if METRICS_DIR is None:
+        return
+    path = Path(METRICS_DIR)
+    path.mkdir(parents=True, exist_ok=True)
+    with open(path / f'samples_{get_pid()}.jsonl', 'a', encoding='utf-8') as f:
+        f.write(json.dumps({'series': series, 'time': round(time.time(), 1), **values}) + '\n')
+
+
+def load_samples(metrics_dir):
+    """return: {pid: [sample, ...]}"""
+    samples = {}
+    for path in sorted(Path(metrics_dir).glob('samples_*.jsonl')):
+        pid = path.stem.split('_', 1)[1]
+        with open(path, encoding='utf-8') as f:
+            for line in f:
+                try:
+                    samples.setdefault(pid, []).append(json.loads(line))
+                except json.JSONDecodeError:
+                    pass
+    return samples
+
+
+def aggregate(metrics_dir):
+    """
+    Stage stats of all processes which dumped them, main process included
+    return: (stats summed over processes, stats per pid)
+    """
+    dump()
+    total: Dict[str, StageStats] = {}
+    per_pid: Dict[str, Dict[str, StageStats]] = {}
+    for path in sorted(Path(metrics_dir).glob('metrics_*.json')):
+        with open(path, encoding='utf-8') as f:
+            try:
+                stages = json.load(f)
+            except json.JSONDecodeError:
+                continue
+        pid = path.stem.split('_', 1)[1]
+        per_pid[pid] = {name: StageStats(**stats) for name, stats in stages.items()}
+        for name, stats in per_pid[pid].items():
+            total.setdefault(name, StageStats()).merge(stats)
+    return total, per_pid
+
+
+def write_report(path, total, per_pid, run_info, samples=None):
+    """JSON run report"""
+    report = {
+        **run_info,
+        'stages': {name: asdict(stats) for name, stats in sorted(total.items())},
+        'processes': {pid: {name: asdict(stats) for name, stats in sorted(stages.items())}
+                      for pid, stages in per_pid.items()},
+        'samples': samples or {},
+    }
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+
+
+def write_textfile(path, total, run_info):
+    """Prometheus textfile collector format. File is replaced at once, so it is never read half written"""
+    lines = []
+    metrics = [
+        ('rts_stage_runs_total', 'counter', 'Times the stage ran', 'count'),
+        ('rts_stage_seconds_total', 'counter', 'Time spent in the stage', 'seconds'),
+        ('rts_stage_seconds_max', 'gauge', 'Longest single run of the stage', 'max_seconds'),
+        ('rts_stage_retries_total', 'counter', 'Retries inside the stage', 'retries'),
+        ('rts_stage_items_total', 'counter', 'Items the stage handled', 'items'),
+    ]
+    for metric, metric_type, help_text, field in metrics:
+        lines.append(f'# HELP {metric} {help_text}')
+        lines.append(f'# TYPE {metric} {metric_type}')
+        for name, stats in sorted(total.items()):
+            lines.append(f'{metric}{{stage="{name}",fz="{run_info["fz"]}"}} {getattr(stats, field)}')
+    lines.append('# HELP rts_run_duration_seconds Duration of the last run')
+    lines.append('# TYPE rts_run_duration_seconds gauge')
+    lines.append(f'rts_run_duration_seconds{{fz="{run_info["fz"]}"}} {run_info["duration"]:.3f}')
+    lines.append('# HELP rts_run_finished_timestamp_seconds Time the last run finished')
+    lines.append('# TYPE rts_run_finished_timestamp_seconds gauge')
+    lines.append(f'rts_run_finished_timestamp_seconds{{fz="{run_info["fz"]}"}} {time.time():.0f}')
+
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_suffix(path.suffix + '.tmp')
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        f.write('\n'.join(lines) + '\n')
+    os.replace(tmp_path, path)
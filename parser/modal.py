@@ -0,0 +1,157 @@
+from selenium.webdriver.common.by import By
+from dataclasses import dataclass, field
+from typing import List, Optional
+from bs4.element import Tag
+
+from .utils import xpath_soup, make_soup
+
+
+# modal root is the closest node holding both filter options and keyword search.
+# Mutation observer bumps the version on structural changes, so snapshot is retaken only then
+_SNAPSHOT_SCRIPT = r"""
+var main = document.querySelector('.modal-settings-filter__main');
+var search = document.querySelector('.modal-settings-search');
+if (main === null) return null;
+var root = main;
+while (search !== null && root.parentElement !== null && !root.contains(search)) root = root.parentElement;
+if (window.__rtsModalRoot !== root) {
+    if (window.__rtsModalObserver) window.__rtsModalObserver.disconnect();
+    window.__rtsModalVersion = 0;
+    window.__rtsModalObserver = new MutationObserver(function() { window.__rtsModalVersion += 1; });
+    window.__rtsModalObserver.observe(root, {childList: true, subtree: true, attributes: true, attributeFilter: ['class']});
+    window.__rtsModalRoot = root;
+}
+return [root, root.outerHTML, window.__rtsModalVersion];
+"""
+
+_VERSION_SCRIPT = r"""
+if (!window.__rtsModalRoot || !document.contains(window.__rtsModalRoot)) return -1;
+return window.__rtsModalVersion;
+"""
+
+
+@dataclass
+class ModalCheckbox:
+    label_text: str
+    input: Tag
+    label: Tag
+
+
+@dataclass
+class ModalDatePicker:
+    title: str
+    inputs: List[Tag]
+
+
+@dataclass
+class ModalSection:
+    el: Tag
+    title: str
+    collapsed_title: Optional[Tag]
+    rows: List[Tag] = field(default_factory=list)
+    checkboxes: List[ModalCheckbox] = field(default_factory=list)
+    datepickers: List[ModalDatePicker] = field(default_factory=list)
+    show_more_links: List[Tag] = field(default_factory=list)
+    clear_links: List[Tag] = field(default_factory=list)
+
+    @property
+    def collapsed(self):
+        return self.collapsed_title is not None
+
+
+class ModalNotFound(Exception):
+    pass
+
+
+class FilterModal:
+    """
+    Index of filter modal sections, rows, checkboxes and date pickers built from one DOM snapshot.
+    Elements are resolved relative to the modal root, snapshot is retaken only if modal DOM changed
+    """
+    def __init__(self, driver):
+        self.driver = driver
+        self.root = None
+        self.soup_root = None
+        self.version = None
+        self.sections: List[ModalSection] = []
+        self.search_input: Optional[Tag] = None
+        self.refresh()
+
+    def refresh(self, force=False):
+        """
+        Retake snapshot if modal DOM changed since the last one
+        return: True if snapshot was retaken
+        """
+        if not force and self.version is not None:
+            if self.driver.execute_script(_VERSION_SCRIPT) == self.version:
+                return False
+
+        snapshot = self.driver.execute_script(_SNAPSHOT_SCRIPT)
+        if snapshot is None:
+            raise ModalNotFound
+        self.root, html, self.version = snapshot
+        self._index(make_soup(html))
+        return True
+
+    def element(self, tag):
+        """WebElement for the snapshot node"""
+        return self.root.find_element(By.XPATH, xpath_soup(tag, self.soup_root))
+
+    def find_section(self, name):
+        for section in self.sections:
+            if str.lower(name) in str.lower(section.title):
+                return section
+
+    def _index(self, soup):
+        main = soup.find("div", {"class": "modal-settings-filter__main"})
+        search = soup.find("div", {"class": "modal-settings-search"})
+
+        # same closest common node the snapshot script chose
+        soup_root = main
+        if search is not None:
+            search_parents = [id(parent) for parent in search.parents]
+            while soup_root.parent is not None and id(soup_root) not in search_parents:
+                soup_root = soup_root.parent
+        self.soup_root = soup_root
+
+        self.search_input = None
+        if search is not None and (controls := search.find("div", {"class": "main-search__controls"})) is not None:
+            self.search_input = controls.find("input")
+
+        self.sections = [self._index_section(el) for el in main.find_all("div", {"class": "modal-settings-section"})]
+
+    @staticmethod
+    def _index_section(el):
+        filter_title = el.find("div", {"class": "filter-title"})
+        title, collapsed_title = '', None
+        if filter_title is not None:
+            if (title_el := filter_title.find("div", {"class": "title-collapse title-collapse--more"})) is not None:
+                title = title_el.get_text()
+            elif (title_el := filter_title.find("div", {"class": "title-collapse title-collapse--less"})) is not None:
+                title = title_el.get_text()
+                collapsed_title = title_el
+        section = ModalSection(el, title, collapsed_title)
+
+        for msr in el.find_all("div", {"class": "modal-settings-row"}):
+            section.rows.append(msr)
+            if (msr_a := msr.find("a")) is not None and 'показать еще' in str.lower(msr.get_text()):
+                if not any(msr_a is link for link in section.show_more_links):
+                    section.show_more_links.append(msr_a)
+
+        for msr in el.find_all("div", {"class": "modal-settings-row filter-helpers"}):
+            for msr_a in msr.find_all("a"):
+                if 'снять всё' in str.lower(msr_a.get_text()):
+                    section.clear_links.append(msr_a)
+
+        for grid_val in el.find_all("div", {"class": "grid-column-4-1"}):
+            label = grid_val.find("label")
+            if label is not None and grid_val.find("input") is not None:
+                section.checkboxes.append(ModalCheckbox(label.get_text(), grid_val.find("input"), label))
+
+        for grid_col in el.find_all("div", {"class": "grid-column-2"}):
+            col_title = grid_col.find("div", {"class": "form-group__title"})
+            datepickers = grid_col.find_all("input", {"class": "datepicker"})
+            if col_title is not None and datepickers:
+                section.datepickers.append(ModalDatePicker(col_title.get_text(), datepickers))
+
+        return section
@@ -0,0 +1,196 @@
+import json
+import hashlib
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Dict, List
+
+from .utils import get_pid
+
+
+INDEX_VERSION = 1
+
+INDEX = None    # this variable is local to each subprocess
+_INDEX_MTIME = None
+
+# helpers shared by tree scripts. Own child of li is the one not nested into a deeper li
+_TREE_HELPERS = r"""
+function own(li, selector) {
+    return Array.from(li.querySelectorAll(selector)).find(function(el) { return el.closest('li') === li; });
+}
+function items(ul) {
+    return Array.from(ul.children).filter(function(el) { return el.tagName === 'LI'; });
+}
+"""
+
+_FINGERPRINT_SCRIPT = _TREE_HELPERS + r"""
+return items(arguments[0]).map(function(li) { return li.textContent.trim().slice(0, 200); }).join('|');
+"""
+
+# expands collapsed nodes level by level until the whole tree is rendered or time budget is spent
+_EXPAND_ALL_SCRIPT = _TREE_HELPERS + r"""
+var ul = arguments[0], budget = arguments[1], done = arguments[arguments.length - 1];
+var started = Date.now(), clicks = new WeakMap();
+function round() {
+    var pending = Array.from(ul.querySelectorAll('li')).filter(function(li) {
+        return !li.classList.contains('settings-tree--show') && own(li, 'button') && (clicks.get(li) || 0) < 3;
+    });
+    if (pending.length === 0) return done(true);
+    if (Date.now() - started > budget) return done(false);
+    pending.forEach(function(li) {
+        clicks.set(li, (clicks.get(li) || 0) + 1);
+        own(li, 'button').click();
+    });
+    setTimeout(round, 300);
+}
+round();
+"""
+
+# returns [[code, [child index on each level]], ...]
+_HARVEST_SCRIPT = _TREE_HELPERS + r"""
+var out = [];
+function walk(ul, path) {
+    items(ul).forEach(function(li, i) {
+        var p = path.concat([i]);
+        var label = own(li, 'label');
+        var b = label ? label.querySelector('b') : null;
+        if (b) out.push([b.textContent.trim(), p]);
+        var child = own(li, 'ul');
+        if (child) walk(child, p);
+    });
+}
+walk(arguments[0], []);
+return out;
+"""
+
+# expands only the nodes on the path of every code and clicks its label. Returns {code: selected}
+_SELECT_SCRIPT = _TREE_HELPERS + r"""
+var ul = arguments[0], targets = arguments[1], done = arguments[arguments.length - 1];
+var result = {};
+function waitFor(cond, timeout, cb) {
+    var started = Date.now();
+    (function poll() {
+        if (cond()) return cb(true);
+        if (Date.now() - started > timeout) return cb(false);
+        setTimeout(poll, 100);
+    })();
+}
+function next(t) {
+    if (t >= targets.length) return done(result);
+    descend(ul, targets[t][0], targets[t][1], 0, t);
+}
+function descend(cur, code, path, depth, t) {
+    var li = items(cur)[path[depth]];
+    if (!li) { result[code] = false; return next(t + 1); }
+    if (depth === path.length - 1) {
+        var label = own(li, 'label');
+        var b = label ? label.querySelector('b') : null;
+        result[code] = Boolean(b && b.textContent.trim() === code);
+        if (result[code]) label.click();
+        return next(t + 1);
+    }
+    if (!li.classList.contains('settings-tree--show') && own(li, 'button')) own(li, 'button').click();
+    waitFor(function() {
+        var child = own(li, 'ul');
+        return child && items(child)[path[depth + 1]];
+    }, 5000, function(ok) {
+        if (!ok) { result[code] = false; return next(t + 1); }
+        descend(own(li, 'ul'), code, path, depth + 1, t);
+    });
+}
+next(0);
+"""
+
+
+class OkpdIndex:
+    """
+    OKPD2 code -> position path in the settings tree. Fingerprint of the tree top level
+    tells when the site changed the classifier and the index has to be harvested again
+    """
+    def __init__(self, codes=None, fingerprint='', harvested_at=None):
+        self.codes: Dict[str, List[int]] = codes or {}
+        self.fingerprint: str = fingerprint
+        self.harvested_at: datetime = harvested_at or datetime.now()
+
+    def __contains__(self, code):
+        return code in self.codes
+
+    def __len__(self):
+        return len(self.codes)
+
+    def is_fresh(self, fingerprint, max_age_days):
+        return (self.fingerprint == fingerprint and
+                datetime.now() - self.harvested_at < timedelta(days=max_age_days))
+
+    def save(self, path):
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_suffix(path.suffix + '.tmp')
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({
+                'version': INDEX_VERSION,
+                'fingerprint': self.fingerprint,
+                'harvested_at': self.harvested_at.isoformat(),
+                'codes': self.codes,
+            }, f)
+        tmp_path.replace(path)
+
+    @classmethod
+    def load(cls, path):
+        """return: OkpdIndex or None if there is no index of current version"""
+        path = Path(path)
+        if not path.is_file():
+            return None
+        with open(path, encoding='utf-8') as f:
+            try:
+                data = json.load(f)
+            except json.JSONDecodeError:
+                return None
+        if data.get('version') != INDEX_VERSION:
+            return None
+        return cls(data['codes'], data['fingerprint'], datetime.fromisoformat(data['harvested_at']))
+
+
+def tree_fingerprint(driver, tree_ul):
+    top_level = driver.execute_script(_FINGERPRINT_SCRIPT, tree_ul)
+    return hashlib.sha1(top_level.encode('utf-8')).hexdigest()
+
+
+def harvest(driver, tree_ul, budget_sec=600):
+    """
+    Expand the whole tree and map every code to its position
+    return: OkpdIndex
+    """
+    fingerprint = tree_fingerprint(driver, tree_ul)
+
+    driver.set_script_timeout(budget_sec + 30)
+    complete = driver.execute_async_script(_EXPAND_ALL_SCRIPT, tree_ul, budget_sec * 1000)
+    if not complete:
+        print(f'Драйвер {get_pid()}: дерево ОКПД раскрыто не полностью')
+
+    codes = {code: path for (code, path) in driver.execute_script(_HARVEST_SCRIPT, tree_ul)}
+    return OkpdIndex(codes, fingerprint)
+
+
+def select_codes(driver, tree_ul, index, codes):
+    """
+    Select codes known to the index in one pass
+    return: {code: selected}. Codes missing in the index are not selected
+    """
+    res = {code: False for code in codes}
+    targets = [[code, index.codes[code]] for code in codes if code in index]
+    if targets:
+        driver.set_script_timeout(10 * len(targets) + 10)
+        res.update(driver.execute_async_script(_SELECT_SCRIPT, tree_ul, targets))
+    return res
+
+
+def load_index(path):
+    """Load index into subprocess global if it is not loaded yet or was rebuilt"""
+    global INDEX, _INDEX_MTIME
+    if path is None or not Path(path).is_file():
+        return None
+    mtime = Path(path).stat().st_mtime
+    if INDEX is None or _INDEX_MTIME != mtime:
+        INDEX = OkpdIndex.load(path)
+        _INDEX_MTIME = mtime
+    return INDEX
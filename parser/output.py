@@ -0,0 +1,122 @@
+import sqlite3
+from dataclasses import dataclass, field
+from pathlib import Path
+
+from .collector import is_valid_num
+from . import metrics
+
+
+@dataclass
+class _OpenFile:
+    buffer: dict = field(default_factory=dict)     # number -> record, keeps arrival order
+    shared: set = field(default_factory=set)    # numbers of searches the file shares with other files
+    found: int = 0
+    new: int = 0
+
+
+class OutputWriter:
+    """
+    Append-only output of new notifications. Records are written in batches as they arrive.
+    Numbers already handled in this run are skipped through an on-disk index shared by all
+    output files, so the output is never read back or rewritten. Results of a search requested by
+    several files go to each of them, database is asked about them once.
+    Several files can be open at once, each has its own buffer
+    """
+    def __init__(self, index_path, db_conn, fz, batch_size=500, cache=None):
+        self.index_path = Path(index_path)
+        self.index_path.parent.mkdir(parents=True, exist_ok=True)
+        self.index = sqlite3.connect(self.index_path)
+        self.index.execute('CREATE TABLE IF NOT EXISTS seen_by_file (notif_num TEXT, output_file TEXT, new INTEGER, '
+                           'PRIMARY KEY (notif_num, output_file)) WITHOUT ROWID')
+
+        self.db_conn = db_conn
+        self.fz = fz
+        self.batch_size = batch_size
+        self.cache = cache      # KnownCache shared between runs, optional
+        self.files = {}         # output file -> _OpenFile
+
+    def open_file(self, output_file):
+        self.files[output_file] = _OpenFile()
+
+    def close_file(self, output_file):
+        self.flush(output_file)
+        open_file = self.files.pop(output_file)
+        print(f'{Path(output_file).name}: найдено {open_file.found} уникальных, из них {open_file.new} новых')
+
+    def _num(self, record):
+        return record if self.fz == '44' else record.notif_num
+
+    def _format(self, record):
+        if self.fz == '44':
+            return record
+        return ';'.join([num for num in [record.notif_num, record.noticeinfoid, record.pfid] if num != ''])
+
+    def write(self, output_file, records, shared=()):
+        """
+        shared: numbers of searches the file shares with other files, they are written
+            even if another file of the run has them
+        """
+        open_file = self.files[output_file]
+        open_file.shared.update(shared)
+        for record in records:
+            notif_num = self._num(record)
+            if is_valid_num(notif_num, self.fz) and notif_num not in open_file.buffer:
+                open_file.buffer[notif_num] = record
+            if len(open_file.buffer) >= self.batch_size:
+                self.flush(output_file)
+
+    def _seen(self, nums, output_file):
+        """
+        return: (numbers already in the output file, number -> True/False if database found it new
+            for numbers handled in other files)
+        """
+        in_file, verdicts = set(), {}
+        slice_sz = 900  # sqlite host parameter limit
+        for nums_slice in [nums[i:i + slice_sz] for i in range(0, len(nums), slice_sz)]:
+            query = f"SELECT notif_num, output_file, new FROM seen_by_file " \
+                    f"WHERE notif_num IN ({','.join('?' * len(nums_slice))})"
+            for notif_num, seen_file, new in self.index.execute(query, nums_slice):
+                if seen_file == str(output_file):
+                    in_file.add(notif_num)
+                verdicts[notif_num] = bool(new)
+        return in_file, verdicts
+
+    def flush(self, output_file):
+        open_file = self.files[output_file]
+        if not open_file.buffer:
+            return
+        buffer, open_file.buffer = open_file.buffer, {}
+
+        in_file, verdicts = self._seen(list(buffer), output_file)
+        # numbers other searches found for another file are skipped, shared searches go to every file
+        unseen = [num for num in buffer if num not in in_file and (num not in verdicts or num in open_file.shared)]
+        open_file.found += len(unseen)
+        unchecked = [num for num in unseen if num not in verdicts]
+        # numbers confirmed by database in earlier runs are not sent again
+        to_check = unchecked if self.cache is None else \
+            [num for num in unchecked if not self.cache.is_known(num, self.fz)]
+        with metrics.timed('db_dedup', len(to_check)):
+            new_collected = self.db_conn.get_new_numbers([buffer[num] for num in to_check], self.fz)
+        new_nums = {self._num(col) for col in new_collected}
+        new_collected.extend(buffer[num] for num in unseen if verdicts.get(num))
+        if new_collected:
+            with metrics.timed('output', len(new_collected)), open(output_file, 'a') as f:
+                for col in new_collected:
+                    print(self._format(col), file=f)
+        open_file.new += len(new_collected)
+
+        if self.cache is not None:
+            self.cache.add_known([num for num in to_check if num not in new_nums], self.fz)
+
+        # old numbers are recorded as well, so database is not asked about them again
+        with self.index:
+            self.index.executemany('INSERT OR IGNORE INTO seen_by_file VALUES (?, ?, ?)', 
+                                   [(num, str(output_file), int(verdicts.get(num, num in new_nums))) 
+                                    for num in unseen])
+
+    def close(self, remove_index=True):
+        for output_file in list(self.files):
+            self.close_file(output_file)
+        self.index.close()
+        if remove_index:
+            self.index_path.unlink(missing_ok=True)
@@ -0,0 +1,93 @@
+import threading
+
+from .collector import CollectRes
+
+
+class _CachedResult:
+    """Stands in for AsyncResult of a number served from local cache"""
+    def __init__(self, res):
+        self.res = res
+
+    def get(self):
+        return [self.res]
+
+
+class EnrichPipeline:
+    """
+    Streams numbers found by search workers to a separate enrichment pool while search goes on.
+    Search workers put pages of (number, url) into the queue, each number is enriched once per run.
+    Queue is consumed for the whole run, files finish in any order
+    batch: numbers of a page go to one job, for jobs resolving many numbers concurrently
+    """
+    def __init__(self, pool, queue, job, accept=None, cache=None, fz='223', batch=False):
+        self.pool = pool
+        self.queue = queue
+        self.job = job
+        self.accept = accept
+        self.cache = cache      # KnownCache, numbers already imported or resolved are not visited
+        self.fz = fz
+        self.batch = batch
+        self.submitted = {}     # number -> (AsyncResult, index of the number in its results)
+        self._lock = threading.Lock()
+        self._consumer = None
+
+    def start(self):
+        self._consumer = threading.Thread(target=self._consume, daemon=True)
+        self._consumer.start()
+
+    def stop(self):
+        if self._consumer is None:
+            return
+        self.queue.put(None)
+        self._consumer.join()
+        self._consumer = None
+
+    def _consume(self):
+        while (page := self.queue.get()) is not None:
+            self.submit(page)
+
+    def submit(self, num_urls):
+        with self._lock:
+            to_submit = []
+            for num_url in num_urls:
+                notif_num = num_url[0]
+                if notif_num in self.submitted:
+                    continue
+                if self.accept is not None and not self.accept(notif_num):
+                    continue
+                if self.cache is not None:
+                    if self.cache.is_known(notif_num, self.fz):
+                        continue
+                    if (resolved := self.cache.get_resolved(notif_num)) is not None:
+                        self.submitted[notif_num] = (_CachedResult(CollectRes(notif_num, *resolved)), 0)
+                        continue
+                if self.batch:
+                    to_submit.append(num_url)
+                    self.submitted[notif_num] = None
+                else:
+                    self.submitted[notif_num] = (self.pool.apply_async(self.job, ([num_url], )), 0)
+
+            if to_submit:
+                res = self.pool.apply_async(self.job, (to_submit, ))
+                for i, num_url in enumerate(to_submit):
+                    self.submitted[num_url[0]] = (res, i)
+
+    def finish_file(self, collected):
+        """
+        Wait for enrichment of every number the file collected
+        yield: job results as they are ready
+        """
+        # pages which were not streamed yet or at all (e.g. pager walk fallback) are submitted now
+        self.submit(collected)
+
+        ready = {}  # results of a batch job are fetched once
+        for notif_num in dict.fromkeys(num_url[0] for num_url in collected):
+            if notif_num not in self.submitted:
+                continue
+            res, i = self.submitted[notif_num]
+            if id(res) not in ready:
+                ready[id(res)] = res.get()
+            col_res = ready[id(res)][i]
+            if self.cache is not None and not isinstance(res, _CachedResult) and col_res.noticeinfoid:
+                self.cache.put_resolved(col_res.notif_num, col_res.noticeinfoid, col_res.pfid)
+            yield col_res
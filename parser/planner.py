@@ -0,0 +1,161 @@
+from dataclasses import dataclass, field
+from datetime import date, timedelta
+from math import ceil
+from pathlib import Path
+from typing import Dict, List, Optional, Set, Tuple
+
+
+_OWNERS = ''    # key of the node files requesting the code are kept under, no code character is empty
+
+
+def normalize_input(input_data, mode):
+    """
+    Lines of an input file as they are searched: whitespace collapsed, empty lines and
+    repeats dropped. Keywords are compared case insensitive, codes without trailing dots
+    """
+    lines = {}
+    for line in input_data:
+        line = ' '.join(line.split())
+        if mode == 'okpd':
+            line = line.rstrip('.')
+        if line:
+            lines.setdefault(line.casefold(), line)
+    return list(lines.values())
+
+
+def task_identity(mode, task):
+    """Tasks with the same identity find the same results whatever file they come from"""
+    return (mode, ) + tuple(sorted(' '.join(line.split()).casefold() for line in task))
+
+
+class CodeTrie:
+    """Prefix tree of OKPD codes. Node of a code keeps indexes of the files which requested it"""
+    def __init__(self):
+        self.root = {}
+
+    def insert(self, code, owner):
+        node = self.root
+        for char in code:
+            node = node.setdefault(char, {})
+        node.setdefault(_OWNERS, set()).add(owner)
+
+    def ancestor_owners(self, code) -> Set[int]:
+        """Files which requested any ancestor of the code, the code itself excluded"""
+        owners = set()
+        node = self.root
+        for char in code[:-1]:
+            if (node := node.get(char)) is None:
+                break
+            owners.update(node.get(_OWNERS, ()))
+        return owners
+
+
+def default_window(search_interval):
+    """Publish date window of a task searched search_interval days back from today"""
+    return date.today() - timedelta(days=search_interval), date.today()
+
+
+def split_window(date_window, pages, max_pages):
+    """
+    Split publish date window into equal windows, enough for each to fit max_pages if results
+    are spread evenly. A window still too large is split again when it runs
+    return: List[Tuple[date, date]] newest first, None for a single day
+    """
+    date_from, date_to = date_window
+    days = (date_to - date_from).days + 1
+    if days <= 1:
+        return None
+    parts = min(days, max(2, ceil(pages / max_pages)))
+    bounds = [date_from + timedelta(days=days * k // parts) for k in range(parts + 1)]
+    windows = [(bounds[k], bounds[k + 1] - timedelta(days=1)) for k in range(parts)]
+    return windows[::-1]
+
+
+@dataclass
+class Shards:
+    """Returned by a task instead of results when its date window has more pages than allowed"""
+    count: int
+    windows: List[Tuple[date, date]]
+
+
+@dataclass
+class PlannedFile:
+    """Input file of the run and state of its output while its tasks run"""
+    input_file: Path
+    output_file: Path
+    mode: str
+    tasks: List[List[str]]
+    pending: int = 0    # tasks still running
+    collected: Set[Tuple[str, str]] = field(default_factory=set)   # 223 (number, url) waiting for enrichment
+    shared: Set[str] = field(default_factory=set)   # 223 numbers of searches shared with other files
+
+
+class RunPlan:
+    """
+    Tasks of all input files of both modes in one stream, so drivers are not idle at file boundaries.
+    Task requested by several files runs once, its results are routed to the output of each of them
+    """
+    def __init__(self):
+        self.files: List[PlannedFile] = []
+        self.items: List[Tuple[str, List[str], Optional[tuple]]] = []    # (mode, task, date window) to run
+        self.owners: List[List[PlannedFile]] = []   # files which requested each item
+        self._items_index: Dict[tuple, int] = {}    # task identity -> index of its item
+        self.requested = 0
+        self.covered = 0
+
+    def add_file(self, planned: PlannedFile):
+        self.files.append(planned)
+
+    def drop_covered_codes(self):
+        """
+        Tree search of a code also finds its children. Code is dropped from a file which requests
+        one of its ancestors too, file gets the children with the ancestor results.
+        Called after all files are added
+        """
+        trie = CodeTrie()
+        for owner, planned in enumerate(self.files):
+            if planned.mode == 'okpd':
+                for task in planned.tasks:
+                    trie.insert(task[0], owner)
+
+        for owner, planned in enumerate(self.files):
+            if planned.mode != 'okpd':
+                continue
+            tasks = [task for task in planned.tasks if owner not in trie.ancestor_owners(task[0])]
+            self.covered += len(planned.tasks) - len(tasks)
+            planned.tasks = tasks
+
+    def add_task(self, planned: PlannedFile, task):
+        self.requested += 1
+        identity = task_identity(planned.mode, task)
+        if (i := self._items_index.get(identity)) is None:
+            i = self._items_index[identity] = len(self.items)
+            self.items.append((planned.mode, task, None))
+            self.owners.append([])
+        if not any(owner is planned for owner in self.owners[i]):
+            self.owners[i].append(planned)
+            planned.pending += 1
+
+    def split(self, i, windows):
+        """
+        Replace the item by items of its date windows, files of the item wait for all of them
+        return: indexes of new items
+        """
+        mode, task, _ = self.items[i]
+        indexes = []
+        for date_window in windows:
+            indexes.append(len(self.items))
+            self.items.append((mode, task, date_window))
+            self.owners.append(self.owners[i])
+        for planned in self.owners[i]:
+            planned.pending += len(windows) - 1
+        return indexes
+
+    def task_done(self, i) -> List[PlannedFile]:
+        """return: files of the item which have no running tasks left"""
+        finished = []
+        for planned in self.owners[i]:
+            planned.pending -= 1
+            if planned.pending == 0:
+                finished.append(planned)
+        return finished
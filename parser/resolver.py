@@ -0,0 +1,130 @@
+import re
+import asyncio
+import logging
+from concurrent import futures
+from typing import List, Tuple
+from urllib.parse import urljoin
+
+import requests
+
+from .collector import CollectRes
+from .utils import get_pid, make_soup
+from . import metrics
+
+
+# redirect of the card page may be done by meta refresh or a script, then the target is taken from the page
+_META_REFRESH_URL_RE = re.compile(r"""url\s*=\s*['"]?([^'"\s;]+)""", re.IGNORECASE)
+_SCRIPT_LOCATION_RE = re.compile(r"""location(?:\.href)?\s*(?:=|\.replace\(|\.assign\()\s*['"]([^'"]+)['"]""")
+_NOTICEINFOID_RE = re.compile(r"noticeInfoId=(\d+)")
+_PFID_RE = re.compile(r"pfid=(\d+)")
+
+
+def _get(session, url, timeout, retries):
+    """
+    Bounded retries on connection errors and timeouts
+    return: response or None
+    """
+    for attempt in range(retries + 1):
+        try:
+            resp = session.get(url, timeout=timeout, allow_redirects=True)
+            resp.raise_for_status()
+            return resp
+        except requests.RequestException as e:
+            logging.warning(f'Process {get_pid()}: attempt {attempt + 1} of {url} failed: {e}')
+            if attempt < retries:
+                metrics.retry('num_info')
+    return None
+
+
+def redirect_target(html):
+    """
+    Target of a redirect the card page does itself: meta refresh or a script setting location.
+    Other links of the page (header, footer) are not followed
+    return: url or None
+    """
+    soup = make_soup(html)
+    for meta in soup.find_all('meta'):
+        if str(meta.get('http-equiv', '')).lower() == 'refresh':
+            if (target := _META_REFRESH_URL_RE.search(meta.get('content', ''))) is not None:
+                return target.group(1)
+    for script in soup.find_all('script'):
+        if (target := _SCRIPT_LOCATION_RE.search(script.get_text())) is not None:
+            return target.group(1).replace('&amp;', '&')
+    return None
+
+
+def parse_pfid(html):
+    """
+    Parses pfid of the notification from zakupki search results html
+    return: pfid as string or None
+    """
+    results = make_soup(html).find('div', {'class': 'search-results'})
+    if results is None:
+        return None
+    icon = results.find('div', {'class': 'registry-entry__header-top__icon'})
+    if icon is None:
+        return None
+    for tag in icon.find_all('a'):
+        pfid = _PFID_RE.search(tag.get('href', ''))
+        if pfid is not None:
+            return pfid.group(1)
+    return None
+
+
+def resolve_num_info(session, num_url, timeout=10, retries=2):
+    """
+    Browserless counterpart of collect_num_info. Redirects are followed without rendering
+    return: CollectRes
+    """
+    with metrics.timed('num_info', 1):
+        return _resolve_num_info(session, num_url, timeout, retries)
+
+
+def _resolve_num_info(session, num_url, timeout, retries):
+    notif_num, url = num_url
+
+    resp = _get(session, url, timeout, retries)
+    if resp is None:
+        print(f'Драйвер {get_pid()}: ссылка для извещения {notif_num} не открывается')
+        return CollectRes(notif_num)
+    if 'zakupki' not in resp.url:
+        target = redirect_target(resp.text)
+        if target is None or 'zakupki' not in (target := urljoin(resp.url, target)):
+            print(f'Драйвер {get_pid()}: ссылка для извещения {notif_num} не ведет на сайт закупок')
+            return CollectRes(notif_num)
+        resp = _get(session, target, timeout, retries)
+        if resp is None:
+            return CollectRes(notif_num)
+
+    url_noticeinfoid = _NOTICEINFOID_RE.search(resp.url)
+    if url_noticeinfoid is None:
+        print(f'Драйвер {get_pid()}: извещения {notif_num} нет на сайте закупок')
+        return CollectRes(notif_num)
+    noticeinfoid = url_noticeinfoid.group(1)
+
+    pfid = parse_pfid(resp.text)
+    if pfid is None:
+        logging.warning(f'Process {get_pid()}: pfid of {notif_num} not found at {resp.url}')
+        return CollectRes(notif_num, noticeinfoid)
+
+    return CollectRes(notif_num, noticeinfoid, pfid)
+
+
+async def _resolve_all(session, num_urls, concurrency, timeout, retries):
+    # own executor, default one is sized by cpu count and would cap concurrency
+    loop = asyncio.get_running_loop()
+    with futures.ThreadPoolExecutor(max_workers=concurrency) as executor:
+        return await asyncio.gather(*[
+            loop.run_in_executor(executor, resolve_num_info, session, num_url, timeout, retries)
+            for num_url in num_urls])
+
+
+def resolve_nums_info(session, num_urls: List[Tuple[str, str]], concurrency=10, timeout=10, retries=2):
+    """
+    Resolves many numbers concurrently. Connections are limited by the session pool
+    session: requests.Session
+    return: List[CollectRes] in input order
+    """
+    if not num_urls:
+        return []
+    return list(asyncio.run(_resolve_all(session, num_urls, concurrency, timeout, retries)))
@@ -0,0 +1,114 @@
+import json
+from pathlib import Path
+from typing import Dict, List, Optional
+
+
+WATERMARKS = None   # this variable is local to each subprocess
+_WATERMARKS_MTIME = None
+
+
+def make_tasks(input_data, mode, kw_policy=None):
+    """
+    Split input into independent searches. Keywords under 'all' policy have to be searched together
+    return: List[List[str]]
+    """
+    input_data = [line for line in input_data if line]
+    if not input_data:
+        return []
+    if mode == 'kw' and kw_policy == 'all':
+        return [input_data]
+    # same keyword or code listed twice is searched once
+    return [[line] for line in dict.fromkeys(input_data)]
+
+
+class TaskSizeHistory:
+    """
+    Number of results each task collected in previous runs. Used as a cheap size estimate
+    to start the heaviest tasks first
+    """
+    def __init__(self, path=None):
+        self.path = Path(path) if path is not None else None
+        self.sizes: Dict[str, int] = {}
+        if self.path is not None and self.path.is_file():
+            with open(self.path, encoding='utf-8') as f:
+                try:
+                    self.sizes = json.load(f)
+                except json.JSONDecodeError:
+                    pass
+
+    @staticmethod
+    def key(task, mode, fz):
+        return f'{mode}|{fz}|' + '|'.join(task)
+
+    def estimate(self, task, mode, fz):
+        return self.sizes.get(self.key(task, mode, fz))
+
+    def update(self, task, mode, fz, size):
+        self.sizes[self.key(task, mode, fz)] = size
+
+    def save(self):
+        if self.path is None:
+            return
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with open(self.path, 'w', encoding='utf-8') as f:
+            json.dump(self.sizes, f, ensure_ascii=False)
+
+
+def order_tasks(items, history, fz):
+    """
+    Longest first. Tasks never seen before go ahead of the known ones since they may be heavy
+    items: (mode, task, date window) of all files of the run
+    return: indexes of items in run order
+    """
+    def sort_key(i):
+        mode, task = items[i][:2]
+        estimate = history.estimate(task, mode, fz)
+        return (estimate is not None, -(estimate or 0))
+
+    return sorted(range(len(items)), key=sort_key)
+
+
+class QueryWatermarks:
+    """
+    Newest numbers each query found in the previous incremental run. Results sorted newest first
+    are paged until a whole page consists of these numbers
+    """
+    SIZE = 30   # a few pages, so a page straddling the previous top is still followed by a known one
+
+    def __init__(self, path=None):
+        self.path = Path(path) if path is not None else None
+        self.marks: Dict[str, List[str]] = {}
+        if self.path is not None and self.path.is_file():
+            with open(self.path, encoding='utf-8') as f:
+                try:
+                    self.marks = json.load(f)
+                except json.JSONDecodeError:
+                    pass
+
+    def get(self, task, mode, fz):
+        return set(self.marks.get(TaskSizeHistory.key(task, mode, fz), []))
+
+    def update(self, task, mode, fz, nums):
+        """nums: numbers collected in this run, newest first"""
+        key = TaskSizeHistory.key(task, mode, fz)
+        merged = dict.fromkeys(list(nums) + self.marks.get(key, []))
+        self.marks[key] = list(merged)[:self.SIZE]
+
+    def save(self):
+        if self.path is None:
+            return
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with open(self.path, 'w', encoding='utf-8') as f:
+            json.dump(self.marks, f, ensure_ascii=False)
+
+
+def load_watermarks(path) -> Optional[QueryWatermarks]:
+    """Load watermarks into subprocess global if they are not loaded yet or were saved again"""
+    global WATERMARKS, _WATERMARKS_MTIME
+    if path is None or not Path(path).is_file():
+        return None
+    mtime = Path(path).stat().st_mtime
+    if WATERMARKS is None or _WATERMARKS_MTIME != mtime:
+        WATERMARKS = QueryWatermarks(path)
+        _WATERMARKS_MTIME = mtime
+    return WATERMARKS
@@ -0,0 +1,180 @@
+import copy
+import threading
+import uuid
+from concurrent import futures
+from functools import partial
+from queue import SimpleQueue, Empty
+
+from selenium.webdriver.common.by import By
+from selenium.webdriver.remote.command import Command
+from selenium.webdriver.remote.switch_to import SwitchTo
+from selenium.webdriver.support import expected_conditions as EC
+from selenium.webdriver.support.wait import WebDriverWait
+from selenium.common.exceptions import WebDriverException
+
+from .waits import until
+from .utils import get_pid
+
+
+_TAB = threading.local()    # tab driven by the calling thread, local to each subprocess
+
+PAGE_LOAD_TIMEOUT = 60
+SCRIPT_TIMEOUT = 30     # async script timeout of a tab until it sets its own
+SCRIPT_POLL = 0.1
+
+# async script of a tab is started by a short command and its result is polled for,
+# its callback stores the result in the window under the key
+_ASYNC_START_SCRIPT = """
+var key = arguments[0], script = arguments[1], args = Array.prototype.slice.call(arguments, 2);
+window[key] = {done: false};
+args.push(function (res) { window[key] = {done: true, res: res}; });
+new Function(script).apply(null, args);
+"""
+_ASYNC_RESULT_SCRIPT = """
+var state = window[arguments[0]];
+if (!state || !state.done) return false;
+delete window[arguments[0]];
+return [state.res];
+"""
+
+
+class TabBrowser:
+    """
+    Browser shared by tab sessions. Commands of the tabs take turns under its lock, so a tab never
+    sends a command which blocks until the page does something: navigation, refresh and async scripts
+    return at once and are waited for by polling, see open_tab
+    """
+    def __init__(self, driver):
+        self.driver = driver
+        self.lock = threading.RLock()
+        self.active = driver.current_window_handle  # window the driver sends commands to
+
+
+def _tab_execute(tab, browser, driver_command, params=None):
+    with browser.lock:
+        if browser.active != tab.tab_handle:
+            type(tab).execute(browser.driver, Command.SWITCH_TO_WINDOW, {'handle': tab.tab_handle})
+            browser.active = tab.tab_handle
+        return type(tab).execute(tab, driver_command, params)
+
+
+def _wait_tab_load(tab, old_root):
+    until(tab, 'tab_navigation', PAGE_LOAD_TIMEOUT, EC.staleness_of(old_root))
+    until(tab, 'tab_page_load', PAGE_LOAD_TIMEOUT,
+          lambda tab: tab.execute_script("return document.readyState") == 'complete')
+
+
+def _tab_get(tab, url):
+    """Navigation returns at once and the load is waited for by polling, so other tabs are driven meanwhile"""
+    old_root = tab.find_element(By.TAG_NAME, 'html')
+    tab.execute_script("window.location.href = arguments[0];", url)
+    _wait_tab_load(tab, old_root)
+
+
+def _tab_refresh(tab):
+    """Reload returns at once like navigation, see _tab_get"""
+    old_root = tab.find_element(By.TAG_NAME, 'html')
+    tab.execute_script("window.location.reload();")
+    _wait_tab_load(tab, old_root)
+
+
+def _tab_set_script_timeout(tab, time_to_wait):
+    """Timeouts are shared by all windows of the browser, the tab keeps its own for async scripts"""
+    tab.script_timeout = time_to_wait
+
+
+def _tab_execute_async(tab, script, *args):
+    """
+    Async script returns at once and its result is polled for, so other tabs are driven meanwhile
+    return: value the script passed to its callback
+    """
+    key = f'_tab_script_{uuid.uuid4().hex}'
+    tab.execute_script(_ASYNC_START_SCRIPT, key, script, *args)
+    res = WebDriverWait(tab, tab.script_timeout, poll_frequency=SCRIPT_POLL).until(
+        lambda tab: tab.execute_script(_ASYNC_RESULT_SCRIPT, key))
+    return res[0]
+
+
+def open_tab(browser):
+    """
+    New tab session of the browser. It is a copy of the driver bound to its own window,
+    elements it finds and waits on it are bound to the window too
+    """
+    driver = browser.driver
+    with browser.lock:
+        driver.switch_to.new_window('tab')
+        browser.active = driver.current_window_handle
+
+    tab = copy.copy(driver)
+    tab.tab_handle = browser.active
+    tab.execute = partial(_tab_execute, tab, browser)
+    tab.get = partial(_tab_get, tab)
+    tab.refresh = partial(_tab_refresh, tab)
+    tab.script_timeout = SCRIPT_TIMEOUT
+    tab.set_script_timeout = partial(_tab_set_script_timeout, tab)
+    tab.execute_async_script = partial(_tab_execute_async, tab)
+    tab._switch_to = SwitchTo(tab)
+    return tab
+
+
+def close_tab(browser, tab):
+    with browser.lock:
+        try:
+            tab.close()
+        except WebDriverException:
+            pass
+        browser.active = None
+
+
+def current_tab():
+    """return: tab of the calling thread or None out of tab sessions"""
+    return getattr(_TAB, 'driver', None)
+
+
+def run_in_tabs(driver, job, tasks, tabs):
+    """
+    Run tasks concurrently in tabs of one browser, each tab is driven by its own thread.
+    Page loads and waits of the tabs overlap, the rest of their commands take turns on the driver
+    job: called with a task, takes its tab from current_tab()
+    return: results in task order
+    """
+    if not tasks:
+        return []
+    browser = TabBrowser(driver)
+    main_handle = browser.active
+    tab_sessions = [open_tab(browser) for _ in range(min(tabs, len(tasks)))]
+
+    todo = SimpleQueue()
+    for i, task in enumerate(tasks):
+        todo.put((i, task))
+    results = [None] * len(tasks)
+
+    def _drive(tab):
+        _TAB.driver = tab
+        try:
+            while True:
+                try:
+                    i, task = todo.get_nowait()
+                except Empty:
+                    return
+                try:
+                    results[i] = job(task)
+                except Exception:
+                    # run fails anyway, other tabs stop after their current task
+                    while not todo.empty():
+                        todo.get_nowait()
+                    raise
+        finally:
+            _TAB.driver = None
+
+    try:
+        with futures.ThreadPoolExecutor(max_workers=len(tab_sessions)) as executor:
+            for fut in [executor.submit(_drive, tab) for tab in tab_sessions]:
+                fut.result()
+    finally:
+        for tab in tab_sessions:
+            close_tab(browser, tab)
+        driver.switch_to.window(main_handle)
+    print(f'Драйвер {get_pid()}: {len(tasks)} задач выполнено в {len(tab_sessions)} вкладках')
+
+    return results
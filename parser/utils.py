@@ -1,16 +1,38 @@
-from math import floor
 import multiprocessing as mp
+from bs4 import BeautifulSoup
 
 
-def xpath_soup(element):
+HTML_PARSER = 'html.parser'   # this variable is local to each subprocess
+
+
+def set_html_parser(name):
+    """Switch bs4 parser backend. lxml is faster on large pages but optional"""
+    global HTML_PARSER
+    if name == 'lxml':
+        try:
+            import lxml
+        except ImportError:
+            print(f'Драйвер {get_pid()}: lxml не установлен, используется html.parser')
+            name = 'html.parser'
+    HTML_PARSER = name
+
+
+def make_soup(html):
+    return BeautifulSoup(html, HTML_PARSER)
+
+
+def xpath_soup(element, root=None):
     """
     Generate xpath of soup element
     :param element: bs4 text or node
+    :param root: optional ancestor node, xpath is then relative to it
     :return: xpath as string
     """
     components = []
     child = element if element.name else element.parent
     for parent in child.parents:  # type: bs4.element.Tag
+        if child is root:
+            break
         siblings = parent.find_all(child.name, recursive=False)
         components.append(
             child.name if 1 == len(siblings) else '%s[%d]' % (
@@ -20,6 +42,8 @@ def xpath_soup(element):
             )
         child = parent
     components.reverse()
+    if root is not None:
+        return './%s' % '/'.join(components) if components else '.'
     return '/%s' % '/'.join(components)
 
 
@@ -27,21 +51,6 @@ def native_click(el, driver):
     driver.execute_script("arguments[0].click();", el)
 
 
-def chunk_into_n(lst, n):
-    min_size = floor(len(lst) / n)
-    rem = len(lst) - min_size * n
-    result = []
-    prev_idx = 0
-    for _ in range(n):
-        next_idx = prev_idx + min_size
-        if rem > 0:
-            next_idx += 1
-            rem -= 1
-        result.append(lst[prev_idx:next_idx])
-        prev_idx = next_idx
-
-    return result
-
 def get_pid():
     proc = mp.current_process()
     return proc.pid
\ No newline at end of file
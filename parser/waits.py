@@ -0,0 +1,144 @@
+import os
+import sys
+import json
+import time
+from collections import deque
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Deque, Dict, List
+from urllib.parse import urlparse
+
+from selenium.webdriver.support.wait import WebDriverWait
+from selenium.common.exceptions import TimeoutException
+
+
+POLICY = None   # this variable is local to each subprocess
+
+# adaptive timeouts are short, so their waits poll more often than selenium default
+POLL_FREQUENCY = 0.1
+
+
+@contextmanager
+def _file_lock(lock_path):
+    """Exclusive lock of a file drivers of the run share, waits until it is free"""
+    with open(lock_path, 'a+') as f:
+        if sys.platform == 'win32':
+            import msvcrt
+            f.seek(0)
+            while True:
+                try:
+                    # retries for 10 seconds, then raises
+                    msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+                    break
+                except OSError:
+                    pass
+            try:
+                yield
+            finally:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+        else:
+            import fcntl
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+
+class WaitPolicy:
+    """
+    Timeouts of named waits learned from durations observed on the site by this driver.
+    Hard-coded timeout of a wait stays its ceiling, it is used until enough samples are collected.
+    A wait which timed out is recorded with its timeout, so frequent timeouts raise the next ones.
+    Durations of the site are kept between runs in one file, each driver merges its own into it
+    """
+    def __init__(self, site, path=None, window=200, percentile=95, factor=3.0, min_timeout=1.0, min_samples=20):
+        self.site = site
+        self.path = Path(path) / f'{site}.json' if path is not None else None
+        self.window = window
+        self.percentile = percentile
+        self.factor = factor
+        self.min_timeout = min_timeout
+        self.min_samples = min_samples
+        self.durations: Dict[str, Deque[float]] = {}
+        self.observed: Dict[str, List[float]] = {}  # durations observed by this driver since the last save
+
+        for name, durations in self._load().items():
+            self.durations[name] = deque(durations, maxlen=window)
+
+    def _load(self):
+        if self.path is None or not self.path.is_file():
+            return {}
+        with open(self.path, encoding='utf-8') as f:
+            try:
+                return json.load(f)
+            except json.JSONDecodeError:
+                return {}
+
+    def record(self, name, seconds):
+        self.durations.setdefault(name, deque(maxlen=self.window)).append(seconds)
+        self.observed.setdefault(name, []).append(seconds)
+
+    def quantile(self, name):
+        durations = sorted(self.durations.get(name, []))
+        if len(durations) < self.min_samples:
+            return None
+        return durations[min(len(durations) - 1, int(len(durations) * self.percentile / 100))]
+
+    def timeout(self, name, default):
+        quantile = self.quantile(name)
+        if quantile is None:
+            return default
+        return min(default, max(self.min_timeout, quantile * self.factor))
+
+    def until(self, target, name, default, condition):
+        timeout = self.timeout(name, default)
+        started = time.perf_counter()
+        try:
+            res = WebDriverWait(target, timeout, poll_frequency=POLL_FREQUENCY).until(condition)
+        except TimeoutException:
+            self.record(name, timeout)
+            raise
+        self.record(name, time.perf_counter() - started)
+        return res
+
+    def save(self):
+        """
+        Append durations this driver observed to the ones saved by other drivers meanwhile,
+        the file keeps the latest window of each wait
+        """
+        if self.path is None or not self.observed:
+            return
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with _file_lock(self.path.with_suffix('.lock')):
+            saved = self._load()
+            for name, durations in self.observed.items():
+                saved[name] = list(deque(saved.get(name, []) + durations, maxlen=self.window))
+            tmp_path = self.path.with_suffix(f'.{os.getpid()}.tmp')
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(saved, f)
+            tmp_path.replace(self.path)
+        self.observed = {}
+
+
+def init_policy(website_url, path=None, **kwargs):
+    """Create subprocess wait policy for the site"""
+    global POLICY
+    POLICY = WaitPolicy(urlparse(website_url).netloc or website_url, path, **kwargs)
+    return POLICY
+
+
+def save_policy():
+    if POLICY is not None:
+        POLICY.save()
+
+
+def until(target, name, default, condition):
+    """
+    WebDriverWait(target, default).until(condition) with the timeout of the named wait
+    taken from subprocess wait policy if it was created
+    """
+    if POLICY is None:
+        return WebDriverWait(target, default).until(condition)
+    return POLICY.until(target, name, default, condition)
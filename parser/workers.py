@@ -0,0 +1,90 @@
+from multiprocessing.util import Finalize
+import os
+import signal
+
+try:
+    import psutil
+except ImportError:     # browsers left by terminated subprocesses are not killed without it
+    psutil = None
+
+from .driver import init_driver, quit_driver
+from .http_engine import init_session, close_session
+
+
+ENRICH_QUEUE = None     # this variable is local to each subprocess
+
+
+def init_worker(driver_kwds=None, session_kwds=None, enrich_queue=None):
+    """
+    Pool initializer. Binds exactly one driver and/or http session to the subprocess for its lifetime,
+    they are closed by finalizers when the subprocess exits after pool is closed.
+    A subprocess the pool restarts in place of a dead one gets its own driver the same way
+    enrich_queue: queue collected pages are streamed to, it can only be passed to subprocesses on start
+    """
+    global ENRICH_QUEUE
+    ENRICH_QUEUE = enrich_queue
+    if enrich_queue is not None:
+        # pages left unread are also submitted when their file finishes, subprocess does not wait on them at exit
+        enrich_queue.cancel_join_thread()
+
+    if session_kwds is not None:
+        init_session(**session_kwds)
+        Finalize(None, close_session, exitpriority=10)
+    if driver_kwds is not None:
+        Finalize(None, quit_driver, exitpriority=10)
+        # failed run terminates the pool, finalizers do not run then
+        signal.signal(signal.SIGTERM, _on_terminate)
+        try:
+            init_driver(**driver_kwds)
+        except Exception as e:
+            # failing initializer makes the pool restart subprocesses endlessly, the driver
+            # is started again by the health check of the first task instead
+            print(f'Драйвер не запустился: {e}')
+
+
+def _on_terminate(signum, frame):
+    quit_driver()
+    close_session()
+    os._exit(0)
+
+
+def pool_browsers(pool):
+    """
+    Processes started by subprocesses of the pool: chromedriver and its browser.
+    Windows can't handle termination in the subprocess, they are killed after it instead
+    return: List[psutil.Process], empty without psutil
+    """
+    if psutil is None:
+        return []
+    browsers = []
+    for worker in pool._pool:
+        try:
+            browsers.extend(psutil.Process(worker.pid).children(recursive=True))
+        except psutil.Error:
+            pass
+    return browsers
+
+
+def kill_processes(procs):
+    for proc in procs:
+        try:
+            proc.kill()
+        except psutil.Error:
+            pass
+
+
+def pack_collected(collected):
+    """
+    Compact form of (number, url) a task collected for transport to the main process.
+    Duplicates are dropped and pairs are sent as two strings instead of many small tuples
+    """
+    collected = dict.fromkeys(collected)
+    return '\n'.join(num_url[0] for num_url in collected), '\n'.join(num_url[1] for num_url in collected)
+
+
+def unpack_collected(packed):
+    """return: List[Tuple[str, str]] of (number, url)"""
+    nums, urls = packed
+    if not nums:
+        return []
+    return list(zip(nums.split('\n'), urls.split('\n')))
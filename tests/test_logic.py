@@ -0,0 +1,164 @@
+from datetime import date
+
+import pytest
+
+from db.backends import DedupBackend, MemoryBackend
+from db.connection import DBConnection
+from parser.collector import CollectRes
+from parser.journal import RunJournal, task_key
+from parser.output import OutputWriter
+from parser.planner import RunPlan, PlannedFile, split_window
+
+
+def num44(i):
+    return f'{i:019d}'
+
+
+class CountingBackend(MemoryBackend):
+    """Memory backend which remembers the numbers it was asked about"""
+    def __init__(self):
+        super().__init__()
+        self.asked = []
+
+    def unknown_numbers(self, nums, fz):
+        self.asked.extend(nums)
+        return super().unknown_numbers(nums, fz)
+
+
+def test_backend_is_abstract():
+    with pytest.raises(TypeError):
+        DedupBackend()
+
+
+def test_get_new_numbers_44():
+    backend = MemoryBackend()
+    backend.add([num44(2)], '44')
+    db_conn = DBConnection(backend)
+
+    assert db_conn.get_new_numbers([num44(3), num44(2), num44(1), num44(3)], '44') == [num44(3), num44(1)]
+    assert db_conn.get_new_numbers([], '44') == []
+
+
+def test_get_new_numbers_223():
+    backend = MemoryBackend()
+    backend.add(['31000000002'], '223')
+    db_conn = DBConnection(backend)
+    collected = [CollectRes('31000000001', '1', '10'), CollectRes('31000000002', '2', '20')]
+
+    assert db_conn.get_new_numbers(collected, '223') == collected[:1]
+
+
+def _read(path):
+    return path.read_text().split() if path.is_file() else []
+
+
+def test_output_skips_numbers_of_other_files(tmp_path):
+    writer = OutputWriter(tmp_path / 'seen.sqlite', DBConnection(MemoryBackend()), '44')
+    a, b = tmp_path / 'a.txt', tmp_path / 'b.txt'
+    writer.open_file(a)
+    writer.open_file(b)
+
+    writer.write(a, [num44(1), num44(2)])
+    writer.flush(a)
+    writer.write(b, [num44(2), num44(3)])
+    writer.close()
+
+    assert _read(a) == [num44(1), num44(2)]
+    assert _read(b) == [num44(3)]
+
+
+def test_output_writes_shared_search_to_every_file(tmp_path):
+    backend = CountingBackend()
+    backend.add([num44(2)], '44')
+    writer = OutputWriter(tmp_path / 'seen.sqlite', DBConnection(backend), '44')
+    a, b = tmp_path / 'a.txt', tmp_path / 'b.txt'
+    writer.open_file(a)
+    writer.open_file(b)
+
+    shared = [num44(1), num44(2)]
+    writer.write(a, shared, shared)
+    writer.flush(a)
+    writer.write(b, shared, shared)
+    writer.close()
+
+    assert _read(a) == [num44(1)]
+    assert _read(b) == [num44(1)]
+    # database is asked about the shared numbers once
+    assert sorted(backend.asked) == shared
+
+
+def test_drop_covered_codes():
+    plan = RunPlan()
+    parent = PlannedFile('a', 'a_out', 'okpd', [['01'], ['01.1'], ['02']])
+    child = PlannedFile('b', 'b_out', 'okpd', [['01.1']])
+    plan.add_file(parent)
+    plan.add_file(child)
+
+    plan.drop_covered_codes()
+
+    assert parent.tasks == [['01'], ['02']]
+    assert child.tasks == [['01.1']]
+    assert plan.covered == 1
+
+
+def test_repeated_task_runs_once():
+    plan = RunPlan()
+    a = PlannedFile('a', 'a_out', 'kw', [['Труба']])
+    b = PlannedFile('b', 'b_out', 'kw', [['труба ']])
+    for planned in (a, b):
+        plan.add_file(planned)
+        for task in planned.tasks:
+            plan.add_task(planned, task)
+
+    assert len(plan.items) == 1
+    assert plan.owners[0] == [a, b]
+    assert plan.task_done(0) == [a, b]
+
+
+def test_split_waits_for_all_windows():
+    plan = RunPlan()
+    planned = PlannedFile('a', 'a_out', 'kw', [['труба']])
+    plan.add_file(planned)
+    plan.add_task(planned, planned.tasks[0])
+    windows = [(date(2026, 10, 6), date(2026, 10, 10)), (date(2026, 10, 1), date(2026, 10, 5))]
+
+    indexes = plan.split(0, windows)
+
+    assert [plan.items[i][2] for i in indexes] == windows
+    assert plan.task_done(indexes[0]) == []
+    assert plan.task_done(indexes[1]) == [planned]
+
+
+def test_split_window():
+    windows = split_window((date(2026, 10, 1), date(2026, 10, 10)), 120, 50)
+
+    assert len(windows) == 3
+    # newest first, days are covered once
+    assert windows[0][1] == date(2026, 10, 10) and windows[-1][0] == date(2026, 10, 1)
+    for newer, older in zip(windows, windows[1:]):
+        assert (newer[0] - older[1]).days == 1
+    assert split_window((date(2026, 10, 1), date(2026, 10, 1)), 120, 50) is None
+
+
+def test_journal_resume(tmp_path):
+    window = (date(2026, 10, 1), date(2026, 10, 8))
+    key = task_key(['труба'], 'kw', '44', window)
+    journal = RunJournal.create(tmp_path)
+    journal.set_meta(fz='44', mode=None, window=[day.isoformat() for day in window])
+    journal.start_file('in.txt', 'out.txt')
+    journal.task_done(key, [(num44(1), 'url')])
+    journal.finish_file('in.txt')
+
+    resumed = RunJournal.latest(tmp_path, fz='44', mode=None)
+
+    assert resumed.run_dir == journal.run_dir
+    assert resumed.date_window() == window
+    assert resumed.is_file_done('in.txt')
+    assert resumed.file_output('in.txt') == 'out.txt'
+    assert resumed.task_result(key) == [(num44(1), 'url')]
+    assert resumed.task_result(task_key(['труба'], 'kw', '44', (date(2026, 10, 2), date(2026, 10, 9)))) is None
+    # journal of another law is not resumed
+    assert RunJournal.latest(tmp_path, fz='223', mode=None) is None
+
+    resumed.complete()
+    assert RunJournal.latest(tmp_path, fz='44', mode=None) is None